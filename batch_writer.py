@@ -0,0 +1,300 @@
+import asyncio
+import atexit
+import queue
+import threading
+import time
+
+
+def _remaining(deadline):
+    """Seconds left until a time.monotonic() deadline (None: no deadline)"""
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+class BatchWriter:
+    """
+    Buffers rows in a bounded in-memory queue and drains them to ClickHouse
+    (`client` may be any sink with the client's insert(), see sinks.py)
+    from a background thread as columnar batches.
+    A batch is flushed when it reaches `max_batch_size` rows or when
+    `flush_interval` seconds have passed since its first row, whichever comes first.
+    """
+
+    def __init__(self, client, table, column_names, max_batch_size=500,
+                 flush_interval=1.0, max_queue_size=10000, block_on_full=False,
+                 put_timeout=0.05):
+        self.client = client
+        self.table = table
+        self.column_names = list(column_names)
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        # block_on_full=True applies backpressure (waits up to put_timeout),
+        # otherwise rows are dropped immediately and counted.
+        self.block_on_full = block_on_full
+        self.put_timeout = put_timeout
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+
+        self._thread = threading.Thread(target=self._run, name=f"batch-writer-{table}", daemon=True)
+        self._thread.start()
+        # Flush whatever is still buffered when the interpreter exits
+        atexit.register(self.close)
+
+    # --- PRODUCER SIDE (agent thread) ---
+
+    def put(self, row):
+        """Enqueue one row. Never raises; returns False if the row was dropped."""
+        if self._closed:
+            self._count_drop()
+            return False
+        try:
+            if self.block_on_full:
+                self._queue.put(row, timeout=self.put_timeout)
+            else:
+                self._queue.put_nowait(row)
+            return True
+        except queue.Full:
+            self._count_drop()
+            return False
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every row enqueued before this call has been written, or `timeout`
+        seconds pass. Returns False on timeout.
+        """
+        if not self._thread.is_alive():
+            return False
+        done = threading.Event()
+        started = time.monotonic()
+        # Waits for room rather than dropping the marker, but within the same timeout:
+        # a full queue behind a stuck insert must not hang the caller
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(None if timeout is None else max(0.0, timeout - (time.monotonic() - started)))
+
+    def close(self, timeout=5.0):
+        """Flushes remaining rows and stops the worker. Safe to call twice."""
+        if self._closed:
+            return
+        self.flush(timeout)
+        self._closed = True
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass  # Worker stuck on an insert; it is a daemon thread, so exit anyway
+        self._thread.join(timeout)
+        atexit.unregister(self.close)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+    def _count_drop(self):
+        with self._lock:
+            self.dropped += 1
+
+    # --- CONSUMER SIDE (background thread) ---
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ...  # Interval elapsed
+
+            if item is ... or isinstance(item, threading.Event) or item is None:
+                self._write(batch)
+                batch, deadline = [], None
+                if isinstance(item, threading.Event):
+                    item.set()
+                elif item is None:
+                    return
+                continue
+
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            if len(batch) >= self.max_batch_size:
+                self._write(batch)
+                batch, deadline = [], None
+
+    def _write(self, rows):
+        """Pushes one columnar insert. Failures are counted, never raised to the agent."""
+        if not rows:
+            return
+        columns = [list(col) for col in zip(*rows)]
+        try:
+            self.client.insert(self.table, columns, column_names=self.column_names,
+                               column_oriented=True)
+            self.written += len(rows)
+        except Exception as e:
+            self.failed += len(rows)
+            print(f"BatchWriter Error ({self.table}): {e}")
+
+
+class AsyncBatchWriter:
+    """
+    asyncio counterpart of BatchWriter for callbacks that run on the event loop.
+    put() is a plain non-blocking call; a drain task on the loop batches rows the same
+    way (max_batch_size / flush_interval) and runs each insert in a worker thread, so
+    the loop never waits on ClickHouse. `get_client` is called in that thread too,
+    which keeps connection and schema setup off the loop as well.
+
+    The drain task belongs to `loop` (by default the loop of the first put()): await
+    close() (or flush()) before that loop exits, or buffered rows are lost. Rows put from
+    another thread (a sync tool running in an executor, or a callback LangChain runs on a
+    short-lived loop of its own) are handed over to that loop.
+    """
+
+    def __init__(self, get_client, table, column_names, max_batch_size=500,
+                 flush_interval=1.0, max_queue_size=10000, loop=None):
+        self._get_client = get_client
+        self.table = table
+        self.column_names = list(column_names)
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self._queue = asyncio.Queue(maxsize=max_queue_size)
+        self._task = None
+        self._loop = loop
+        # put() also runs on foreign threads (before handing the row over), so drops are counted under a lock
+        self._lock = threading.Lock()
+        self._closed = False
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+
+    # --- PRODUCER SIDE (callbacks on the loop) ---
+
+    def put(self, row):
+        """Enqueue one row. Never blocks or raises; returns False if the row was dropped."""
+        if self._closed:
+            self._count_drop()
+            return False
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if self._loop is None:
+            if running is None:
+                # No loop bound yet and none here to drain on
+                self._count_drop()
+                return False
+            self._loop = running
+        if running is not self._loop:
+            # asyncio.Queue isn't thread-safe
+            try:
+                self._loop.call_soon_threadsafe(self.put, row)
+                return True
+            except RuntimeError:  # The loop is closed
+                self._count_drop()
+                return False
+        if self._task is None:
+            self._task = self._loop.create_task(self._run())
+        try:
+            self._queue.put_nowait(row)
+            return True
+        except asyncio.QueueFull:
+            self._count_drop()
+            return False
+
+    async def flush(self, timeout=None):
+        """
+        Waits until every row enqueued before this call has been written, or `timeout`
+        seconds pass. Returns False on timeout.
+        """
+        if self._task is None or self._task.done():
+            return self._task is None
+        done = asyncio.Event()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            # Waits for room rather than dropping the marker, but within the same timeout:
+            # a full queue behind a stuck insert must not hang the caller
+            await asyncio.wait_for(self._queue.put(done), _remaining(deadline))
+            await asyncio.wait_for(done.wait(), _remaining(deadline))
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def close(self, timeout=5.0):
+        """Flushes remaining rows and stops the drain task. Safe to call twice."""
+        if self._closed:
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        await self.flush(_remaining(deadline))
+        self._closed = True
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._queue.put(None), _remaining(deadline))
+                await asyncio.wait_for(self._task, _remaining(deadline))
+            except asyncio.TimeoutError:
+                # Drain task stuck on an insert: stop it so the loop can exit
+                self._task.cancel()
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+    def _count_drop(self):
+        with self._lock:
+            self.dropped += 1
+
+    # --- CONSUMER SIDE (drain task) ---
+
+    async def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                item = ...  # Interval elapsed
+
+            if item is ... or isinstance(item, asyncio.Event) or item is None:
+                await self._write(batch)
+                batch, deadline = [], None
+                if isinstance(item, asyncio.Event):
+                    item.set()
+                elif item is None:
+                    return
+                continue
+
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            if len(batch) >= self.max_batch_size:
+                await self._write(batch)
+                batch, deadline = [], None
+
+    def _insert(self, columns):
+        self._get_client().insert(self.table, columns, column_names=self.column_names,
+                                  column_oriented=True)
+
+    async def _write(self, rows):
+        """One columnar insert in a worker thread. Failures are counted, never raised."""
+        if not rows:
+            return
+        columns = [list(col) for col in zip(*rows)]
+        try:
+            await asyncio.to_thread(self._insert, columns)
+            self.written += len(rows)
+        except Exception as e:
+            self.failed += len(rows)
+            print(f"AsyncBatchWriter Error ({self.table}): {e}")
@@ -0,0 +1,358 @@
+import argparse
+import contextlib
+import datetime
+import itertools
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from collections import defaultdict
+import numpy as np
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+from langchain_core.tools import tool
+from batch_writer import BatchWriter
+from clickhouse_callback import ClickHouseLogger, TraceRecorder
+from clickhouse_db import TRACE_COLUMNS
+from dre import Evaluator, GOLD_STANDARD_PATH, JUDGE_CONCURRENCY
+from eval_sink import EvalSink
+from fake_llm import FakeToolChatModel
+from gold_standard import load_gold_standard
+from judge import JUDGE_METRICS
+from my_agent import TASKS, build_agent, build_inputs
+
+# --- CONFIGURATION ---
+BENCH_BASELINE_PATH = os.environ.get("BENCH_BASELINE_PATH", "bench_baseline.json")
+# Relative change that counts as a regression when comparing against the baseline
+BENCH_TOLERANCE = float(os.environ.get("BENCH_TOLERANCE", "0.10"))
+# Only costs (lower is better) and rates are compared; plain counts are informational
+LOWER_IS_BETTER = ("_ns", "_us", "_ms", "_mb")
+HIGHER_IS_BETTER = ("_per_sec",)
+
+BENCHES = ["callbacks", "inserts", "agent", "eval"]
+
+
+# --- LOCAL STAND-INS ---
+
+class LocalClient:
+    """
+    Stand-in for the ClickHouse client (only insert() is used by the writers).
+    Rows are kept in memory, or appended as JSON lines to `path`.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.tables = defaultdict(list)
+        self.rows = 0
+        self.inserts = 0
+        self._lock = threading.Lock()
+
+    def insert(self, table, data, column_names=None, column_oriented=False, settings=None):
+        rows = list(zip(*data)) if column_oriented else data
+        with self._lock:
+            if self.path:
+                with open(self.path, "a") as f:
+                    for row in rows:
+                        f.write(json.dumps(dict(zip(column_names, row)), default=str) + "\n")
+            else:
+                self.tables[table].extend(rows)
+            self.rows += len(rows)
+            self.inserts += 1
+
+
+class HashEncoder:
+    """Deterministic stand-in for SentenceTransformer: normalized bag of hashed words"""
+
+    dim = 384
+
+    def encode(self, texts, batch_size=64, normalize_embeddings=True, convert_to_numpy=True):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[i, zlib.crc32(word.encode()) % self.dim] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+
+class OfflineEvaluator(Evaluator):
+    """Evaluator with ClickHouse, the embedding model and the Groq judge swapped for local fakes"""
+
+    def __init__(self, client, judge_latency=0.05, **kwargs):
+        super().__init__(**kwargs)
+        self._ch_client = client
+        self.sink = EvalSink(lambda: client)
+        self.judge_latency = judge_latency
+        self.judge_requests = 0
+        self._lock = threading.Lock()
+
+    def _load_embed_model(self):
+        return HashEncoder()
+
+    def already_graded(self, session_ids):
+        return set()
+
+    def failure_counts(self, session_ids):
+        return {}
+
+    def record_failures(self, errors):
+        return set()
+
+    def save_watermark(self, watermark):
+        pass
+
+    def judge_batch(self, batch):
+        # One fake request per packed batch, like the combined judge
+        if self.judge_latency:
+            time.sleep(self.judge_latency)
+        with self._lock:
+            self.judge_requests += 1
+        return {sess[0]: {metric: (1.0, "fake judge") for metric in JUDGE_METRICS} for sess in batch}
+
+
+def make_fake_tools(latency=0.0):
+    """Same names and signatures as my_agent's tools, without the prints"""
+
+    @tool
+    def get_weather(city: str):
+        """Retrieves current weather data for a specific city."""
+        if latency:
+            time.sleep(latency)
+        return "75 F, Sunny" if "dallas" in city.lower() else "Unknown location"
+
+    @tool
+    def get_time(timezone: str):
+        """Retrieves current time for a timezone."""
+        if latency:
+            time.sleep(latency)
+        return f"The current time in {timezone} is 12:00:00"
+
+    @tool
+    def multiply(a: int, b: int):
+        """Multiplies two integers."""
+        if latency:
+            time.sleep(latency)
+        return str(a * b)
+
+    return [get_weather, get_time, multiply]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# --- BENCHMARKS ---
+
+def bench_callbacks(make_client, events=20000):
+    """Average cost of each logger hook, i.e. what telemetry adds to every agent event"""
+    writer = BatchWriter(make_client(), 'agent_traces', TRACE_COLUMNS, max_queue_size=0)
+    recorder = TraceRecorder("sess_bench", writer)
+    parent = uuid.uuid4()
+    run_ids = [uuid.uuid4() for _ in range(events)]
+    result = LLMResult(
+        generations=[[ChatGeneration(message=AIMessage(
+            content="The answer is 100.",
+            usage_metadata={"input_tokens": 120, "output_tokens": 8, "total_tokens": 128}))]],
+        llm_output={"model_name": "openai/gpt-oss-120b"},
+    )
+    hooks = [
+        ("on_chain_start", lambda r: recorder.on_chain_start({"name": "agent"}, {"messages": []},
+                                                             run_id=r, parent_run_id=parent)),
+        ("on_chain_end", lambda r: recorder.on_chain_end({"messages": []}, run_id=r, parent_run_id=parent)),
+        ("on_llm_start", lambda r: recorder.on_llm_start({"name": "ChatGroq"}, ["prompt"], run_id=r,
+                                                         parent_run_id=parent,
+                                                         invocation_params={"model_name": "openai/gpt-oss-120b"})),
+        ("on_llm_new_token", lambda r: recorder.on_llm_new_token("tok", run_id=r, parent_run_id=parent)),
+        ("on_llm_end", lambda r: recorder.on_llm_end(result, run_id=r, parent_run_id=parent)),
+        ("on_tool_start", lambda r: recorder.on_tool_start({"name": "multiply"}, "{'a': 25, 'b': 4}",
+                                                           run_id=r, parent_run_id=parent)),
+        ("on_tool_end", lambda r: recorder.on_tool_end("100", run_id=r, parent_run_id=parent)),
+    ]
+    results = {}
+    for name, hook in hooks:
+        started = time.perf_counter_ns()
+        for run_id in run_ids:
+            hook(run_id)
+        results[f"{name}_ns"] = (time.perf_counter_ns() - started) / events
+    writer.close()
+    return results
+
+
+def bench_inserts(make_client, rows=200000, eval_rows=50000):
+    """Rows/sec through the trace BatchWriter and the EvalSink into the local sink"""
+    client = make_client()
+    writer = BatchWriter(client, 'agent_traces', TRACE_COLUMNS, max_queue_size=0)
+    row = [datetime.datetime.now(), "sess_bench", "tool_end", "100", "multiply", 3, "", "",
+           0, 0, 0, 0.0, "", 0.0]
+    started = time.perf_counter()
+    for _ in range(rows):
+        writer.put(row)
+    put_seconds = time.perf_counter() - started
+    writer.flush()
+    trace_seconds = time.perf_counter() - started
+    writer.close()
+
+    sink = EvalSink(lambda: client)
+    started = time.perf_counter()
+    for i in range(eval_rows):
+        sink.add(f"sess_{i:08d}", "faithfulness", 1.0, "Auto-graded")
+    sink.flush()
+    eval_seconds = time.perf_counter() - started
+    return {
+        "trace_put_ns": put_seconds / rows * 1e9,
+        "trace_rows_per_sec": rows / trace_seconds,
+        "eval_rows_per_sec": eval_rows / eval_seconds,
+        "inserts": client.inserts,
+    }
+
+
+def bench_agent(make_client, sessions=200, llm_latency=0.0, tool_latency=0.0):
+    """Agent sessions/sec with the fake model and tools, with and without telemetry"""
+    graph = build_agent(FakeToolChatModel(latency=llm_latency), make_fake_tools(tool_latency))
+    questions = list(itertools.islice(itertools.cycle(TASKS), sessions))
+
+    def run(telemetry):
+        client = make_client()
+        writer = BatchWriter(client, 'agent_traces', TRACE_COLUMNS, max_queue_size=0)
+        started = time.perf_counter()
+        for question in questions:
+            callbacks = [ClickHouseLogger(f"sess_{uuid.uuid4().hex[:8]}", writer=writer)] if telemetry else []
+            graph.invoke(build_inputs(question), config={"callbacks": callbacks})
+        seconds = time.perf_counter() - started
+        writer.close()
+        return seconds, client.rows
+
+    run(False) # Warm-up: graph compilation, imports, caches
+    plain, _ = run(False)
+    traced, events = run(True)
+    overhead = traced - plain
+    return {
+        "sessions_per_sec": sessions / traced,
+        "sessions_per_sec_no_telemetry": sessions / plain,
+        "events_per_session": events / sessions,
+        "overhead_per_session_ms": overhead / sessions * 1000,
+        "overhead_per_event_us": overhead / events * 1e6 if events else 0.0,
+    }
+
+
+def bench_eval(make_client, sessions=1000, page_size=200, judge_latency=0.05, concurrency=JUDGE_CONCURRENCY):
+    """dre.py grading throughput: process_page() over synthetic sessions with a fake judge"""
+    client = make_client()
+    evaluator = OfflineEvaluator(client, judge_latency=judge_latency, page_size=page_size,
+                                 concurrency=concurrency, gold_standard_path=GOLD_STANDARD_PATH)
+    gold = load_gold_standard(GOLD_STANDARD_PATH)
+    questions = list(itertools.islice(itertools.cycle(list(gold) + TASKS), sessions))
+    rows = [(f"sess_{i:08d}", q, f"Answer {i}: {gold.get(q, 'Unknown')}", "tool output | 100",
+             1_700_000_000_000 + i) for i, q in enumerate(questions)]
+
+    watermark = (0, "")
+    started = time.perf_counter()
+    # The per-session progress prints are part of dre's cost but would flood the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for start in range(0, len(rows), page_size):
+            watermark, _, _ = evaluator.process_page(rows[start:start + page_size], watermark)
+    seconds = time.perf_counter() - started
+    return {
+        "sessions_per_sec": sessions / seconds,
+        "judge_requests": evaluator.judge_requests,
+        "score_rows": client.rows,
+    }
+
+
+# --- BASELINE ---
+
+def compare(results, baseline, tolerance=BENCH_TOLERANCE):
+    """Prints every metric against the baseline; returns the regressed ones"""
+    regressions = []
+    print(f"\n--- 📏 Against baseline (tolerance {tolerance:.0%}) ---")
+    if baseline.get("meta", {}).get("sink") != results["meta"]["sink"]:
+        print(f"⚠️ Baseline used the {baseline.get('meta', {}).get('sink')} sink; numbers aren't comparable")
+    for bench, metrics in results.items():
+        if bench == "meta":
+            continue
+        for name, value in metrics.items():
+            old = baseline.get(bench, {}).get(name)
+            if not old or not name.endswith(LOWER_IS_BETTER + HIGHER_IS_BETTER):
+                continue
+            change = (value - old) / abs(old)
+            worse = change > tolerance if name.endswith(LOWER_IS_BETTER) else change < -tolerance
+            flag = " ⚠️ REGRESSION" if worse else ""
+            print(f"{bench}.{name}: {old:.4g} -> {value:.4g} ({change:+.1%}){flag}")
+            if worse:
+                regressions.append(f"{bench}.{name}")
+    return regressions
+
+
+# --- CLI ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for telemetry and evaluation hot paths.")
+    parser.add_argument("benches", nargs="*", metavar="BENCH",
+                        help=f"which benchmarks to run (default: all of {', '.join(BENCHES)})")
+    parser.add_argument("--sink", choices=["memory", "file"], default="memory",
+                        help="where telemetry/score rows go instead of ClickHouse")
+    parser.add_argument("--events", type=int, default=20000, help="callbacks: calls per hook")
+    parser.add_argument("--rows", type=int, default=200000, help="inserts: trace rows")
+    parser.add_argument("--sessions", type=int, default=200, help="agent: sessions per pass")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="agent: seconds per fake LLM call")
+    parser.add_argument("--tool-latency", type=float, default=0.0, help="agent: seconds per fake tool call")
+    parser.add_argument("--eval-sessions", type=int, default=1000, help="eval: sessions to grade")
+    parser.add_argument("--judge-latency", type=float, default=0.05, help="eval: seconds per fake judge request")
+    parser.add_argument("--concurrency", type=int, default=JUDGE_CONCURRENCY, help="eval: parallel judge workers")
+    parser.add_argument("--baseline", default=BENCH_BASELINE_PATH, help="baseline results file")
+    parser.add_argument("--save-baseline", action="store_true", help="write these results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="compare against the baseline; exit 1 on regression")
+    args = parser.parse_args(argv)
+    unknown = set(args.benches) - set(BENCHES)
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+
+    sink_dir = tempfile.mkdtemp(prefix="bench_sink_") if args.sink == "file" else None
+    def make_client():
+        return LocalClient(os.path.join(sink_dir, f"{uuid.uuid4().hex}.jsonl") if sink_dir else None)
+
+    runs = {
+        "callbacks": lambda: bench_callbacks(make_client, args.events),
+        "inserts": lambda: bench_inserts(make_client, args.rows),
+        "agent": lambda: bench_agent(make_client, args.sessions, args.llm_latency, args.tool_latency),
+        "eval": lambda: bench_eval(make_client, args.eval_sessions, judge_latency=args.judge_latency,
+                                   concurrency=args.concurrency),
+    }
+    results = {"meta": {"python": platform.python_version(), "sink": args.sink,
+                        "at": datetime.datetime.now().isoformat(timespec="seconds")}}
+    for name in args.benches or BENCHES:
+        print(f"⏳ Running {name} benchmark...")
+        results[name] = runs[name]()
+        # Process-wide high-water mark, so benches are run lightest first
+        results[name]["peak_rss_mb"] = peak_rss_mb()
+        for metric, value in results[name].items():
+            print(f"   {metric}: {value:,.2f}")
+
+    if sink_dir:
+        for file_name in os.listdir(sink_dir):
+            os.remove(os.path.join(sink_dir, file_name))
+        os.rmdir(sink_dir)
+
+    status = 0
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"❌ No baseline at {args.baseline}; run with --save-baseline first")
+            return 1
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f))
+        print(f"\n{'⚠️ ' + str(len(regressions)) + ' regression(s)' if regressions else '✅ No regressions'}")
+        status = 1 if regressions else 0
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Baseline saved to {args.baseline}")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
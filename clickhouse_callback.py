@@ -1,82 +1,396 @@
-import clickhouse_connect
 import datetime
+import functools
+import json
+import time
 import uuid
-from langchain_core.callbacks import BaseCallbackHandler
+from uuid import UUID
+from langchain_core.callbacks import AsyncCallbackHandler, BaseCallbackHandler
 from langchain_core.outputs import LLMResult
-from typing import Dict, Any, List
-import os
-from dotenv import load_dotenv, find_dotenv
-
-load_dotenv(find_dotenv())
-# --- CONFIGURATION ---
-CLICKHOUSE_HOST = os.environ.get("CLICKHOUSE_HOST")
-CLICKHOUSE_PORT = int(os.environ.get("CLICKHOUSE_PORT"))
-CLICKHOUSE_USER = os.environ.get("CLICKHOUSE_USER")
-CLICKHOUSE_PASSWORD = os.environ.get("CLICKHOUSE_PASSWORD")
-
-class ClickHouseLogger(BaseCallbackHandler):
-    def __init__(self, session_id: str):
+from typing import Dict, Any, List, Optional
+from clickhouse_db import get_async_trace_writer, get_trace_writer
+from loop_detector import LoopDetected, get_loop_detector
+
+# --- PRICING ---
+# USD per 1M tokens (input, output). Groq list prices; update when they change.
+MODEL_PRICES = {
+    "openai/gpt-oss-120b": (0.15, 0.75),
+    "meta-llama/llama-4-scout-17b-16e-instruct": (0.11, 0.34),
+}
+
+def estimate_cost(model_name, prompt_tokens, completion_tokens):
+    """Returns the USD cost of one LLM call, or 0.0 for unknown models"""
+    price_in, price_out = MODEL_PRICES.get(model_name, (0.0, 0.0))
+    return (prompt_tokens * price_in + completion_tokens * price_out) / 1_000_000
+
+def extract_usage(response: LLMResult):
+    """Pulls (model_name, prompt_tokens, completion_tokens) out of an LLMResult.
+    Non-streaming ChatGroq fills llm_output['token_usage']; streaming runs only carry
+    usage_metadata on the final message, so both places are checked."""
+    llm_output = response.llm_output or {}
+    usage = llm_output.get("token_usage") or llm_output.get("usage") or {}
+    model_name = llm_output.get("model_name") or llm_output.get("model") or ""
+    prompt_tokens = usage.get("prompt_tokens", 0)
+    completion_tokens = usage.get("completion_tokens", 0)
+
+    generation = response.generations[0][0] if response.generations and response.generations[0] else None
+    message = getattr(generation, "message", None)
+    usage_metadata = getattr(message, "usage_metadata", None) or {}
+    if not prompt_tokens and not completion_tokens and usage_metadata:
+        prompt_tokens = usage_metadata.get("input_tokens", 0)
+        completion_tokens = usage_metadata.get("output_tokens", 0)
+    if not model_name:
+        info = (getattr(generation, "generation_info", None) or {})
+        metadata = getattr(message, "response_metadata", None) or {}
+        model_name = info.get("model_name") or metadata.get("model_name") or ""
+    return model_name, int(prompt_tokens or 0), int(completion_tokens or 0)
+
+def _traced_hook(hook):
+    """
+    Tracing must never break the agent: a hook that fails (bad payload, writer bug) is
+    reported and skipped. Only LoopDetected gets through, since stopping the run is its job.
+    """
+    @functools.wraps(hook)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return hook(self, *args, **kwargs)
+        except LoopDetected:
+            raise
+        except Exception as e:
+            print(f"⚠️ Trace hook {hook.__name__} failed ({e!r}); event not traced")
+    return wrapper
+
+class TraceRecorder:
+    """
+    Turns LangChain callback events into agent_traces rows.
+    Holds all per-session state (open spans, streaming LLM runs) and never blocks:
+    rows go to a non-blocking writer. The sync and async loggers below are thin
+    callback-handler shells around it.
+
+    With a LoopDetector, repeated tool calls and repeated questions are traced as
+    loop_detected events; when the detector aborts, a run_aborted event is written and
+    LoopDetected is raised from the hook (and from every later chain/LLM/tool start, in
+    case the tool node swallows the first one), which stops the graph. Late callbacks of
+    the aborted tool run (tool_end, tool_cache_hit) are not traced.
+    """
+
+    def __init__(self, session_id: str, writer, detector=None):
         self.session_id = session_id
-        self.client = clickhouse_connect.get_client(
-            host=CLICKHOUSE_HOST,
-            port=CLICKHOUSE_PORT,
-            username=CLICKHOUSE_USER,  # Added
-            password=CLICKHOUSE_PASSWORD, # Added
-            secure=False # Set to True if using Cloud/HTTPS
-        )
-        # Ensure Table Exists (Run this once or in setup)
-        self.client.command("""
-        CREATE TABLE IF NOT EXISTS agent_traces (
-            timestamp DateTime64(3),
-            session_id String,
-            event_type Enum('user_input', 'tool_start', 'tool_end', 'llm_end', 'error'),
-            content String,
-            tool_name String,
-            latency_ms UInt32
-        ) ENGINE = MergeTree()
-        ORDER BY (session_id, timestamp)
-        """)
-
-    def _insert_log(self, event_type, content, tool_name="", latency_ms=0):
-        """Helper to push row to ClickHouse"""
+        self.writer = writer
+        self.detector = detector
+        self.aborted = None  # Reason, once the run has been aborted
+        # run_id -> (monotonic start time, span name)
+        self._spans: Dict[UUID, tuple] = {}
+        # run_id -> [first token time, last token time, streamed token count, requested model]
+        self._llm_runs: Dict[UUID, list] = {}
+
+    def flush(self, timeout=None):
+        """Blocks until all buffered events are written to ClickHouse"""
+        return self.writer.flush(timeout)
+
+    def _insert_log(self, event_type, content, tool_name="", latency_ms=0, run_id=None, parent_run_id=None,
+                    ttft_ms=0, prompt_tokens=0, completion_tokens=0, tokens_per_sec=0.0,
+                    model_name="", cost_usd=0.0):
+        """Helper to queue a row for ClickHouse"""
         row = [
             datetime.datetime.now(),
             self.session_id,
             event_type,
             str(content), # Ensure string format for DB
             tool_name,
-            latency_ms
+            latency_ms,
+            str(run_id or ""),
+            str(parent_run_id or ""),
+            ttft_ms,
+            prompt_tokens,
+            completion_tokens,
+            tokens_per_sec,
+            model_name,
+            cost_usd
         ]
-        # Insert a single row (In prod, you might batch this)
-        self.client.insert('agent_traces', [row], column_names=[
-            'timestamp', 'session_id', 'event_type', 'content', 'tool_name', 'latency_ms'
-        ])
+        # Non-blocking: the writer batches rows and drops (and counts) them if the queue is full
+        self.writer.put(row)
+
+    # --- SPAN TIMING ---
+    # LangChain gives every chain/LLM/tool run a run_id, and the matching *_end
+    # callback carries the same run_id, so start times are keyed on it.
+
+    def _start_span(self, run_id, name=""):
+        self._spans[run_id] = (time.monotonic(), name)
+
+    def _end_span(self, run_id):
+        """Returns (latency_ms, name) for a finished run"""
+        start, name = self._spans.pop(run_id, (None, ""))
+        if start is None:
+            return 0, name
+        return int((time.monotonic() - start) * 1000), name
+
+    # --- LOOP DETECTION ---
+
+    def _loop_detected(self, reason, abort, tool_name="", run_id=None, parent_run_id=None):
+        self._insert_log("loop_detected", reason, tool_name=tool_name, run_id=run_id, parent_run_id=parent_run_id)
+        if abort:
+            self.aborted = reason
+            self._insert_log("run_aborted", reason, tool_name=tool_name, run_id=run_id, parent_run_id=parent_run_id)
+            raise LoopDetected(reason)
+
+    def _check_aborted(self):
+        if self.aborted is not None:
+            raise LoopDetected(self.aborted)
+
+    def _closed_by_abort(self, run_id):
+        """True for callbacks of a run whose span the abort already closed"""
+        return self.aborted is not None and run_id not in self._spans
+
+    # --- RESPONSE CACHE ---
+
+    @_traced_hook
+    def on_cache_hit(self, inputs, hit, latency_ms=0):
+        """
+        Records a question answered from the response cache; the graph never ran.
+        `inputs` are what the graph would have been invoked with, so the user_input row
+        (and the rage-click check) match a normal run of the same question.
+        """
+        run_id = uuid.uuid4()
+        self._user_input(inputs, run_id)
+        self._insert_log("cache_hit", json.dumps({
+            "answer": hit.answer,
+            "context": hit.context,  # Tool outputs of the cached run; the judge grades against them
+            "match": hit.match,
+            "similarity": round(hit.similarity, 4),
+            "cached_question": hit.question,
+            "saved_ms": hit.saved_ms,  # What the cached run took
+        }), latency_ms=latency_ms, run_id=run_id)
+
+    def _user_input(self, inputs, run_id):
+        # Usually the input is inside a key like 'input' or 'chat_history'
+        user_input = inputs.get("input", str(inputs)) if isinstance(inputs, dict) else str(inputs)
+        self._insert_log("user_input", user_input, run_id=run_id)
+        if self.detector is not None:
+            reason = self.detector.user_input(user_input)
+            if reason:
+                self._loop_detected(reason, self.detector.abort_rage_clicks, run_id=run_id)
 
     # --- EVENT HOOKS ---
     
-    def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], **kwargs):
+    @_traced_hook
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, **kwargs):
         """Captures the User Input"""
-        # Usually the input is inside a key like 'input' or 'chat_history'
-        user_input = inputs.get("input", str(inputs))
-        self._insert_log("user_input", user_input)
+        self._check_aborted()
+        name = kwargs.get("name") or (serialized or {}).get("name", "chain")
+        self._start_span(run_id, name)
+        # LangGraph starts a chain for every node; only the root run carries the user input
+        if parent_run_id is None:
+            self._user_input(inputs, run_id)
+
+    @_traced_hook
+    def on_chain_end(self, outputs: Dict[str, Any], *, run_id: UUID,
+                     parent_run_id: Optional[UUID] = None, **kwargs):
+        """Records how long a graph node (or the whole graph) took"""
+        latency_ms, name = self._end_span(run_id)
+        self._insert_log("chain_end", name, latency_ms=latency_ms,
+                         run_id=run_id, parent_run_id=parent_run_id)
+        if parent_run_id is None and self.detector is not None:
+            self.detector.end_session(self.session_id)
+
+    @_traced_hook
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID,
+                     parent_run_id: Optional[UUID] = None, **kwargs):
+        """Starts the LLM call timer (also the reference point for time-to-first-token)"""
+        self._check_aborted()
+        self._start_span(run_id, kwargs.get("name") or (serialized or {}).get("name", "llm"))
+        params = kwargs.get("invocation_params") or {}
+        metadata = kwargs.get("metadata") or {}
+        model = params.get("model_name") or params.get("model") or metadata.get("ls_model_name", "")
+        self._llm_runs[run_id] = [None, None, 0, model]
 
-    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs):
+    @_traced_hook
+    def on_llm_new_token(self, token: str, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs):
+        """Only fires when the model streams; kept to a couple of dict updates"""
+        run = self._llm_runs.get(run_id)
+        if run is None:
+            return
+        now = time.monotonic()
+        if run[0] is None:
+            run[0] = now
+        run[1] = now
+        run[2] += 1
+
+    @_traced_hook
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID,
+                      parent_run_id: Optional[UUID] = None, **kwargs):
         """Captures when the Agent calls a tool"""
-        tool_name = serialized.get("name", "unknown")
-        self._insert_log("tool_start", input_str, tool_name=tool_name)
+        self._check_aborted()
+        tool_name = (serialized or {}).get("name") or kwargs.get("name") or "unknown"
+        self._start_span(run_id, tool_name)
+        self._insert_log("tool_start", input_str, tool_name=tool_name,
+                         run_id=run_id, parent_run_id=parent_run_id)
+        if self.detector is not None:
+            reason = self.detector.tool_call(self.session_id, tool_name, input_str)
+            if reason:
+                if self.detector.abort:
+                    self._end_span(run_id)  # Raising here stops the tool before it runs
+                self._loop_detected(reason, self.detector.abort, tool_name=tool_name,
+                                    run_id=run_id, parent_run_id=parent_run_id)
+
+    @_traced_hook
+    def on_tool_end(self, output: str, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs):
+        """Captures what the tool returned and how long it took"""
+        if self._closed_by_abort(run_id):
+            return
+        latency_ms, tool_name = self._end_span(run_id)
+        self._insert_log("tool_end", output, tool_name=tool_name, latency_ms=latency_ms,
+                         run_id=run_id, parent_run_id=parent_run_id)
 
-    def on_tool_end(self, output: str, **kwargs):
-        """Captures what the tool returned"""
-        # Note: We don't easily get tool_name here without state, 
-        # but for simple traces, just logging the output is enough.
-        self._insert_log("tool_end", output)
+    @_traced_hook
+    def on_tool_error(self, error: BaseException, *, run_id: UUID,
+                      parent_run_id: Optional[UUID] = None, **kwargs):
+        """Captures tool crashes (counted as failures in Tool Reliability)"""
+        if self._closed_by_abort(run_id):
+            return
+        latency_ms, tool_name = self._end_span(run_id)
+        self._insert_log("error", str(error), tool_name=tool_name, latency_ms=latency_ms,
+                         run_id=run_id, parent_run_id=parent_run_id)
 
-    def on_llm_end(self, response: LLMResult, **kwargs):
+    @_traced_hook
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs):
         """Captures the Final Answer (or intermediate thought)"""
+        start = self._spans.get(run_id, (None,))[0]
+        latency_ms, _ = self._end_span(run_id)
+        first_token, last_token, streamed, requested_model = self._llm_runs.pop(run_id, [None, None, 0, ""])
         # The LLM output is nested in the response object
         text_response = response.generations[0][0].text
-        self._insert_log("llm_end", text_response)
 
-    def on_chain_error(self, error: BaseException, **kwargs):
+        model_name, prompt_tokens, completion_tokens = extract_usage(response)
+        model_name = model_name or requested_model
+        completion_tokens = completion_tokens or streamed
+
+        ttft_ms = 0
+        tokens_per_sec = 0.0
+        if first_token is not None and start is not None:
+            ttft_ms = int((first_token - start) * 1000)
+            # Inter-token throughput: generation speed after the first token arrived
+            if last_token > first_token:
+                tokens_per_sec = max(completion_tokens - 1, 0) / (last_token - first_token)
+        elif latency_ms:
+            tokens_per_sec = completion_tokens / (latency_ms / 1000)
+
+        self._insert_log("llm_end", text_response, latency_ms=latency_ms,
+                         run_id=run_id, parent_run_id=parent_run_id,
+                         ttft_ms=ttft_ms, prompt_tokens=prompt_tokens,
+                         completion_tokens=completion_tokens, tokens_per_sec=tokens_per_sec,
+                         model_name=model_name,
+                         cost_usd=estimate_cost(model_name, prompt_tokens, completion_tokens))
+
+    @_traced_hook
+    def on_llm_error(self, error: BaseException, *, run_id: UUID,
+                     parent_run_id: Optional[UUID] = None, **kwargs):
+        """Captures LLM API failures"""
+        latency_ms, _ = self._end_span(run_id)
+        self._llm_runs.pop(run_id, None)
+        self._insert_log("error", str(error), latency_ms=latency_ms,
+                         run_id=run_id, parent_run_id=parent_run_id)
+
+    @_traced_hook
+    def on_custom_event(self, name: str, data: Any, *, run_id: UUID, **kwargs):
+        """Captures memoized tool results (see tool_cache.py); run_id is the tool run"""
+        if name == "tool_cache_hit" and not self._closed_by_abort(run_id):
+            self._insert_log("tool_cache_hit", json.dumps({
+                "arguments": data.get("arguments"),
+                "saved_ms": data.get("saved_ms", 0),  # What the real call took
+            }, default=str), tool_name=data.get("tool", ""), run_id=run_id)
+
+    @_traced_hook
+    def on_chain_error(self, error: BaseException, *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, **kwargs):
         """Captures Crashes"""
-        self._insert_log("error", str(error))
\ No newline at end of file
+        latency_ms, _ = self._end_span(run_id)
+        self._insert_log("error", str(error), latency_ms=latency_ms,
+                         run_id=run_id, parent_run_id=parent_run_id)
+        if parent_run_id is None:
+            # The recursion limit is LangGraph's own loop cap; trace it like a detected loop
+            if type(error).__name__ == "GraphRecursionError" and self.aborted is None:
+                self.aborted = "recursion limit reached"
+                self._insert_log("run_aborted", self.aborted, run_id=run_id)
+            if self.detector is not None:
+                self.detector.end_session(self.session_id)
+
+
+class ClickHouseLogger(TraceRecorder, BaseCallbackHandler):
+    """
+    Callback handler for invoke()/stream(); rows go through the shared BatchWriter thread.
+    `detector` defaults to the shared LoopDetector (pass False to turn detection off).
+    """
+
+    def __init__(self, session_id: str, writer=None, detector=None):
+        # Cheap per-session object: the client, schema, writer and detector are shared process-wide
+        super().__init__(session_id, writer or get_trace_writer(),
+                         get_loop_detector() if detector is None else detector or None)
+        # LangChain swallows hook exceptions unless the handler asks otherwise; the hooks
+        # swallow everything but LoopDetected (see _traced_hook), so only that gets through
+        self.raise_error = self.detector is not None
+
+
+class AsyncClickHouseLogger(AsyncCallbackHandler):
+    """
+    Callback handler for ainvoke()/astream().
+    LangChain runs sync handlers in a thread pool when the graph runs under asyncio;
+    these hooks run on the loop directly, and rows go to the loop's AsyncBatchWriter.
+    Call `await logger.flush()` before the event loop exits. `detector` as for ClickHouseLogger.
+
+    The hooks that can raise LoopDetected are plain methods run inline: a coroutine hook
+    called from a sync path (a sync tool run in an executor) is run on a side loop whose
+    exceptions LangChain only logs, so the tool would still run.
+    """
+
+    run_inline = True
+
+    def __init__(self, session_id: str, writer=None, detector=None):
+        self.recorder = TraceRecorder(session_id, writer or get_async_trace_writer(),
+                                      get_loop_detector() if detector is None else detector or None)
+        self.raise_error = self.recorder.detector is not None
+
+    @property
+    def session_id(self):
+        return self.recorder.session_id
+
+    async def flush(self, timeout=None):
+        """Waits until all buffered events are written to ClickHouse"""
+        return await self.recorder.writer.flush(timeout)
+
+    def on_cache_hit(self, *args, **kwargs):
+        self.recorder.on_cache_hit(*args, **kwargs)
+
+    # Same hooks as the sync logger; the recorder does the (non-blocking) work
+    def on_chain_start(self, *args, **kwargs):
+        self.recorder.on_chain_start(*args, **kwargs)
+
+    async def on_chain_end(self, *args, **kwargs):
+        self.recorder.on_chain_end(*args, **kwargs)
+
+    async def on_chain_error(self, *args, **kwargs):
+        self.recorder.on_chain_error(*args, **kwargs)
+
+    def on_llm_start(self, *args, **kwargs):
+        self.recorder.on_llm_start(*args, **kwargs)
+
+    async def on_llm_new_token(self, *args, **kwargs):
+        self.recorder.on_llm_new_token(*args, **kwargs)
+
+    async def on_llm_end(self, *args, **kwargs):
+        self.recorder.on_llm_end(*args, **kwargs)
+
+    async def on_llm_error(self, *args, **kwargs):
+        self.recorder.on_llm_error(*args, **kwargs)
+
+    def on_tool_start(self, *args, **kwargs):
+        self.recorder.on_tool_start(*args, **kwargs)
+
+    async def on_tool_end(self, *args, **kwargs):
+        self.recorder.on_tool_end(*args, **kwargs)
+
+    async def on_tool_error(self, *args, **kwargs):
+        self.recorder.on_tool_error(*args, **kwargs)
+
+    async def on_custom_event(self, *args, **kwargs):
+        self.recorder.on_custom_event(*args, **kwargs)
@@ -0,0 +1,533 @@
+import argparse
+import asyncio
+import atexit
+import os
+import sys
+import threading
+import time
+import weakref
+import clickhouse_connect
+from clickhouse_connect.driver import httputil
+from dotenv import load_dotenv, find_dotenv
+from batch_writer import AsyncBatchWriter, BatchWriter
+from sinks import ClickHouseSink, SpoolingSink, SpoolReplayer
+from spool import Spool
+
+load_dotenv(find_dotenv())
+# --- CONFIGURATION ---
+CLICKHOUSE_HOST = os.environ.get("CLICKHOUSE_HOST")
+CLICKHOUSE_PORT = int(os.environ.get("CLICKHOUSE_PORT", "8123"))
+CLICKHOUSE_USER = os.environ.get("CLICKHOUSE_USER")
+CLICKHOUSE_PASSWORD = os.environ.get("CLICKHOUSE_PASSWORD")
+CLICKHOUSE_POOL_SIZE = int(os.environ.get("CLICKHOUSE_POOL_SIZE", "8"))
+# Local spool for trace batches while ClickHouse is down or slow (empty = off)
+TRACE_SPOOL_DIR = os.environ.get("TRACE_SPOOL_DIR", "trace_spool")
+TRACE_SPOOL_MAX_MB = int(os.environ.get("TRACE_SPOOL_MAX_MB", "512"))
+TRACE_SPOOL_FSYNC = os.environ.get("TRACE_SPOOL_FSYNC", "interval")  # always | interval | never
+# An insert slower than this sends the next batches to the spool
+TRACE_SLOW_INSERT_SECONDS = float(os.environ.get("TRACE_SLOW_INSERT_SECONDS", "2"))
+
+# Raw rows older than this are dropped a whole day-partition at a time
+TRACE_RETENTION_DAYS = int(os.environ.get("TRACE_RETENTION_DAYS", "90"))
+EVAL_RETENTION_DAYS = int(os.environ.get("EVAL_RETENTION_DAYS", "365"))
+# Table rebuilds refuse to start if traces were written this recently (agents still running)
+MIGRATION_QUIET_SECONDS = int(os.environ.get("MIGRATION_QUIET_SECONDS", "120"))
+
+TRACE_COLUMNS = ['timestamp', 'session_id', 'event_type', 'content', 'tool_name', 'latency_ms',
+                 'run_id', 'parent_run_id', 'ttft_ms', 'prompt_tokens', 'completion_tokens',
+                 'tokens_per_sec', 'model_name', 'cost_usd']
+EVAL_COLUMNS = ['timestamp', 'session_id', 'metric_name', 'score', 'reason']
+
+# New event types are only ever appended so existing Enum values keep their numbers
+TRACE_EVENT_TYPES = ['user_input', 'tool_start', 'tool_end', 'llm_end', 'error', 'chain_end',
+                     'loop_detected', 'run_aborted', 'cache_hit', 'tool_cache_hit']
+_EVENT_ENUM = "Enum(" + ", ".join(f"'{e}'" for e in TRACE_EVENT_TYPES) + ")"
+
+# --- SCHEMA ---
+# Versioned migrations, applied in order and recorded in schema_migrations.
+# Never edit a released migration; append a new one.
+
+def _rebuild(table, create_sql, columns):
+    """
+    Statements that move `table` to a new layout (partitioning/ORDER BY can't be ALTERed):
+    build `<table>_migrating` and copy the rows (one step, redone whole if interrupted), swap
+    the two tables atomically, drop the old one.
+    """
+    cols = ", ".join(columns)
+    return [
+        (
+            f"DROP TABLE IF EXISTS {table}_migrating",
+            create_sql.format(table=f"{table}_migrating"),
+            f"INSERT INTO {table}_migrating ({cols}) SELECT {cols} FROM {table}",
+        ),
+        f"EXCHANGE TABLES {table} AND {table}_migrating",
+        f"DROP TABLE {table}_migrating",
+    ]
+
+TRACES_V2 = f"""
+    CREATE TABLE {{table}} (
+        timestamp DateTime64(3) CODEC(Delta, ZSTD(1)),
+        session_id String,
+        event_type {_EVENT_ENUM},
+        content String CODEC(ZSTD(3)),
+        tool_name LowCardinality(String),
+        latency_ms UInt32,
+        run_id String CODEC(ZSTD(1)),
+        parent_run_id String CODEC(ZSTD(1)),
+        ttft_ms UInt32,
+        prompt_tokens UInt32,
+        completion_tokens UInt32,
+        tokens_per_sec Float32,
+        model_name LowCardinality(String),
+        cost_usd Float64,
+        inserted_at DateTime64(3) DEFAULT now64(3) CODEC(Delta, ZSTD(1)),
+        -- The evaluator pages on ingest time; parts written close together prune well
+        INDEX inserted_at_idx inserted_at TYPE minmax GRANULARITY 1
+    ) ENGINE = MergeTree()
+    PARTITION BY toDate(timestamp)
+    ORDER BY (session_id, timestamp)
+    TTL toDateTime(timestamp) + INTERVAL {TRACE_RETENTION_DAYS} DAY
+    SETTINGS ttl_only_drop_parts = 1, non_replicated_deduplication_window = 1000
+    """
+
+EVALS_V2 = f"""
+    CREATE TABLE {{table}} (
+        timestamp DateTime64(3) CODEC(Delta, ZSTD(1)),
+        session_id String,
+        metric_name LowCardinality(String),
+        score Float32,
+        reason String CODEC(ZSTD(3)),
+        inserted_at DateTime64(3) DEFAULT now64(3) CODEC(Delta, ZSTD(1))
+    ) ENGINE = MergeTree()
+    PARTITION BY toDate(timestamp)
+    ORDER BY (session_id, timestamp)
+    TTL toDateTime(timestamp) + INTERVAL {EVAL_RETENTION_DAYS} DAY
+    SETTINGS ttl_only_drop_parts = 1, non_replicated_deduplication_window = 1000
+    """
+
+# Pre-aggregated dashboard metrics; each SELECT feeds a materialized view and its backfill.
+# {where} splits the rows between the two on ingest time (inserted_at), so every row is
+# counted exactly once, including late rows (spool replays, imports) with old timestamps.
+TRACES_HOURLY_SELECT = """
+    SELECT
+        toStartOfHour(toDateTime(timestamp)) AS hour,
+        event_type,
+        tool_name,
+        count() AS events,
+        countIf(event_type = 'error' OR (event_type = 'tool_end' AND position(content, 'Unknown') > 0)) AS failures,
+        sum(length(content)) AS content_chars,
+        uniqState(session_id) AS sessions,
+        quantilesState(0.5, 0.95)(latency_ms) AS latency
+    FROM agent_traces
+    WHERE {where}
+    GROUP BY hour, event_type, tool_name
+    """
+RAGE_CLICKS_SELECT = """
+    SELECT
+        toStartOfFiveMinutes(toDateTime(timestamp)) AS bucket,
+        content AS question,
+        count() AS hits,
+        uniqState(session_id) AS sessions
+    FROM agent_traces
+    WHERE event_type = 'user_input' AND {where}
+    GROUP BY bucket, question
+    """
+EVAL_SCORES_HOURLY_SELECT = """
+    SELECT
+        toStartOfHour(toDateTime(timestamp)) AS hour,
+        metric_name,
+        sum(score) AS score_sum,
+        count() AS score_count
+    FROM agent_evals
+    WHERE {where}
+    GROUP BY hour, metric_name
+    """
+
+# Placeholder for a migration's cutoff, fixed when its first step runs and kept across re-runs
+CUTOFF = "{cutoff}"
+# Migration step that waits for the cutoff to pass: views created before it cover rows from
+# the cutoff on, backfills after it cover the rows before it
+WAIT_FOR_CUTOFF = "-- wait for cutoff"
+CUTOFF_LEAD_MS = 10_000
+
+def _rollup_view(table, create_sql, select):
+    """Statements that create rollup `table` and the materialized view filling it from the cutoff on"""
+    return [
+        create_sql,
+        f"CREATE MATERIALIZED VIEW IF NOT EXISTS {table}_mv TO {table} AS"
+        + select.format(where=f"inserted_at >= {CUTOFF}"),
+    ]
+
+def _rollup_backfill(table, select, order_by):
+    """
+    Statements that backfill rollup `table` with the rows before the cutoff. The history is
+    aggregated into `<table>_backfill` first (one step, redone whole if interrupted), then
+    copied in one deduplicated insert, so re-running an interrupted migration never doubles it.
+    """
+    return [
+        (
+            f"DROP TABLE IF EXISTS {table}_backfill",
+            f"CREATE TABLE {table}_backfill AS {table}",
+            f"INSERT INTO {table}_backfill" + select.format(where=f"inserted_at < {CUTOFF}"),
+        ),
+        f"INSERT INTO {table} SELECT * FROM {table}_backfill ORDER BY {order_by} "
+        f"SETTINGS insert_deduplication_token = '{table}_backfill'",
+        f"DROP TABLE {table}_backfill",
+    ]
+
+AGENT_TRACES_HOURLY = """
+    CREATE TABLE IF NOT EXISTS agent_traces_hourly (
+        hour DateTime,
+        event_type LowCardinality(String),
+        tool_name LowCardinality(String),
+        events SimpleAggregateFunction(sum, UInt64),
+        failures SimpleAggregateFunction(sum, UInt64),
+        content_chars SimpleAggregateFunction(sum, UInt64),
+        sessions AggregateFunction(uniq, String),
+        latency AggregateFunction(quantiles(0.5, 0.95), UInt32)
+    ) ENGINE = AggregatingMergeTree()
+    PARTITION BY toYYYYMM(hour)
+    ORDER BY (hour, event_type, tool_name)
+    SETTINGS non_replicated_deduplication_window = 100
+    """
+RAGE_CLICKS_5M = """
+    CREATE TABLE IF NOT EXISTS rage_clicks_5m (
+        bucket DateTime,
+        question String CODEC(ZSTD(3)),
+        hits SimpleAggregateFunction(sum, UInt64),
+        sessions AggregateFunction(uniq, String)
+    ) ENGINE = AggregatingMergeTree()
+    PARTITION BY toYYYYMM(bucket)
+    ORDER BY (bucket, question)
+    SETTINGS non_replicated_deduplication_window = 100
+    """
+EVAL_SCORES_HOURLY = """
+    CREATE TABLE IF NOT EXISTS eval_scores_hourly (
+        hour DateTime,
+        metric_name LowCardinality(String),
+        score_sum SimpleAggregateFunction(sum, Float64),
+        score_count SimpleAggregateFunction(sum, UInt64)
+    ) ENGINE = AggregatingMergeTree()
+    PARTITION BY toYYYYMM(hour)
+    ORDER BY (hour, metric_name)
+    SETTINGS non_replicated_deduplication_window = 100
+    """
+ROLLUPS = [
+    ("agent_traces_hourly", AGENT_TRACES_HOURLY, TRACES_HOURLY_SELECT, "hour, event_type, tool_name"),
+    ("rage_clicks_5m", RAGE_CLICKS_5M, RAGE_CLICKS_SELECT, "bucket, question"),
+    ("eval_scores_hourly", EVAL_SCORES_HOURLY, EVAL_SCORES_HOURLY_SELECT, "hour, metric_name"),
+]
+
+MIGRATIONS = [
+    (1, "baseline", [
+        """
+        CREATE TABLE IF NOT EXISTS agent_traces (
+            timestamp DateTime64(3),
+            session_id String,
+            event_type Enum('user_input', 'tool_start', 'tool_end', 'llm_end', 'error', 'chain_end'),
+            content String,
+            tool_name String,
+            latency_ms UInt32,
+            run_id String,
+            parent_run_id String,
+            ttft_ms UInt32,
+            prompt_tokens UInt32,
+            completion_tokens UInt32,
+            tokens_per_sec Float32,
+            model_name String,
+            cost_usd Float64
+        ) ENGINE = MergeTree()
+        ORDER BY (session_id, timestamp)
+        """,
+        # Upgrade tables created before span timing existed
+        """
+        ALTER TABLE agent_traces
+            ADD COLUMN IF NOT EXISTS run_id String,
+            ADD COLUMN IF NOT EXISTS parent_run_id String
+        """,
+        # Upgrade tables created before LLM usage accounting existed
+        """
+        ALTER TABLE agent_traces
+            ADD COLUMN IF NOT EXISTS ttft_ms UInt32,
+            ADD COLUMN IF NOT EXISTS prompt_tokens UInt32,
+            ADD COLUMN IF NOT EXISTS completion_tokens UInt32,
+            ADD COLUMN IF NOT EXISTS tokens_per_sec Float32,
+            ADD COLUMN IF NOT EXISTS model_name String,
+            ADD COLUMN IF NOT EXISTS cost_usd Float64
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS agent_evals (
+            timestamp DateTime64(3),
+            session_id String,
+            metric_name String,
+            score Float32,
+            reason String
+        ) ENGINE = MergeTree()
+        ORDER BY (session_id, timestamp)
+        """,
+        # Lets insert_deduplication_token drop replayed score batches on a non-replicated table
+        "ALTER TABLE agent_evals MODIFY SETTING non_replicated_deduplication_window = 1000",
+        # Same for trace batches replayed from the local spool
+        "ALTER TABLE agent_traces MODIFY SETTING non_replicated_deduplication_window = 1000",
+        # Evaluation progress: one logical row per evaluator, latest `updated` wins
+        """
+        CREATE TABLE IF NOT EXISTS eval_watermark (
+            evaluator String,
+            last_event_ms Int64,
+            last_session_id String,
+            updated DateTime64(3)
+        ) ENGINE = ReplacingMergeTree(updated)
+        ORDER BY evaluator
+        """,
+    ]),
+    # LowCardinality dimensions, ZSTD on the text columns, daily partitions and retention
+    (2, "partitioned_tables", [
+        *_rebuild("agent_traces", TRACES_V2, TRACE_COLUMNS),
+        *_rebuild("agent_evals", EVALS_V2, EVAL_COLUMNS),
+    ]),
+    # Rollups for the Grafana panels, kept current by materialized views and backfilled once
+    (3, "dashboard_rollups", [
+        *[sql for table, create_sql, select, _ in ROLLUPS for sql in _rollup_view(table, create_sql, select)],
+        WAIT_FOR_CUTOFF,
+        *[sql for table, _, select, order_by in ROLLUPS for sql in _rollup_backfill(table, select, order_by)],
+    ]),
+    # One row per failed grading attempt; sessions at the retry cap are skipped (dead letters)
+    (4, "eval_failures", [
+        """
+        CREATE TABLE IF NOT EXISTS eval_failures (
+            evaluator LowCardinality(String),
+            session_id String,
+            error String CODEC(ZSTD(3)),
+            failed_at DateTime64(3) DEFAULT now64(3)
+        ) ENGINE = MergeTree()
+        ORDER BY (evaluator, session_id)
+        TTL toDateTime(failed_at) + INTERVAL 90 DAY
+        """,
+    ]),
+]
+
+# Table rebuilds and history backfills. Agents never apply these (ensure_schema skips
+# them and keeps writing to the current layout); only `python clickhouse_db.py` does,
+# once the agents are stopped. Later online migrations still apply without them, so
+# they must not depend on an offline one.
+OFFLINE_MIGRATIONS = {2, 3}
+
+# Run on every start: keeps the event_type Enum in step with TRACE_EVENT_TYPES
+SCHEMA_SYNC = [
+    f"ALTER TABLE agent_traces MODIFY COLUMN event_type {_EVENT_ENUM}",
+]
+
+
+def pending_migrations(client, up_to=None):
+    """Migrations (up to version `up_to`) not yet recorded in schema_migrations, in order"""
+    client.command("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version UInt32,
+            name String,
+            applied DateTime64(3) DEFAULT now64(3)
+        ) ENGINE = MergeTree()
+        ORDER BY version
+    """)
+    # Progress inside a migration, so an interrupted one resumes instead of redoing finished steps
+    client.command("""
+        CREATE TABLE IF NOT EXISTS schema_migration_steps (
+            version UInt32,
+            step UInt32,
+            cutoff_ms Int64,
+            applied DateTime64(3) DEFAULT now64(3)
+        ) ENGINE = MergeTree()
+        ORDER BY (version, step)
+    """)
+    done = {row[0] for row in client.query("SELECT version FROM schema_migrations").result_rows}
+    return [m for m in MIGRATIONS if m[0] not in done and (up_to is None or m[0] <= up_to)]
+
+
+def apply_migrations(client, up_to=None, offline=True):
+    """
+    Applies pending migrations (up to version `up_to`) on `client`; returns the versions applied.
+    With offline=False it skips OFFLINE_MIGRATIONS entries (with a warning) and applies the rest.
+    """
+    applied = []
+    for version, name, statements in pending_migrations(client, up_to):
+        if version in OFFLINE_MIGRATIONS and not offline:
+            print(f"⚠️ Schema migration {version} ({name}) is pending and rebuilds tables; "
+                  f"stop the agents and run `python clickhouse_db.py` to apply it")
+            continue
+        print(f"⏳ Applying schema migration {version} ({name})...")
+        _apply_steps(client, version, statements)
+        client.insert('schema_migrations', [[version, name]], column_names=['version', 'name'])
+        applied.append(version)
+    if up_to is None:
+        for sql in SCHEMA_SYNC:
+            client.command(sql)
+    return applied
+
+
+def _server_ms(client):
+    return int(client.command("SELECT toUnixTimestamp64Milli(now64(3))"))
+
+def _apply_steps(client, version, statements):
+    """
+    Runs the steps of one migration not recorded in schema_migration_steps, recording each.
+    A step is a statement or a tuple of statements redone together. The migration's cutoff
+    (server time, CUTOFF_LEAD_MS ahead) is fixed on its first run and reused on re-runs.
+    """
+    rows = client.query(
+        "SELECT step, cutoff_ms FROM schema_migration_steps WHERE version = {v:UInt32}",
+        parameters={"v": version},
+    ).result_rows
+    done = {step for step, _ in rows}
+    cutoff_ms = rows[0][1] if rows else _server_ms(client) + CUTOFF_LEAD_MS
+    cutoff = f"fromUnixTimestamp64Milli(toInt64({cutoff_ms}))"
+    for step, statements in enumerate(statements):
+        if step in done:
+            continue
+        if statements == WAIT_FOR_CUTOFF:
+            wait_ms = cutoff_ms - _server_ms(client)
+            if wait_ms > 0:
+                time.sleep(wait_ms / 1000)
+        else:
+            for sql in (statements if isinstance(statements, tuple) else (statements,)):
+                client.command(sql.replace(CUTOFF, cutoff))
+        client.insert('schema_migration_steps', [[version, step, cutoff_ms]],
+                      column_names=['version', 'step', 'cutoff_ms'])
+
+
+# --- PROCESS-WIDE STATE ---
+_lock = threading.Lock()
+_client = None
+_schema_ready = False
+_trace_writer = None
+_trace_sink = None
+# One async writer per event loop (its drain task is tied to the loop)
+_async_trace_writers = weakref.WeakKeyDictionary()
+
+
+def new_client(database=None):
+    """A new ClickHouse client (get_client() is the shared one); `database` overrides the default"""
+    kwargs = {"database": database} if database else {}
+    return clickhouse_connect.get_client(
+        host=CLICKHOUSE_HOST,
+        port=CLICKHOUSE_PORT,
+        username=CLICKHOUSE_USER,
+        password=CLICKHOUSE_PASSWORD,
+        secure=False, # Set to True if using Cloud/HTTPS
+        # Keep-alive connections shared by every logger, writer and the evaluator.
+        # No server-side session, so concurrent threads can use the same client.
+        pool_mgr=httputil.get_pool_manager(maxsize=CLICKHOUSE_POOL_SIZE),
+        autogenerate_session_id=False,
+        **kwargs,
+    )
+
+
+def get_client():
+    """Returns the process-wide ClickHouse client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = new_client()
+    return _client
+
+
+def ensure_schema():
+    """Applies pending online migrations once per process. Later calls are free."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    client = get_client()
+    with _lock:
+        if not _schema_ready:
+            apply_migrations(client, offline=False)
+            _schema_ready = True
+
+
+def _ready_client():
+    ensure_schema()
+    return get_client()
+
+
+def get_trace_sink():
+    """
+    Returns the process-wide sink for trace batches. Nothing connects here: the
+    client and schema are set up on the first insert, in the writer's thread, so a
+    ClickHouse outage never reaches the agent. With TRACE_SPOOL_DIR set, failed or
+    slow inserts go to a local spool that is replayed once ClickHouse is back.
+    """
+    global _trace_sink
+    if _trace_sink is None:
+        with _lock:
+            if _trace_sink is None:
+                sink = ClickHouseSink(_ready_client)
+                if TRACE_SPOOL_DIR:
+                    try:
+                        spool = Spool(TRACE_SPOOL_DIR, max_bytes=TRACE_SPOOL_MAX_MB * 1024 * 1024,
+                                      fsync=TRACE_SPOOL_FSYNC)
+                        sink = SpoolingSink(sink, spool, slow_seconds=TRACE_SLOW_INSERT_SECONDS)
+                        SpoolReplayer(sink).start()
+                        # Registered before any writer, so it runs after the writers' final flush
+                        atexit.register(spool.close)
+                    except RuntimeError as e:
+                        print(f"⚠️ Trace spool disabled: {e}")
+                _trace_sink = sink
+    return _trace_sink
+
+
+def get_trace_writer():
+    """Returns the shared background writer for agent_traces."""
+    global _trace_writer
+    if _trace_writer is None:
+        sink = get_trace_sink()
+        with _lock:
+            if _trace_writer is None:
+                _trace_writer = BatchWriter(sink, 'agent_traces', TRACE_COLUMNS)
+    return _trace_writer
+
+
+def get_async_trace_writer():
+    """Returns the agent_traces writer for the running event loop (call from async code)."""
+    loop = asyncio.get_running_loop()
+    writer = _async_trace_writers.get(loop)
+    if writer is None:
+        # The sink connects lazily in the writer's insert thread, not on the loop
+        sink = get_trace_sink()
+        writer = _async_trace_writers[loop] = AsyncBatchWriter(lambda: sink, 'agent_traces', TRACE_COLUMNS,
+                                                               loop=loop)
+    return writer
+
+
+def recent_trace_rows(client, seconds):
+    """Trace rows written in the last `seconds` (0 if the table doesn't exist yet)"""
+    if not int(client.command("EXISTS TABLE agent_traces")):
+        return 0
+    return int(client.command(
+        "SELECT count() FROM agent_traces WHERE timestamp >= now64(3) - toIntervalSecond({s:UInt32})",
+        parameters={"s": seconds},
+    ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create or upgrade the ClickHouse schema.")
+    parser.add_argument("--quiet-seconds", type=int, default=MIGRATION_QUIET_SECONDS,
+                        help="refuse table rebuilds if traces were written this recently")
+    parser.add_argument("--force", action="store_true", help="rebuild even if agents look active")
+    args = parser.parse_args(argv)
+
+    client = get_client()
+    pending = [version for version, _, _ in pending_migrations(client)]
+    offline = [version for version in pending if version in OFFLINE_MIGRATIONS]
+    # Rows written during a rebuild's copy would be lost at the swap, so agents must be stopped
+    if offline and not args.force:
+        active = recent_trace_rows(client, args.quiet_seconds)
+        if active:
+            print(f"❌ {active} trace rows in the last {args.quiet_seconds}s: agents look active. "
+                  f"Stop them before migrations {offline} (or pass --force).")
+            return 1
+    applied = apply_migrations(client)
+    print(f"✅ ClickHouse schema is ready (applied migrations: {applied or 'none'}).")
+    return 0
+
+if __name__ == "__main__":
+    # Explicit setup/upgrade entry point: python clickhouse_db.py
+    # Run this (with the agents stopped) before restarting agents on a new version.
+    sys.exit(main())
@@ -1,193 +1,80 @@
-import pandas as pd
-import json
+import time
+_STARTED = time.perf_counter() # Startup is measured from here, before the imports below
+
+import argparse
 import os
 import datetime
-import clickhouse_connect
-from groq import Groq
+import signal
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from dotenv import load_dotenv, find_dotenv
-from sentence_transformers import SentenceTransformer, util
-import re
-import requests
+from clickhouse_db import get_client, ensure_schema
+from judge import run_judge, run_combined_judge, JudgeError
+import judge
+from embeddings import EmbeddingStage
+from eval_sink import EvalSink
+from url_checker import UrlChecker
+from eval_service import EvalService, EVAL_POLL_INTERVAL
+from gold_standard import GoldIndex, load_gold_standard
 
 # Load Env
 load_dotenv(find_dotenv())
 
 # --- CONFIGURATION ---
-CLICKHOUSE_HOST = os.environ.get("CLICKHOUSE_HOST")
-CLICKHOUSE_PORT = int(os.environ.get("CLICKHOUSE_PORT"))
-CLICKHOUSE_USER = os.environ.get("CLICKHOUSE_USER")
-CLICKHOUSE_PASSWORD = os.environ.get("CLICKHOUSE_PASSWORD")
-GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
-
-# --- CLIENTS ---
-client = Groq(api_key=GROQ_API_KEY)
-print("⏳ Loading Embedding Model (all-MiniLM-L6-v2)...")
-embed_model = SentenceTransformer('all-MiniLM-L6-v2')
-
-# --- 2. DEFINE GOLD STANDARD DATASET ---
-# If the user asks X, the "Perfect" answer is Y.
-GOLD_STANDARD = {
-    "Calculate 25 times 4.": "100",
-    "What is the weather in Dallas?": "75 F, Sunny",
-    "Who is the President of France?": "I cannot answer that", # Refusal is correct
-    "What is the weather in Atlantis?": "Unknown location"
-}
-
-try:
-    ch_client = clickhouse_connect.get_client(
-        host=CLICKHOUSE_HOST, 
-        port=CLICKHOUSE_PORT, 
-        username=CLICKHOUSE_USER, 
-        password=CLICKHOUSE_PASSWORD
-    )
-    # Ensure Evals Table Exists
-    ch_client.command("""
-    CREATE TABLE IF NOT EXISTS agent_evals (
-        timestamp DateTime64(3),
-        session_id String,
-        metric_name String,
-        score Float32,
-        reason String
-    ) ENGINE = MergeTree()
-    ORDER BY (session_id, timestamp)
-    """)
-except Exception as e:
-    print(f"ClickHouse Connection Error: {e}")
-    exit()
-
-def save_eval(session_id, metric_name, score):
-    """Saves the score to ClickHouse"""
-    row = [datetime.datetime.now(), session_id, metric_name, float(score), "Level 2 Check"]
-    ch_client.insert('agent_evals', [row], column_names=['timestamp', 'session_id', 'metric_name', 'score', 'reason'])
-
-def check_urls(text):
-    """Returns 0 if any URL in the text is broken (404), else 1."""
-    urls = re.findall(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', text)
-    if not urls: return 1.0 # No URLs = Safe
-    
-    for url in urls:
-        try:
-            # Ping the URL (Head request is faster)
-            r = requests.head(url, timeout=3)
-            if r.status_code >= 400: return 0.0 # Broken Link
-        except:
-            return 0.0 # DNS/Connection Failure
-    return 1.0
-
-# --- THE JUDGE FUNCTION ---
-def run_judge(metric_name, prompt, user_q, agent_ans, context=""):
-    """
-    Generic function to run a grading prompt.
-    Returns: 1.0 (Positive/Yes) or 0.0 (Negative/No)
-    """
-    system_prompt = f"""
-    You are an impartial AI QA Auditor.
-    
-    TASK: {prompt}
-    
-    DATA TO EVALUATE:
-    User Question: "{user_q}"
-    Agent Answer: "{agent_ans}"
-    Context (Tool Outputs): "{context}"
-    
-    INSTRUCTIONS:
-    - Analyze strictly based on the provided Data.
-    - Output ONLY the digit '1' for YES or '0' for NO. 
-    - Do not write any other words.
-    """
-    
-    try:
-        # UPDATED: Using the requested Llama 4 model
-        completion = client.chat.completions.create(
-            model="meta-llama/llama-4-scout-17b-16e-instruct", 
-            messages=[{"role": "user", "content": system_prompt}],
-            temperature=0
-        )
-        result = completion.choices[0].message.content.strip()
-        # Parse result safely
-        return 1.0 if '1' in result else 0.0
-    except Exception as e:
-        print(f"Judge Error ({metric_name}): {e}")
-        return 0.0
-
-def save_eval(session_id, metric_name, score):
-    """Saves the score to ClickHouse"""
-    row = [
-        datetime.datetime.now(),
-        session_id,
-        metric_name,
-        score,
-        "Auto-graded by Llama-4-Scout"
-    ]
-    ch_client.insert('agent_evals', [row], column_names=[
-        'timestamp', 'session_id', 'metric_name', 'score', 'reason'
-    ])
-
-# --- MAIN LOOP ---
-
-print("\n--- 🕵️ STARTED INCREMENTAL EVALUATION ---\n")
-
-# --- KEY CHANGE HERE ---
-# Logic: Fetch sessions from traces ONLY IF they are NOT already in 'agent_evals'.
-# This ensures we only grade new, ungraded sessions.
-query = """
-SELECT 
-    session_id, 
-    groupArray(event_type) as events, 
-    groupArray(content) as contents
-FROM agent_traces
-WHERE session_id NOT IN (
-    SELECT DISTINCT session_id FROM agent_evals 
-    --WHERE metric_name = 'semantic_similarity'
-)
--- Optional: Keep a time limit if your DB is huge (e.g., look back 7 days for ungraded work)
--- AND timestamp > now() - INTERVAL 7 DAY 
-GROUP BY session_id
-limit 10
-"""
-
-try:
-    sessions = ch_client.query(query).result_rows
-except Exception as e:
-    print(f"Error fetching traces: {e}")
-    sessions = []
-
-if len(sessions) == 0:
-    print("✅ No new sessions to grade. Everything is up to date!")
-else:
-    print(f"Found {len(sessions)} NEW sessions to evaluate...\n")
-
-for sess in sessions:
-    sess_id, events, contents = sess
-    
-    # 1. Reconstruct Data
-    try:
-        # Get User Question
-        if 'user_input' in events:
-            user_q = contents[events.index('user_input')]
-        else:
-            continue
+# Sessions graded in parallel; the judge rate limiter keeps us inside Groq's limits
+JUDGE_CONCURRENCY = int(os.environ.get("JUDGE_CONCURRENCY", "8"))
+# Sessions fetched per keyset page, and how many pages one run may process (0 = until caught up)
+EVAL_PAGE_SIZE = int(os.environ.get("EVAL_PAGE_SIZE", "200"))
+EVAL_MAX_PAGES = int(os.environ.get("EVAL_MAX_PAGES", "0"))
+# A session is only graded once it has had no new events for this long
+SESSION_IDLE_SECONDS = int(os.environ.get("SESSION_IDLE_SECONDS", "60"))
+# Failed grading attempts per session before it is dead-lettered and the watermark moves on
+EVAL_MAX_ATTEMPTS = int(os.environ.get("EVAL_MAX_ATTEMPTS", "5"))
+# Name of this evaluator's row in eval_watermark
+EVALUATOR_NAME = os.environ.get("EVALUATOR_NAME", "default")
+# Sharding: worker i of N only grades sessions with cityHash64(session_id) % N = i
+EVAL_WORKER_INDEX = int(os.environ.get("EVAL_WORKER_INDEX", "0"))
+EVAL_WORKER_COUNT = int(os.environ.get("EVAL_WORKER_COUNT", "1"))
+# "combined" scores every rubric metric in one JSON request; "single" is one request per metric
+JUDGE_MODE = os.environ.get("JUDGE_MODE", "combined")
+# Combined mode only: pack up to this many short sessions into one judge request
+JUDGE_PACK_SIZE = int(os.environ.get("JUDGE_PACK_SIZE", "4"))
+JUDGE_PACK_MAX_CHARS = int(os.environ.get("JUDGE_PACK_MAX_CHARS", "1500"))
+EMBED_MODEL_NAME = 'all-MiniLM-L6-v2'
+# Optional on-disk cache of answer embeddings (empty = off)
+EMBED_CACHE_PATH = os.environ.get("EMBED_CACHE_PATH", "")
+# Gold set file (.jsonl or .csv) and how close a question must be to count as a match
+GOLD_STANDARD_PATH = os.environ.get(
+    "GOLD_STANDARD_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "gold_standard.jsonl"))
+GOLD_MATCH_THRESHOLD = float(os.environ.get("GOLD_MATCH_THRESHOLD", "0.85"))
 
-        # Get Final Answer (Last text output)
-        if 'llm_end' in events:
-            # Find the LAST llm_end
-            indices = [i for i, x in enumerate(events) if x == "llm_end"]
-            agent_ans = contents[indices[-1]]
-        elif 'tool_end' in events:
-             indices = [i for i, x in enumerate(events) if x == "tool_end"]
-             agent_ans = contents[indices[-1]]
-        else:
-            agent_ans = "No Answer"
+DEFAULT_REASON = "Auto-graded by Llama-4-Scout"
+
+
+# --- SESSION HELPERS ---
+
+def pack_sessions(sessions, pack_size=JUDGE_PACK_SIZE, max_chars=JUDGE_PACK_MAX_CHARS):
+    """Groups short sessions into judge batches of up to pack_size; long ones go alone"""
+    batches, current = [], []
+    for sess in sessions:
+        size = sum(len(part) for part in sess[1:])
+        if size > max_chars or pack_size <= 1:
+            batches.append([sess])
+            continue
+        current.append(sess)
+        if len(current) >= pack_size:
+            batches.append(current)
+            current = []
+    if current:
+        batches.append(current)
+    return batches
 
-        # Get Context (All tool outputs combined)
-        tool_outputs = [str(c) for i, c in enumerate(contents) if events[i] == 'tool_end']
-        context_str = " | ".join(tool_outputs)
-        
-    except ValueError:
-        continue 
+def judge_single(sess):
+    """Legacy mode: one request per metric. Returns {metric: (score, reason)}"""
+    _, user_q, agent_ans, context_str = sess
 
-    print(f"-> Grading Session {sess_id[-8:]}...")
-    
     # --- METRIC A: FAITHFULNESS ---
     # PROMPT: "Does the answer contain info NOT in context?"
     # YES (1) = Hallucination (Bad)
@@ -196,13 +83,6 @@ for sess in sessions:
         "Does the Agent Answer contain specific facts or numbers NOT found in the Context/Tool Outputs? "
         "Answer '1' if it Hallucinated (contains outside info). Answer '0' if it stayed Faithful (only used context)."
     )
-    
-    is_hallucination = run_judge("faithfulness", faith_prompt, user_q, agent_ans, context_str)
-    
-    # INVERT SCORE: If Hallucination is 1, Faithfulness is 0.
-    faithfulness_score = 0.0 if is_hallucination == 1.0 else 1.0
-    
-    save_eval(sess_id, "faithfulness", faithfulness_score)
 
     # --- METRIC B: ANSWER RELEVANCE ---
     # PROMPT: "Does it answer the question?"
@@ -212,32 +92,488 @@ for sess in sessions:
         "Does the Agent Answer directly address the User Question? "
         "Answer '1' for Yes (Relevant). Answer '0' for No (Irrelevant)."
     )
-    
+
+    is_hallucination = run_judge("faithfulness", faith_prompt, user_q, agent_ans, context_str)
     relevance_score = run_judge("answer_relevance", rel_prompt, user_q, agent_ans, context_str)
-    
-    save_eval(sess_id, "answer_relevance", relevance_score)
-    
-    # --- METRIC C: SEMANTIC SIMILARITY (The "Gold Standard" Check) ---
-    # We only run this if we have a "Correct Answer" defined for this question.
-    # Note: We use basic string matching for keys; in prod, use fuzzy matching.
-    if user_q in GOLD_STANDARD:
-        gold_answer = GOLD_STANDARD[user_q]
-        
-        # Compute Cosine Similarity between Agent Answer and Gold Answer
-        embeddings = embed_model.encode([agent_ans, gold_answer])
-        sim_score = util.cos_sim(embeddings[0], embeddings[1]).item()
-        
-        print(f"   Similarity: {sim_score:.2f} (Target: {gold_answer})")
-        save_eval(sess_id, "semantic_similarity", sim_score)
-    else:
-        # If no gold standard exists, we skip this metric (or mark -1)
-        pass
-
-    # --- METRIC D: HALLUCINATION CHECK (Broken Link Detector) ---
-    # Checks if the agent generated a fake URL.
-    url_score = check_urls(agent_ans)
-    if url_score == 0.0:
-        print(f"   ⚠️ FOUND BROKEN URL in: {agent_ans}")
-    save_eval(sess_id, "url_validity", url_score)
-
-print("\n✅ Incremental Evaluation Complete!")
\ No newline at end of file
+
+    # INVERT SCORE: If Hallucination is 1, Faithfulness is 0.
+    faithfulness_score = 0.0 if is_hallucination == 1.0 else 1.0
+    return {"faithfulness": (faithfulness_score, DEFAULT_REASON),
+            "answer_relevance": (relevance_score, DEFAULT_REASON)}
+
+# --- THE ENGINE ---
+
+class Evaluator:
+    """
+    Incremental LLM-as-a-Judge evaluator.
+    Nothing heavy happens in __init__: the embedding model, Groq client and ClickHouse
+    client are each created the first time a metric needs them,
+    and how long each took is kept in `timings`.
+
+    With worker_count > 1 the evaluator owns one shard of the sessions (by hash of
+    session_id) and keeps its own watermark row, so N workers never grade the same
+    session and need no coordination beyond agreeing on N.
+    """
+
+    def __init__(self, page_size=EVAL_PAGE_SIZE, max_pages=EVAL_MAX_PAGES, concurrency=JUDGE_CONCURRENCY,
+                 judge_mode=JUDGE_MODE, gold_standard_path=GOLD_STANDARD_PATH,
+                 idle_seconds=SESSION_IDLE_SECONDS, name=EVALUATOR_NAME,
+                 worker_index=EVAL_WORKER_INDEX, worker_count=EVAL_WORKER_COUNT,
+                 max_attempts=EVAL_MAX_ATTEMPTS):
+        if not 0 <= worker_index < worker_count:
+            raise ValueError(f"worker_index must be in [0, {worker_count}), got {worker_index}")
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.idle_seconds = idle_seconds
+        self.max_attempts = max_attempts
+        self.dead_lettered = 0
+        self.worker_index = worker_index
+        self.worker_count = worker_count
+        # Each shard pages through its own sessions, so it needs its own watermark
+        self.name = name if worker_count == 1 else f"{name}/{worker_index}of{worker_count}"
+        self.concurrency = concurrency
+        self.judge_mode = judge_mode
+        self.gold_standard_path = gold_standard_path
+        self.timings = {}
+        self._ch_client = None
+        self._keyset_column = None
+        # Lives for the whole process so its URL result cache carries across pages
+        self.url_checker = UrlChecker()
+        self._embed_stage = None
+        self._gold_index = None
+        # Scores are buffered and written in bulk; flushed before the watermark moves
+        self.sink = EvalSink(lambda: self.ch_client)
+
+    def _timed(self, name, fn):
+        started = time.perf_counter()
+        result = fn()
+        self.timings[name] = time.perf_counter() - started
+        return result
+
+    # --- LAZY RESOURCES ---
+
+    @property
+    def ch_client(self):
+        if self._ch_client is None:
+            def connect():
+                # Shared process-wide client; tables are created once per process
+                client = get_client()
+                ensure_schema()
+                return client
+            self._ch_client = self._timed("clickhouse_connect", connect)
+        return self._ch_client
+
+    @property
+    def keyset_column(self):
+        """
+        Pages are keyed on ingest time (inserted_at), so late rows, e.g. a spool replayed
+        after an outage or an imported JSONL file, still land after the watermark even
+        though their event timestamps are old. Tables not yet rebuilt by migration 2 have
+        no inserted_at; they page on event time, and late rows older than the watermark
+        are never graded.
+        """
+        if self._keyset_column is None:
+            has_column = self.ch_client.query(
+                "SELECT count() FROM system.columns "
+                "WHERE database = currentDatabase() AND table = 'agent_traces' AND name = 'inserted_at'"
+            ).result_rows[0][0]
+            if not has_column:
+                print("⚠️ agent_traces has no inserted_at (run `python clickhouse_db.py`); "
+                      "paging on event time, so late-arriving sessions are missed")
+            self._keyset_column = "inserted_at" if has_column else "timestamp"
+        return self._keyset_column
+
+    def _load_embed_model(self):
+        def load():
+            print(f"⏳ Loading Embedding Model ({EMBED_MODEL_NAME})...")
+            # Imported here: torch + sentence_transformers alone take seconds
+            from sentence_transformers import SentenceTransformer
+            return SentenceTransformer(EMBED_MODEL_NAME)
+        return self._timed("embed_model_load", load)
+
+    @property
+    def embed_stage(self):
+        if self._embed_stage is None:
+            self._embed_stage = EmbeddingStage(self._load_embed_model, EMBED_MODEL_NAME,
+                                               cache_path=EMBED_CACHE_PATH or None)
+        return self._embed_stage
+
+    @property
+    def gold_index(self):
+        if self._gold_index is None:
+            # If the user asks X, the "Perfect" answer is Y.
+            gold_standard = load_gold_standard(self.gold_standard_path)
+            self._gold_index = GoldIndex(self.embed_stage, gold_standard, threshold=GOLD_MATCH_THRESHOLD)
+        return self._gold_index
+
+    # --- PIPELINE ---
+
+    def read_watermark(self):
+        """
+        (last_event_ms, session_id) of the last fully graded session, in keyset order.
+        last_event_ms is the session's last ingest time (see keyset_column).
+        """
+        row = self.ch_client.query(
+            """
+            SELECT argMax(last_event_ms, updated), argMax(last_session_id, updated)
+            FROM eval_watermark
+            WHERE evaluator = {name:String}
+            """,
+            parameters={"name": self.name}
+        ).result_rows[0]
+        return row[0], row[1]
+
+    def save_watermark(self, watermark):
+        last_event_ms, session_id = watermark
+        self.ch_client.insert('eval_watermark', [[self.name, last_event_ms, session_id, datetime.datetime.now()]],
+                              column_names=['evaluator', 'last_event_ms', 'last_session_id', 'updated'])
+
+    def fetch_page(self, watermark):
+        """
+        Next keyset page of closed sessions after the watermark, already reconstructed
+        in ClickHouse: (session_id, user_q, agent_ans, context_str, last_event_ms) rows
+        ordered by (last_event_ms, session_id), where last_event_ms is when the session's
+        last row was ingested. Only these strings cross the wire.
+        Timestamps are compared as epoch milliseconds so the keyset survives the
+        round trip through Python exactly (no truncation, no timezone conversion).
+        """
+        # Only sessions with rows ingested at/after the watermark are aggregated, so the
+        # cost of a page doesn't grow with the size of the history.
+        query = """
+        SELECT
+            session_id,
+            -- User Question: the first user_input
+            argMinIf(content, timestamp, event_type = 'user_input') as user_q,
+            -- Final Answer: the LAST llm_end, else the response cache's answer, else the last tool_end
+            multiIf(
+                countIf(event_type = 'llm_end') > 0, argMaxIf(content, timestamp, event_type = 'llm_end'),
+                countIf(event_type = 'cache_hit') > 0,
+                    JSONExtractString(argMaxIf(content, timestamp, event_type = 'cache_hit'), 'answer'),
+                countIf(event_type = 'tool_end') > 0, argMaxIf(content, timestamp, event_type = 'tool_end'),
+                'No Answer'
+            ) as agent_ans,
+            -- Context: all tool outputs, in time order (a cache hit carries those of the cached run)
+            if(
+                countIf(event_type = 'tool_end') = 0 AND countIf(event_type = 'cache_hit') > 0,
+                JSONExtractString(argMaxIf(content, timestamp, event_type = 'cache_hit'), 'context'),
+                arrayStringConcat(
+                    arrayMap(x -> x.2, arraySort(x -> x.1, groupArrayIf((timestamp, content), event_type = 'tool_end'))),
+                    ' | '
+                )
+            ) as context_str,
+            toUnixTimestamp64Milli(max(KEYSET_COLUMN)) as last_event_ms
+        FROM agent_traces
+        WHERE session_id IN (
+            SELECT DISTINCT session_id FROM agent_traces
+            WHERE KEYSET_COLUMN >= fromUnixTimestamp64Milli({wm_ms:Int64})
+              -- This worker's shard only
+              AND cityHash64(session_id) % {workers:UInt32} = {worker:UInt32}
+        )
+        GROUP BY session_id
+        HAVING (last_event_ms, session_id) > ({wm_ms:Int64}, {wm_sid:String})
+           -- Closed sessions only: nothing new ingested for idle_seconds
+           AND last_event_ms < toUnixTimestamp64Milli(now64(3)) - {idle:UInt32} * 1000
+           -- Sessions without a question can't be graded
+           AND countIf(event_type = 'user_input') > 0
+        ORDER BY last_event_ms, session_id
+        LIMIT {page:UInt32}
+        """.replace("KEYSET_COLUMN", self.keyset_column)
+        parameters = {
+            "wm_ms": watermark[0], "wm_sid": watermark[1],
+            "idle": self.idle_seconds, "page": self.page_size,
+            "workers": self.worker_count, "worker": self.worker_index,
+        }
+        # Consume the result block by block instead of materializing one big result set
+        rows = []
+        with self.ch_client.query_row_block_stream(query, parameters=parameters) as stream:
+            for block in stream:
+                rows.extend(tuple(row) for row in block)
+        return rows
+
+    def already_graded(self, session_ids):
+        """Sessions of this page that already have scores (e.g. from a run that crashed mid-page)"""
+        if not session_ids:
+            return set()
+        rows = self.ch_client.query(
+            "SELECT DISTINCT session_id FROM agent_evals WHERE session_id IN {ids:Array(String)}",
+            parameters={"ids": list(session_ids)}
+        ).result_rows
+        return {row[0] for row in rows}
+
+    def failure_counts(self, session_ids):
+        """{session_id: failed grading attempts} for the sessions of a page that have any"""
+        if not session_ids:
+            return {}
+        return dict(self.ch_client.query(
+            """
+            SELECT session_id, count() FROM eval_failures
+            WHERE evaluator = {name:String} AND session_id IN {ids:Array(String)}
+            GROUP BY session_id
+            """,
+            parameters={"name": self.name, "ids": list(session_ids)}
+        ).result_rows)
+
+    def record_failures(self, errors):
+        """Logs one failed attempt per session ({session_id: error}); returns the ones that just reached max_attempts"""
+        if not errors:
+            return set()
+        now = datetime.datetime.now()
+        self.ch_client.insert('eval_failures', [[self.name, sess_id, str(error)[:1000], now]
+                                                for sess_id, error in sorted(errors.items())],
+                              column_names=['evaluator', 'session_id', 'error', 'failed_at'])
+        dead = {sess_id for sess_id, attempts in self.failure_counts(list(errors)).items()
+                if attempts >= self.max_attempts}
+        if dead:
+            self.dead_lettered += len(dead)
+            print(f"   🪦 Giving up on {len(dead)} session(s) after {self.max_attempts} failed attempts "
+                  f"(listed in eval_failures)")
+        return dead
+
+    def save_eval(self, session_id, metric_name, score, reason=DEFAULT_REASON):
+        """Queues the score for the bulk insert into agent_evals"""
+        self.sink.add(session_id, metric_name, score, reason)
+
+    def judge_batch(self, batch):
+        """Returns {session_id: {metric: (score, reason)}} for a batch of reconstructed sessions"""
+        if self.judge_mode != "combined":
+            return {sess[0]: judge_single(sess) for sess in batch}
+        return run_combined_judge(batch)
+
+    def compute_similarities(self, sessions):
+        """
+        METRIC C for the whole run at once: {session_id: (similarity, gold_answer)}.
+        All agent answers go through the embedding model in one batch.
+        """
+        if not sessions:
+            return {}
+        # We only run this if we have a "Correct Answer" for this question (or one close enough to it)
+        golds = self.gold_index.lookup([user_q for _, user_q, _, _ in sessions])
+        graded = [(sess_id, agent_ans, gold)
+                  for (sess_id, _, agent_ans, _), gold in zip(sessions, golds) if gold is not None]
+        if not graded:
+            return {}
+        sess_ids, answers, golds = zip(*graded)
+        scores = self.embed_stage.similarities(list(answers), list(golds))
+        return {sess_id: (float(score), gold) for sess_id, score, gold in zip(sess_ids, scores, golds)}
+
+    def compute_url_scores(self, sessions):
+        """METRIC D for the whole page at once: {session_id: 1.0/0.0}, URLs checked concurrently"""
+        scores = self.url_checker.score_texts([agent_ans for _, _, agent_ans, _ in sessions])
+        return {sess[0]: score for sess, score in zip(sessions, scores)}
+
+    def grade_batch(self, batch, similarities, url_scores):
+        """Judges a batch of sessions, then runs the local metrics and saves everything.
+        Returns (ids of the sessions graded, {session_id: error} for sessions the judge rejected)."""
+        print(f"-> Grading Session(s) {', '.join(sess[0][-8:] for sess in batch)}...")
+        try:
+            verdicts = self.judge_batch(batch)
+        except JudgeError as e:
+            if not e.transient and len(batch) > 1:
+                # A packed request came back malformed: grade its sessions one by one instead
+                graded, rejected = [], {}
+                for sess in batch:
+                    ids, errors = self.grade_batch([sess], similarities, url_scores)
+                    graded.extend(ids)
+                    rejected.update(errors)
+                return graded, rejected
+            # Nothing is saved, so the sessions stay ungraded and are retried on the next run.
+            # Only a verdict on this one session counts toward max_attempts, not a judge outage.
+            print(f"   ❌ Judge Error ({e}); skipping {len(batch)} session(s)")
+            return [], {} if e.transient else {batch[0][0]: e}
+
+        for sess_id, user_q, agent_ans, context_str in batch:
+            for metric_name, (score, reason) in verdicts[sess_id].items():
+                self.save_eval(sess_id, metric_name, score, reason or DEFAULT_REASON)
+            self.grade_local_metrics(sess_id, agent_ans, similarities.get(sess_id), url_scores[sess_id])
+        return [sess[0] for sess in batch], {}
+
+    def grade_local_metrics(self, sess_id, agent_ans, similarity, url_score):
+        """Metrics that don't need the LLM judge"""
+        # --- METRIC C: SEMANTIC SIMILARITY (The "Gold Standard" Check) ---
+        # Scores were computed for the whole run in compute_similarities()
+        if similarity is not None:
+            sim_score, gold_answer = similarity
+            print(f"   Similarity: {sim_score:.2f} (Target: {gold_answer})")
+            self.save_eval(sess_id, "semantic_similarity", sim_score)
+
+        # --- METRIC D: HALLUCINATION CHECK (Broken Link Detector) ---
+        # Checks if the agent generated a fake URL (checked for the whole page in compute_url_scores()).
+        if url_score == 0.0:
+            print(f"   ⚠️ FOUND BROKEN URL in: {agent_ans}")
+        self.save_eval(sess_id, "url_validity", url_score)
+
+    def grade_sessions(self, sessions):
+        """Grades reconstructed sessions; returns (set of session ids graded, {session_id: error} rejected)"""
+        if not sessions:
+            return set(), {}
+        if self.judge_mode == "combined":
+            batches = pack_sessions(sessions)
+        else:
+            batches = [[sess] for sess in sessions]
+        similarities = self.compute_similarities(sessions)
+        url_scores = self.compute_url_scores(sessions)
+
+        # Each worker grades one batch at a time; judge calls across workers share one rate limiter
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            graded, rejected = set(), {}
+            for ids, errors in pool.map(partial(self.grade_batch, similarities=similarities, url_scores=url_scores),
+                                        batches):
+                graded.update(ids)
+                rejected.update(errors)
+            return graded, rejected
+
+    def process_page(self, rows, watermark):
+        """
+        Grades one fetched page and persists it. Returns (new_watermark, graded, failed).
+        The watermark only moves past sessions whose scores are saved: it stops just
+        before the first session (in keyset order) that failed to grade. Attempts the
+        judge rejected (e.g. an unparseable verdict) are logged in eval_failures; a session
+        rejected max_attempts times is dead-lettered (skipped), so one poison session can't
+        hold its shard back forever. Outages (judge rate limits, ClickHouse, the embedding
+        model) don't count: those sessions are simply retried.
+        """
+        ids = [row[0] for row in rows]
+        done = self.already_graded(ids)
+        dead = {sess_id for sess_id, attempts in self.failure_counts(ids).items() if attempts >= self.max_attempts}
+        sessions = [row[:4] for row in rows if row[0] not in done and row[0] not in dead]
+        try:
+            with self.sink.hold():
+                graded_ids, rejected = self.grade_sessions(sessions)
+        except Exception:
+            # The page will be regraded from the watermark, so its buffered scores must not be written
+            self.sink.discard()
+            raise
+        failed = {sess[0] for sess in sessions} - graded_ids
+        # Scores must be durable before the watermark moves past their sessions
+        self.sink.flush()
+        failed -= self.record_failures(rejected)
+
+        new_watermark = watermark
+        for sess_id, _, _, _, last_event_ms in rows:
+            if sess_id in failed:
+                break
+            new_watermark = (last_event_ms, sess_id)
+        if new_watermark != watermark:
+            self.save_watermark(new_watermark)
+        return new_watermark, len(graded_ids), failed
+
+    def run(self):
+        """
+        One incremental pass: pages through closed sessions after the watermark until
+        caught up (or max_pages). Returns a summary dict.
+        A session that failed to grade stops the run there, so it is retried next time
+        (until the judge has rejected it max_attempts times, see process_page).
+        """
+        print("\n--- 🕵️ STARTED INCREMENTAL EVALUATION ---\n")
+        started = time.perf_counter()
+        watermark = self.read_watermark()
+        fetched = graded = pages = 0
+
+        while True:
+            rows = self.fetch_page(watermark)
+            if not rows:
+                break
+            pages += 1
+            fetched += len(rows)
+            print(f"Found {len(rows)} NEW sessions to evaluate (page {pages})...\n")
+
+            watermark, page_graded, failed = self.process_page(rows, watermark)
+            graded += page_graded
+
+            if failed:
+                print(f"⚠️ {len(failed)} session(s) failed; stopping here so they are retried next run")
+                break
+            if len(rows) < self.page_size or (self.max_pages and pages >= self.max_pages):
+                break
+
+        if fetched == 0:
+            print("✅ No new sessions to grade. Everything is up to date!")
+        return {"fetched": fetched, "graded": graded, "pages": pages, "dead_lettered": self.dead_lettered,
+                "seconds": time.perf_counter() - started, **self.sink.stats()}
+
+
+# --- CLI ---
+
+def spawn_workers(count, argv):
+    """Runs `count` sharded copies of this script locally and waits for all of them"""
+    procs = [subprocess.Popen([sys.executable, os.path.abspath(__file__), *argv,
+                               "--worker-index", str(i), "--worker-count", str(count)])
+             for i in range(count)]
+    # Pass SIGTERM/SIGINT on so every worker drains its page before exiting
+    def forward(signum, frame):
+        for proc in procs:
+            if proc.poll() is None:
+                proc.send_signal(signum)
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, forward)
+    codes = [proc.wait() for proc in procs]
+    return max(codes)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Grade new agent sessions with LLM-as-a-Judge.")
+    parser.add_argument("--page-size", type=int, default=EVAL_PAGE_SIZE, help="sessions per keyset page")
+    parser.add_argument("--max-pages", type=int, default=EVAL_MAX_PAGES, help="pages per run (0 = until caught up)")
+    parser.add_argument("--idle-seconds", type=int, default=SESSION_IDLE_SECONDS,
+                        help="only grade sessions with no events for this long")
+    parser.add_argument("--concurrency", type=int, default=JUDGE_CONCURRENCY, help="parallel judge workers")
+    parser.add_argument("--judge-mode", choices=["combined", "single"], default=JUDGE_MODE)
+    parser.add_argument("--gold-standard", default=GOLD_STANDARD_PATH, help=".jsonl or .csv gold set")
+    parser.add_argument("--serve", action="store_true", help="run continuously as a service (stop with SIGTERM)")
+    parser.add_argument("--poll-interval", type=float, default=EVAL_POLL_INTERVAL,
+                        help="service mode: seconds between polls once caught up")
+    parser.add_argument("--worker-index", type=int, default=EVAL_WORKER_INDEX, help="this worker's shard (0-based)")
+    parser.add_argument("--worker-count", type=int, default=EVAL_WORKER_COUNT,
+                        help="total number of sharded workers (all workers must agree)")
+    parser.add_argument("--spawn-workers", type=int, default=0, metavar="N",
+                        help="launch N sharded workers on this machine and wait for them")
+    args = parser.parse_args(argv)
+    if not 0 <= args.worker_index < args.worker_count:
+        parser.error(f"--worker-index must be between 0 and {args.worker_count - 1}")
+
+    if args.spawn_workers > 1:
+        worker_argv, skip = [], False
+        for arg in (argv if argv is not None else sys.argv[1:]):
+            if skip or arg.startswith("--spawn-workers"):
+                skip = arg == "--spawn-workers" and not skip
+                continue
+            worker_argv.append(arg)
+        return spawn_workers(args.spawn_workers, worker_argv)
+
+    if args.worker_count > 1:
+        # Every worker shares the same Groq key, so each gets 1/N of the account limits
+        judge.limiter = judge.RateLimiter(judge.GROQ_RPM / args.worker_count, judge.GROQ_TPM / args.worker_count)
+        print(f"🧩 Worker {args.worker_index + 1}/{args.worker_count}")
+
+    evaluator = Evaluator(page_size=args.page_size, max_pages=args.max_pages, concurrency=args.concurrency,
+                          judge_mode=args.judge_mode, gold_standard_path=args.gold_standard,
+                          idle_seconds=args.idle_seconds,
+                          worker_index=args.worker_index, worker_count=args.worker_count)
+    print(f"⏱️ Startup: {(time.perf_counter() - _STARTED) * 1000:.0f} ms")
+
+    if args.serve:
+        service = EvalService(evaluator, poll_interval=args.poll_interval)
+        service.install_signal_handlers()
+        service.serve()
+        return 0
+
+    try:
+        summary = evaluator.run()
+    except Exception as e:
+        print(f"Evaluation Error: {e}")
+        return 1
+
+    cache = judge.get_cache()
+    if cache:
+        stats = cache.stats()
+        print(f"\n🗄️ Judge cache: {stats['hits']} hits / {stats['misses']} misses ({stats['hit_rate']:.0%})")
+    for name, seconds in evaluator.timings.items():
+        print(f"⏱️ {name}: {seconds * 1000:.0f} ms")
+    print(f"⏱️ Graded {summary['graded']} session(s) in {summary['seconds']:.1f}s")
+    print(f"💾 Wrote {summary['rows_written']} score rows ({summary['rows_per_sec']:.0f} rows/s)")
+
+    print("\n✅ Incremental Evaluation Complete!")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
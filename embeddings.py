@@ -0,0 +1,97 @@
+import sqlite3
+import threading
+import numpy as np
+from hashing import content_key
+
+
+class EmbeddingCache:
+    """SQLite store of answer embeddings so repeated answers never reach the model."""
+
+    def __init__(self, path, model_name):
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+
+    def _key(self, text):
+        return content_key(self.model_name, text)
+
+    def get_many(self, texts):
+        """Returns {text: vector} for the texts that are cached"""
+        keys = {self._key(t): t for t in texts}
+        key_list = list(keys)
+        found = {}
+        with self._lock:
+            # Chunked to stay under SQLite's bound-parameter limit
+            for i in range(0, len(key_list), 500):
+                chunk = key_list[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk
+                )
+                for key, blob in rows:
+                    found[keys[key]] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, texts, vectors):
+        rows = [(self._key(t), np.asarray(v, dtype=np.float32).tobytes()) for t, v in zip(texts, vectors)]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?)", rows)
+
+
+class EmbeddingStage:
+    """
+    Batched semantic-similarity scoring against gold answers.
+    Gold embeddings are computed once and kept in memory; agent answers for a whole
+    run are encoded in one normalized batch, so cosine similarity is a row-wise dot product.
+    `load_model` is only called the first time something actually needs encoding.
+    """
+
+    def __init__(self, load_model, model_name, gold_answers=(), cache_path=None, batch_size=64):
+        self._load_model = load_model
+        self._model = None
+        self._model_lock = threading.Lock()
+        self.batch_size = batch_size
+        self.cache = EmbeddingCache(cache_path, model_name) if cache_path else None
+        self.gold = {}
+        self.add_gold(gold_answers)
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self._load_model()
+        return self._model
+
+    def encode(self, texts):
+        """Normalized float32 matrix, one row per text (cached rows skip the model)"""
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        unique = list(dict.fromkeys(texts))
+        vectors = self.cache.get_many(unique) if self.cache else {}
+        missing = [t for t in unique if t not in vectors]
+        if missing:
+            encoded = self.model.encode(missing, batch_size=self.batch_size,
+                                        normalize_embeddings=True, convert_to_numpy=True)
+            encoded = np.asarray(encoded, dtype=np.float32)
+            vectors.update(zip(missing, encoded))
+            if self.cache:
+                self.cache.put_many(missing, encoded)
+        return np.stack([vectors[t] for t in texts])
+
+    def add_gold(self, answers):
+        answers = [a for a in dict.fromkeys(answers) if a not in self.gold]
+        if answers:
+            self.gold.update(zip(answers, self.encode(answers)))
+
+    def similarities(self, answers, gold_answers):
+        """Cosine similarity of answers[i] vs gold_answers[i], computed as one matrix op"""
+        if not answers:
+            return np.zeros(0, dtype=np.float32)
+        self.add_gold(gold_answers)
+        answer_matrix = self.encode(answers)
+        gold_matrix = np.stack([self.gold[g] for g in gold_answers])
+        return np.einsum("ij,ij->i", answer_matrix, gold_matrix)
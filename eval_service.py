@@ -0,0 +1,171 @@
+import json
+import os
+import queue
+import signal
+import threading
+import time
+
+# --- CONFIGURATION ---
+EVAL_POLL_INTERVAL = float(os.environ.get("EVAL_POLL_INTERVAL", "10"))
+# Pages fetched ahead of the grader; when the judge is rate limited the fetcher blocks here
+EVAL_PREFETCH_PAGES = int(os.environ.get("EVAL_PREFETCH_PAGES", "2"))
+EVAL_STATUS_PATH = os.environ.get("EVAL_STATUS_PATH", "eval_status.json")
+EVAL_RETRY_DELAY = float(os.environ.get("EVAL_RETRY_DELAY", "30"))
+
+
+class EvalService:
+    """
+    Long-running evaluator: fetch -> (judge + embed + URL) -> persist, continuously.
+
+    A fetcher thread tails agent_traces for newly closed sessions and pushes pages into
+    a bounded queue; the grading loop drains it through Evaluator.process_page(). The
+    grader runs at the pace the judge rate limiter allows, so a full queue blocks the
+    fetcher (backpressure) instead of buffering the backlog in memory.
+
+    SIGTERM/SIGINT stop fetching and let the page currently being graded finish and
+    persist; prefetched pages are dropped because the watermark has not passed them.
+    """
+
+    def __init__(self, evaluator, poll_interval=EVAL_POLL_INTERVAL, prefetch_pages=EVAL_PREFETCH_PAGES,
+                 status_path=EVAL_STATUS_PATH, retry_delay=EVAL_RETRY_DELAY):
+        self.evaluator = evaluator
+        self.poll_interval = poll_interval
+        self.status_path = status_path
+        self.retry_delay = retry_delay
+        self._pages = queue.Queue(maxsize=prefetch_pages)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # The fetcher reads ahead from `_cursor`; bumping `_generation` invalidates pages
+        # fetched before a reset (after a failure the grader rewinds to the watermark).
+        self._cursor = None
+        self._generation = 0
+        self.started = time.time()
+        self.stats = {"pages": 0, "graded": 0, "failed": 0, "errors": 0, "last_error": "",
+                      "last_page_at": None}
+
+    # --- LIFECYCLE ---
+
+    def install_signal_handlers(self):
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda signum, frame: self.stop())
+
+    def stop(self):
+        if not self._stop.is_set():
+            print("\n🛑 Shutdown requested; finishing the page in flight...")
+        self._stop.set()
+
+    def serve(self):
+        """Blocks until stop() (or a signal). Returns the final status dict."""
+        print("\n--- 🕵️ EVALUATOR SERVICE STARTED ---\n")
+        self._cursor = self.evaluator.read_watermark()
+        watermark = self._cursor
+        fetcher = threading.Thread(target=self._fetch_loop, name="eval-fetcher", daemon=True)
+        fetcher.start()
+
+        while not self._stop.is_set():
+            try:
+                generation, rows = self._pages.get(timeout=1.0)
+            except queue.Empty:
+                self._write_status(watermark)
+                continue
+            if generation != self._generation:
+                continue # Fetched before a rewind
+
+            try:
+                watermark, graded, failed = self.evaluator.process_page(rows, watermark)
+            except Exception as e:
+                failed = {row[0] for row in rows}
+                graded = 0
+                self._record_error(e)
+            with self._lock:
+                self.stats["pages"] += 1
+                self.stats["graded"] += graded
+                self.stats["failed"] += len(failed)
+                self.stats["last_page_at"] = time.time()
+            if failed:
+                self._rewind(watermark)
+            status = self._write_status(watermark)
+            print(f"📈 {status['pages']} pages | {status['graded']} graded | "
+                  f"{status['sessions_per_sec']:.2f} sessions/s | {status['queued_pages']} queued")
+
+        fetcher.join(timeout=5)
+        status = self._write_status(watermark)
+        print(f"✅ Evaluator service stopped after grading {status['graded']} session(s).")
+        return status
+
+    # --- STAGES ---
+
+    def _fetch_loop(self):
+        while not self._stop.is_set():
+            with self._lock:
+                cursor, generation = self._cursor, self._generation
+            try:
+                rows = self.evaluator.fetch_page(cursor)
+            except Exception as e:
+                self._record_error(e)
+                self._stop.wait(self.retry_delay)
+                continue
+            if not rows:
+                self._stop.wait(self.poll_interval)
+                continue
+            # Blocks while the grader is behind; re-checks stop so shutdown isn't held up
+            while not self._stop.is_set():
+                try:
+                    self._pages.put((generation, rows), timeout=1.0)
+                    break
+                except queue.Full:
+                    continue
+            with self._lock:
+                if generation == self._generation:
+                    last = rows[-1]
+                    self._cursor = (last[-1], last[0])
+            if len(rows) < self.evaluator.page_size:
+                self._stop.wait(self.poll_interval)
+
+    def _rewind(self, watermark):
+        """After a failure: drop prefetched pages and refetch from the watermark after a delay"""
+        print(f"⚠️ Page had failures; retrying from the watermark in {self.retry_delay:.0f}s")
+        with self._lock:
+            self._generation += 1
+            self._cursor = watermark
+        while True:
+            try:
+                self._pages.get_nowait()
+            except queue.Empty:
+                break
+        self._stop.wait(self.retry_delay)
+
+    # --- STATUS ---
+
+    def _record_error(self, error):
+        print(f"❌ Evaluator service error: {error}")
+        with self._lock:
+            self.stats["errors"] += 1
+            self.stats["last_error"] = str(error)
+
+    def status(self, watermark=None):
+        uptime = time.time() - self.started
+        with self._lock:
+            status = dict(self.stats)
+        last_page_at = status["last_page_at"]
+        status.update({
+            "state": "stopping" if self._stop.is_set() else "running",
+            "uptime_seconds": round(uptime, 1),
+            "sessions_per_sec": round(status["graded"] / uptime, 3) if uptime else 0.0,
+            "queued_pages": self._pages.qsize(),
+            "watermark": list(watermark) if watermark else None,
+            "seconds_since_last_page": round(time.time() - last_page_at, 1) if last_page_at else None,
+            "dead_lettered": self.evaluator.dead_lettered,
+            **self.evaluator.sink.stats(),
+        })
+        return status
+
+    def _write_status(self, watermark):
+        """Health/throughput snapshot, written atomically for probes and dashboards"""
+        status = self.status(watermark)
+        if self.status_path:
+            tmp = self.status_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(status, f)
+            os.replace(tmp, self.status_path)
+        return status
@@ -0,0 +1,97 @@
+import datetime
+import threading
+import time
+from contextlib import contextmanager
+from clickhouse_db import EVAL_COLUMNS
+from hashing import content_key
+
+
+class EvalSink:
+    """
+    Collects evaluation scores and writes them to agent_evals as columnar inserts.
+    Rows are flushed when `max_rows` are buffered, when `flush_interval` seconds
+    have passed since the oldest buffered row, or on an explicit flush();
+    inside hold() only the explicit flush() writes.
+    Every insert carries an insert_deduplication_token derived from its content
+    (not its timestamps), so replaying a batch after a crash or timeout is a no-op
+    on the server.
+    """
+
+    def __init__(self, get_client, table='agent_evals', max_rows=5000, flush_interval=5.0, retries=2):
+        self._get_client = get_client
+        self.table = table
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self._rows = []
+        self._first_row_at = None
+        self._held = 0
+        self._lock = threading.Lock()
+        self.rows_written = 0
+        self.insert_seconds = 0.0
+
+    def add(self, session_id, metric_name, score, reason):
+        with self._lock:
+            self._rows.append([datetime.datetime.now(), session_id, metric_name, float(score), reason])
+            if self._first_row_at is None:
+                self._first_row_at = time.monotonic()
+            due = not self._held and (len(self._rows) >= self.max_rows
+                                      or time.monotonic() - self._first_row_at >= self.flush_interval)
+            rows = self._take() if due else None
+        if rows:
+            self._write(rows)
+
+    @contextmanager
+    def hold(self):
+        """
+        No automatic flushes inside the block: a page's scores are written together by
+        the flush() after it, or dropped together by discard(). A page that fails halfway
+        must not leave some of its sessions partly scored (already_graded would skip them).
+        """
+        with self._lock:
+            self._held += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._held -= 1
+
+    def flush(self):
+        with self._lock:
+            rows = self._take()
+        if rows:
+            self._write(rows)
+
+    def discard(self):
+        """Drops the buffered rows (a failed page is regraded from scratch); returns how many"""
+        with self._lock:
+            return len(self._take())
+
+    def _take(self):
+        rows, self._rows, self._first_row_at = self._rows, [], None
+        return rows
+
+    def _write(self, rows):
+        # Same scores -> same token, whenever they were computed
+        token = content_key(*sorted(f"{r[1]}|{r[2]}|{r[3]}|{r[4]}" for r in rows))
+        columns = [list(col) for col in zip(*rows)]
+        started = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                self._get_client().insert(self.table, columns, column_names=EVAL_COLUMNS,
+                                          column_oriented=True,
+                                          settings={'insert_deduplication_token': token})
+                break
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(2 ** attempt)
+        with self._lock:
+            self.insert_seconds += time.perf_counter() - started
+            self.rows_written += len(rows)
+
+    def stats(self):
+        return {
+            "rows_written": self.rows_written,
+            "rows_per_sec": self.rows_written / self.insert_seconds if self.insert_seconds else 0.0,
+        }
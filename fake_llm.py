@@ -0,0 +1,92 @@
+import asyncio
+import re
+import time
+import uuid
+from typing import Any, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# --- INTENT PATTERNS ---
+# Just enough of the demo tasks to exercise every tool offline
+WEATHER_PATTERN = re.compile(r"\b(weather|raining|temperature)\b", re.I)
+CITY_PATTERN = re.compile(r"\bin\s+([A-Z][a-zA-Z]*(?:\s+[A-Z][a-zA-Z]*)*)")
+TIME_PATTERN = re.compile(r"\btime\b", re.I)
+TIMEZONE_PATTERN = re.compile(r"\b([A-Z]{2,4})\b")
+MULTIPLY_PATTERN = re.compile(r"(\d+)\s*(?:times|by|\*|x)\s*(\d+)", re.I)
+
+REFUSAL = "I cannot help with that."
+
+
+def plan_tool_calls(question):
+    """Tool calls the agent should make for a question, in the order they're mentioned"""
+    calls = []
+    if WEATHER_PATTERN.search(question):
+        city = CITY_PATTERN.search(question)
+        calls.append(("get_weather", {"city": city.group(1) if city else ""}))
+    if TIME_PATTERN.search(question):
+        zone = TIMEZONE_PATTERN.search(question)
+        calls.append(("get_time", {"timezone": zone.group(1) if zone else "UTC"}))
+    match = MULTIPLY_PATTERN.search(question)
+    if match:
+        calls.append(("multiply", {"a": int(match.group(1)), "b": int(match.group(2))}))
+    return calls
+
+
+class FakeToolChatModel(BaseChatModel):
+    """
+    Offline stand-in for ChatGroq in the ReAct agent.
+    The first turn calls the demo tools the question asks for (or refuses); once the
+    tool results are in, it answers with them. `latency` seconds are spent per call
+    (asyncio.sleep under ainvoke) so load tests see realistic concurrency.
+    """
+
+    latency: float = 0.0
+    model_name: str = "fake-tool-chat"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-tool-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        # Tool calls are planned from the question, so the schemas aren't needed
+        return self
+
+    def _respond(self, messages: List[BaseMessage]) -> ChatResult:
+        tool_results = []
+        for message in reversed(messages):
+            if not isinstance(message, ToolMessage):
+                break
+            tool_results.insert(0, str(message.content))
+
+        if tool_results:
+            answer = "Unknown" if any("Unknown" in r for r in tool_results) else " ".join(tool_results)
+            message = AIMessage(content=answer)
+        else:
+            question = next((str(m.content) for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+            calls = plan_tool_calls(question)
+            message = AIMessage(
+                content="" if calls else REFUSAL,
+                tool_calls=[{"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:8]}"}
+                            for name, args in calls],
+            )
+
+        prompt_tokens = sum(len(str(m.content)) for m in messages) // 4
+        completion_tokens = len(str(message.content)) // 4 + len(message.tool_calls) * 10
+        message.usage_metadata = {"input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+                                  "total_tokens": prompt_tokens + completion_tokens}
+        message.response_metadata = {"model_name": self.model_name}
+        return ChatResult(generations=[ChatGeneration(message=message)],
+                          llm_output={"model_name": self.model_name})
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(messages)
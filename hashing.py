@@ -0,0 +1,10 @@
+import hashlib
+
+
+def content_key(*parts):
+    """Stable hash of the parts, in order: cache keys, dedup tokens, loop fingerprints"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x1f")  # Separator so ("ab", "c") != ("a", "bc")
+    return digest.hexdigest()
@@ -0,0 +1,240 @@
+import argparse
+import datetime
+import glob
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from clickhouse_db import TRACE_COLUMNS, TRACE_EVENT_TYPES, get_client, ensure_schema
+
+# --- CONFIGURATION ---
+# Rows per columnar insert; memory is bounded by two batches (one parsing, one inserting)
+IMPORT_BATCH_ROWS = int(os.environ.get("IMPORT_BATCH_ROWS", "100000"))
+
+# Event names written by sample_files/agent.py -> agent_traces event types
+LEGACY_EVENT_TYPES = {
+    "input": "user_input",
+    "decision": "tool_start",
+    "tool_output": "tool_end",
+    "final_answer": "llm_end",
+}
+INT_COLUMNS = {"latency_ms", "ttft_ms", "prompt_tokens", "completion_tokens"}
+FLOAT_COLUMNS = {"tokens_per_sec", "cost_usd"}
+
+
+def open_lines(path):
+    """Streams a .jsonl or .jsonl.gz file line by line"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8", buffering=1024 * 1024)
+
+def parse_timestamp(value):
+    if value is None or value == "":
+        return datetime.datetime.now()
+    if isinstance(value, (int, float)):
+        # Epoch seconds, or milliseconds for anything past the year 5000
+        return datetime.datetime.fromtimestamp(value / 1000 if value > 1e11 else value)
+    return datetime.datetime.fromisoformat(str(value))
+
+
+class TraceMapper:
+    """
+    Maps one JSON log record onto an agent_traces row (None = skip).
+
+    Understands the sample agent's log format (turn_number, decision/tool_output/...)
+    as well as records that already use agent_traces column names. `fields` renames
+    source keys (agent_traces column -> key in the file) for other layouts, and
+    `default_event_type` covers files without an event type at all.
+    """
+
+    def __init__(self, fields=None, default_event_type=None, max_sessions=10000):
+        self.fields = fields or {}
+        self.default_event_type = default_event_type
+        self.max_sessions = max_sessions
+        # session_id -> tool named by its last decision, so tool_output rows get a tool_name
+        self._last_tool = OrderedDict()
+        self.skipped = 0
+
+    def _get(self, record, column):
+        return record.get(self.fields.get(column, column))
+
+    def _remember_tool(self, session_id, tool_name):
+        self._last_tool[session_id] = tool_name
+        self._last_tool.move_to_end(session_id)
+        if len(self._last_tool) > self.max_sessions:
+            self._last_tool.popitem(last=False)
+
+    def map(self, record):
+        event_type = self._get(record, "event_type") or self.default_event_type
+        event_type = LEGACY_EVENT_TYPES.get(event_type, event_type)
+        if event_type not in TRACE_EVENT_TYPES:
+            self.skipped += 1
+            return None
+
+        session_id = str(self._get(record, "session_id") or "")
+        content = self._get(record, "content")
+        tool_name = self._get(record, "tool_name") or ""
+        if event_type == "tool_start" and not tool_name and isinstance(content, dict):
+            tool_name = content.get("tool") or "" # Legacy decision: {"tool": ..., "args": ...}
+        if event_type == "tool_start":
+            self._remember_tool(session_id, tool_name)
+        elif event_type == "tool_end" and not tool_name:
+            tool_name = self._last_tool.get(session_id, "")
+        if not isinstance(content, str):
+            content = "" if content is None else json.dumps(content, default=str)
+
+        run_id = self._get(record, "run_id") or ""
+        turn_number = self._get(record, "turn_number")
+        if not run_id and turn_number is not None:
+            # The events of one agent turn share a run, like a tool_start/tool_end pair does
+            run_id = f"{session_id}:{turn_number}"
+
+        values = {
+            "timestamp": parse_timestamp(self._get(record, "timestamp")),
+            "session_id": session_id,
+            "event_type": event_type,
+            "content": content,
+            "tool_name": str(tool_name),
+            "run_id": str(run_id),
+        }
+        row = []
+        for column in TRACE_COLUMNS:
+            if column in values:
+                row.append(values[column])
+            elif column in INT_COLUMNS:
+                row.append(int(self._get(record, column) or 0))
+            elif column in FLOAT_COLUMNS:
+                row.append(float(self._get(record, column) or 0.0))
+            else:
+                row.append(str(self._get(record, column) or ""))
+        return row
+
+
+class TraceImporter:
+    """
+    Streams JSONL files into agent_traces as large columnar inserts.
+    Parsing the next batch overlaps with inserting the previous one (at most one
+    insert in flight). Each batch carries a deduplication token hashed from the source
+    lines it holds, so re-running an import is a no-op: batches always start every
+    `batch_rows` rows, so the full batches of a file that has grown since (or been
+    rotated into a .gz) hash the same. Only a partial last batch can load twice.
+    """
+
+    def __init__(self, client, mapper, batch_rows=IMPORT_BATCH_ROWS, dry_run=False):
+        self.client = client
+        self.mapper = mapper
+        self.batch_rows = batch_rows
+        self.dry_run = dry_run
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+        self.rows = 0
+        self.bad_lines = 0
+
+    def import_file(self, path):
+        columns = [[] for _ in TRACE_COLUMNS]
+        count = 0
+        digest = hashlib.sha256()
+        with open_lines(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    row = self.mapper.map(record) if isinstance(record, dict) else None
+                except (ValueError, TypeError, OverflowError, OSError):
+                    # Not JSON, or a value that doesn't fit its column (e.g. an epoch out of range)
+                    self.bad_lines += 1
+                    continue
+                if row is None:
+                    continue
+                for column, value in zip(columns, row):
+                    column.append(value)
+                # The raw line, not the row: rows without a timestamp get the import time
+                digest.update(line.rstrip("\r\n").encode("utf-8") + b"\n")
+                count += 1
+                if count >= self.batch_rows:
+                    self._submit(columns, digest.hexdigest())
+                    columns = [[] for _ in TRACE_COLUMNS]
+                    count = 0
+                    digest = hashlib.sha256()
+        if count:
+            self._submit(columns, digest.hexdigest())
+
+    def _submit(self, columns, token):
+        self.finish()
+        if self.dry_run:
+            self.rows += len(columns[0])
+            return
+        self._pending = self._pool.submit(self._insert, columns, token)
+
+    def _insert(self, columns, token):
+        self.client.insert('agent_traces', columns, column_names=TRACE_COLUMNS, column_oriented=True,
+                           settings={'insert_deduplication_token': token})
+        self.rows += len(columns[0])
+
+    def finish(self):
+        """Waits for the insert in flight (and re-raises its error)"""
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            pending.result()
+
+
+# --- CLI ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-load JSONL (or .jsonl.gz) logs into agent_traces.")
+    parser.add_argument("paths", nargs="+", help="files or glob patterns")
+    parser.add_argument("--batch-rows", type=int, default=IMPORT_BATCH_ROWS, help="rows per insert")
+    parser.add_argument("--field", action="append", default=[], metavar="COLUMN=KEY",
+                        help="read agent_traces COLUMN from KEY, e.g. --field content=body")
+    parser.add_argument("--event-type", choices=TRACE_EVENT_TYPES, help="event type for records without one")
+    parser.add_argument("--dry-run", action="store_true", help="parse and map only, don't insert")
+    args = parser.parse_args(argv)
+
+    fields = {}
+    for spec in args.field:
+        column, _, key = spec.partition("=")
+        if (column not in TRACE_COLUMNS and column != "turn_number") or not key:
+            parser.error(f"bad --field {spec!r}; expected COLUMN=KEY with an agent_traces column")
+        fields[column] = key
+    paths = [path for pattern in args.paths for path in sorted(glob.glob(pattern))]
+    # Half-written archives from the log rotation (jsonl_log.py); the finished .gz follows
+    partial = [path for path in paths if path.endswith(".tmp")]
+    if partial:
+        print(f"⏭️ Skipping {len(partial)} temporary file(s): {', '.join(partial)}")
+        paths = [path for path in paths if not path.endswith(".tmp")]
+    if not paths:
+        parser.error("no files matched")
+
+    client = None
+    if not args.dry_run:
+        client = get_client()
+        ensure_schema()
+    mapper = TraceMapper(fields, args.event_type)
+    importer = TraceImporter(client, mapper, batch_rows=args.batch_rows, dry_run=args.dry_run)
+
+    started = time.perf_counter()
+    try:
+        for path in paths:
+            before = importer.rows
+            file_started = time.perf_counter()
+            importer.import_file(path)
+            importer.finish()
+            seconds = time.perf_counter() - file_started
+            loaded = importer.rows - before
+            print(f"📥 {path}: {loaded} rows in {seconds:.1f}s ({loaded / seconds if seconds else 0:,.0f} rows/s)")
+    except Exception as e:
+        print(f"❌ Import Error: {e}")
+        return 1
+    seconds = time.perf_counter() - started
+    print(f"\n✅ {'Parsed' if args.dry_run else 'Imported'} {importer.rows} rows from {len(paths)} file(s) in "
+          f"{seconds:.1f}s ({importer.rows / seconds if seconds else 0:,.0f} rows/s); "
+          f"{mapper.skipped} skipped, {importer.bad_lines} unreadable lines")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import atexit
+import datetime
+import glob
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+
+
+class JsonlWriter:
+    """
+    Buffered JSON-lines log writer with size-based rotation.
+
+    The file stays open and lines go through a large write buffer that is flushed
+    every `flush_interval` seconds (checked on write), on flush() and at exit.
+    Once the file reaches `max_bytes` it is renamed to `<name>.<timestamp>.jsonl`,
+    gzip-compressed in the background if `compress` is set, and the oldest rotated
+    files beyond `keep` are deleted (0 = keep all).
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, compress=False, keep=0,
+                 flush_interval=1.0, buffer_size=1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.keep = keep
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._last_flush = time.monotonic()
+        self._compressors = []
+        self._prune_lock = threading.Lock()
+        self.lines = 0
+        self.rotations = 0
+        atexit.register(self.close)
+
+    def _open(self):
+        self._file = open(self.path, "a", encoding="utf-8", buffering=self.buffer_size)
+        self._size = self._file.tell()
+
+    def write(self, entry):
+        line = json.dumps(entry, default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self._file.write(line)
+            self._size += len(line)
+            self.lines += 1
+            if self._size >= self.max_bytes:
+                self._rotate()
+            elif time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def _flush(self):
+        self._file.flush()
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        for thread in self._compressors:
+            thread.join()
+        atexit.unregister(self.close)
+
+    # --- ROTATION ---
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        base, ext = os.path.splitext(self.path)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        rotated = f"{base}.{stamp}{ext}"
+        os.replace(self.path, rotated)
+        self.rotations += 1
+        if self.compress:
+            # Compressing a full segment takes a while; the agent keeps logging meanwhile
+            thread = threading.Thread(target=self._compress, args=(rotated,), daemon=True)
+            thread.start()
+            self._compressors = [t for t in self._compressors if t.is_alive()] + [thread]
+        else:
+            self._prune()
+
+    def _compress(self, path):
+        # Written under a temporary name so a half-written archive is never pruned or imported
+        with open(path, "rb") as src, gzip.open(path + ".gz.tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(path + ".gz.tmp", path + ".gz")
+        os.remove(path)
+        self._prune()
+
+    def _prune(self):
+        if not self.keep:
+            return
+        base, ext = os.path.splitext(self.path)
+        # Only finished rotations count; timestamped names sort chronologically
+        pattern = f"{glob.escape(base)}.*{ext}" + (".gz" if self.compress else "")
+        with self._prune_lock:
+            for path in sorted(glob.glob(pattern))[:-self.keep]:
+                os.remove(path)
@@ -0,0 +1,349 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+import groq
+from groq import Groq
+from dotenv import load_dotenv, find_dotenv
+from hashing import content_key
+from judge_cache import VerdictCache
+
+load_dotenv(find_dotenv())
+
+# --- CONFIGURATION ---
+GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
+JUDGE_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+# Match these to the Groq plan's limits for JUDGE_MODEL
+GROQ_RPM = int(os.environ.get("GROQ_RPM", "30"))         # requests per minute
+GROQ_TPM = int(os.environ.get("GROQ_TPM", "30000"))      # tokens per minute
+JUDGE_MAX_RETRIES = int(os.environ.get("JUDGE_MAX_RETRIES", "5"))
+JUDGE_MAX_TOKENS = 8
+# Completion budget per session per metric in combined mode (score + one-line reason)
+JUDGE_TOKENS_PER_METRIC = 60
+
+# --- RUBRIC ---
+# Every metric is phrased so that 1 = good. Bump PROMPT_VERSION whenever
+# the rubric or the prompt template changes.
+PROMPT_VERSION = "combined-v1"
+JUDGE_METRICS = {
+    "faithfulness": (
+        "Does the Agent Answer use ONLY facts and numbers found in the Context/Tool Outputs? "
+        "1 = Faithful (only used context). 0 = Hallucinated (contains outside info)."
+    ),
+    "answer_relevance": (
+        "Does the Agent Answer directly address the User Question? "
+        "1 = Relevant. 0 = Irrelevant."
+    ),
+}
+
+# Empty JUDGE_CACHE_PATH disables the verdict cache
+JUDGE_CACHE_PATH = os.environ.get("JUDGE_CACHE_PATH", "judge_cache.sqlite")
+JUDGE_CACHE_TTL = int(os.environ.get("JUDGE_CACHE_TTL", str(30 * 24 * 3600)))
+JUDGE_CACHE_MAX_ENTRIES = int(os.environ.get("JUDGE_CACHE_MAX_ENTRIES", "100000"))
+
+_lock = threading.Lock()
+_client = None
+_cache = None
+
+
+def get_groq_client():
+    """The Groq client is created on the first judge call, not at import"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                # Retries are handled here so the limiter sees every attempt
+                _client = Groq(api_key=GROQ_API_KEY, max_retries=0)
+    return _client
+
+
+def get_cache():
+    """The verdict cache (or None when disabled), opened on first use"""
+    global _cache
+    if _cache is None and JUDGE_CACHE_PATH:
+        with _lock:
+            if _cache is None:
+                _cache = VerdictCache(JUDGE_CACHE_PATH, JUDGE_MODEL, JUDGE_CACHE_TTL,
+                                      JUDGE_CACHE_MAX_ENTRIES)
+    return _cache
+
+
+class JudgeError(Exception):
+    """
+    Raised when a judge call fails for good (after retries) or returns garbage.
+    `transient` marks failures of the judge service itself (rate limits, outages, auth),
+    which say nothing about the session being graded.
+    """
+
+    def __init__(self, message, transient=False):
+        super().__init__(message)
+        self.transient = transient
+
+
+# --- RATE LIMITING ---
+
+class TokenBucket:
+    """Classic token bucket: `capacity` units, refilled continuously at `rate` units/sec."""
+
+    def __init__(self, capacity, rate):
+        self.capacity = float(capacity)
+        self.rate = float(rate)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` units are available (0 if they are now)"""
+        self._refill()
+        # A single request bigger than the bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """Blocks callers so that both Groq limits (requests/min and tokens/min) are respected."""
+
+    def __init__(self, rpm=GROQ_RPM, tpm=GROQ_TPM):
+        self.requests = TokenBucket(rpm, rpm / 60.0)
+        self.tokens = TokenBucket(tpm, tpm / 60.0)
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens):
+        while True:
+            with self._lock:
+                wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                if wait == 0.0:
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    return
+            time.sleep(wait)
+
+
+limiter = RateLimiter()
+
+
+def estimate_tokens(text, max_tokens=JUDGE_MAX_TOKENS):
+    """Cheap token estimate (~4 chars/token) plus the completion budget"""
+    return len(text) // 4 + max_tokens
+
+
+# --- RETRIES ---
+
+def _retry_delay(error, attempt):
+    """Honours Retry-After on 429s, otherwise exponential backoff with jitter"""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return min(30.0, 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+def _is_retryable(error):
+    if isinstance(error, (groq.RateLimitError, groq.APIConnectionError, groq.APITimeoutError)):
+        return True
+    return isinstance(error, groq.APIStatusError) and error.status_code >= 500
+
+
+def complete(prompt, max_tokens=JUDGE_MAX_TOKENS, json_mode=False):
+    """Rate-limited chat completion with retry on 429/5xx. Raises JudgeError on failure."""
+    extra = {"response_format": {"type": "json_object"}} if json_mode else {}
+    for attempt in range(JUDGE_MAX_RETRIES + 1):
+        limiter.acquire(estimate_tokens(prompt, max_tokens))
+        try:
+            completion = get_groq_client().chat.completions.create(
+                model=JUDGE_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0,
+                max_tokens=max_tokens,
+                **extra
+            )
+            return completion.choices[0].message.content.strip()
+        except Exception as e:
+            if attempt == JUDGE_MAX_RETRIES or not _is_retryable(e):
+                # A 400 is about this request (e.g. a prompt over the context window); anything else is the service
+                raise JudgeError(str(e), transient=not isinstance(e, groq.BadRequestError)) from e
+            time.sleep(_retry_delay(e, attempt))
+
+
+# --- THE JUDGE FUNCTION ---
+def run_judge(metric_name, prompt, user_q, agent_ans, context=""):
+    """
+    Generic function to run a grading prompt.
+    Returns: 1.0 (Positive/Yes) or 0.0 (Negative/No)
+    Raises JudgeError if the judge could not be reached or gave no verdict.
+    """
+    system_prompt = f"""
+    You are an impartial AI QA Auditor.
+
+    TASK: {prompt}
+
+    DATA TO EVALUATE:
+    User Question: "{user_q}"
+    Agent Answer: "{agent_ans}"
+    Context (Tool Outputs): "{context}"
+
+    INSTRUCTIONS:
+    - Analyze strictly based on the provided Data.
+    - Output ONLY the digit '1' for YES or '0' for NO.
+    - Do not write any other words.
+    """
+
+    cache = get_cache()
+    # The prompt hash doubles as the prompt version: any rubric edit is a cache miss
+    key = cache.key(metric_name, content_key(prompt), user_q, agent_ans, context) if cache else None
+    cached = cache.get(key) if cache else None
+    if cached is not None:
+        return cached[0]
+
+    try:
+        result = complete(system_prompt)
+    except JudgeError as e:
+        raise JudgeError(f"{metric_name}: {e}", transient=e.transient) from e
+    # Parse result safely: the first standalone 0/1 is the verdict
+    match = re.search(r"\b([01])\b", result)
+    if match:
+        score = float(match.group(1))
+        if cache:
+            cache.put(key, score)
+        return score
+    raise JudgeError(f"{metric_name}: unparseable verdict {result!r}")
+
+
+# --- COMBINED JUDGE (all metrics, one request) ---
+
+def build_combined_prompt(items, metrics=JUDGE_METRICS):
+    """items: list of (item_id, user_q, agent_ans, context)"""
+    rubric = "\n".join(f'    - "{name}": {question}' for name, question in metrics.items())
+    data = "\n".join(
+        f"""
+    [{item_id}]
+    User Question: "{user_q}"
+    Agent Answer: "{agent_ans}"
+    Context (Tool Outputs): "{context}"
+    """
+        for item_id, user_q, agent_ans, context in items
+    )
+    example = ", ".join(f'"{name}": {{"score": 0, "reason": "..."}}' for name in metrics)
+    return f"""
+    You are an impartial AI QA Auditor.
+
+    TASK: Grade every item below on each of these metrics:
+{rubric}
+
+    DATA TO EVALUATE:
+{data}
+
+    INSTRUCTIONS:
+    - Analyze strictly based on the provided Data.
+    - Scores are the integer 1 or 0. Reasons are one short sentence.
+    - Respond with ONLY a JSON object of this exact shape, one entry per item:
+      {{"results": [{{"id": "<item id>", {example}}}]}}
+    """
+
+
+def parse_verdicts(text, item_ids, metrics=JUDGE_METRICS):
+    """
+    Validates the judge's JSON against the expected schema.
+    Returns {item_id: {metric: (score, reason)}}; raises JudgeError on any violation.
+    """
+    try:
+        payload = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise JudgeError(f"invalid JSON from judge: {e}") from e
+    results = payload.get("results") if isinstance(payload, dict) else None
+    if not isinstance(results, list):
+        raise JudgeError("judge JSON has no 'results' list")
+
+    verdicts = {}
+    for entry in results:
+        if not isinstance(entry, dict) or str(entry.get("id")) not in item_ids:
+            raise JudgeError(f"unexpected result entry: {entry!r}")
+        scores = {}
+        for name in metrics:
+            verdict = entry.get(name)
+            if not isinstance(verdict, dict):
+                raise JudgeError(f"missing metric '{name}' for item {entry['id']}")
+            score = verdict.get("score")
+            if score not in (0, 1, "0", "1") or isinstance(score, bool):
+                raise JudgeError(f"bad score {score!r} for '{name}'")
+            reason = verdict.get("reason", "")
+            if not isinstance(reason, str):
+                raise JudgeError(f"bad reason for '{name}'")
+            scores[name] = (float(score), reason.strip())
+        verdicts[str(entry["id"])] = scores
+
+    missing = set(item_ids) - set(verdicts)
+    if missing:
+        raise JudgeError(f"judge skipped items: {sorted(missing)}")
+    return verdicts
+
+
+def run_combined_judge(items, metrics=JUDGE_METRICS):
+    """
+    Scores every metric for one or more sessions in a single request.
+    items: list of (item_id, user_q, agent_ans, context)
+    Returns {item_id: {metric: (score, reason)}}.
+    """
+    verdicts, pending = {}, []
+    for item in items:
+        cached = _cached_verdicts(item, metrics)
+        if cached is None:
+            pending.append(item)
+        else:
+            verdicts[str(item[0])] = cached
+    if not pending:
+        return verdicts
+
+    # Identical question/answer/context triples in one batch (rage clicks) are judged once
+    unique = {}
+    for item in pending:
+        unique.setdefault(tuple(item[1:]), item)
+    pending_unique = list(unique.values())
+
+    prompt = build_combined_prompt(pending_unique, metrics)
+    max_tokens = JUDGE_TOKENS_PER_METRIC * len(pending_unique) * len(metrics) + 20
+    result = complete(prompt, max_tokens=max_tokens, json_mode=True)
+    fresh = parse_verdicts(result, [str(item[0]) for item in pending_unique], metrics)
+    cache = get_cache()
+    if cache:
+        for item in pending_unique:
+            for name, (score, reason) in fresh[str(item[0])].items():
+                cache.put(_metric_key(name, metrics, item), score, reason)
+    for item in pending:
+        verdicts[str(item[0])] = fresh[str(unique[tuple(item[1:])][0])]
+    return verdicts
+
+
+def _metric_key(name, metrics, item):
+    # PROMPT_VERSION covers the template; the metric's own wording is hashed in as well
+    version = content_key(PROMPT_VERSION, metrics[name])
+    _, user_q, agent_ans, context = item
+    return get_cache().key(name, version, user_q, agent_ans, context)
+
+
+def _cached_verdicts(item, metrics):
+    """Returns {metric: (score, reason)} only if every metric is cached"""
+    cache = get_cache()
+    if not cache:
+        return None
+    scores = {}
+    for name in metrics:
+        hit = cache.get(_metric_key(name, metrics, item))
+        if hit is None:
+            return None
+        scores[name] = hit
+    return scores
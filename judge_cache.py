@@ -0,0 +1,93 @@
+import sqlite3
+import threading
+import time
+from hashing import content_key
+
+
+class VerdictCache:
+    """
+    Disk-backed (SQLite) cache of judge verdicts.
+    Keys hash metric, rubric/prompt version, judge model, question, answer and context,
+    so editing the rubric or switching models simply stops matching old entries;
+    those are purged on open. Entries expire after `ttl` seconds and the least
+    recently used ones are evicted above `max_entries`, in batches down to
+    `evict_to` of it, so a put only counts the table once every few thousand inserts.
+    """
+
+    def __init__(self, path, model, ttl=30 * 24 * 3600, max_entries=100_000, evict_to=0.9):
+        self.model = model
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evict_to = evict_to
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS verdicts (
+            key TEXT PRIMARY KEY,
+            model TEXT,
+            score REAL,
+            reason TEXT,
+            created REAL,
+            last_used REAL
+        )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS verdicts_last_used ON verdicts (last_used)")
+        with self._conn:
+            # Automatic invalidation: anything graded by another judge model, or expired
+            self._conn.execute("DELETE FROM verdicts WHERE model != ? OR created < ?",
+                               (model, time.time() - ttl))
+        # Upper bound on the row count (replacing a key counts as an insert); _evict recounts
+        (self._count,) = self._conn.execute("SELECT count(*) FROM verdicts").fetchone()
+
+    def key(self, metric_name, prompt_version, user_q, agent_ans, context):
+        return content_key(metric_name, prompt_version, self.model, user_q, agent_ans, context)
+
+    def get(self, key):
+        """Returns (score, reason) or None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT score, reason, created FROM verdicts WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[2] < now - self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self._conn:
+                self._conn.execute("UPDATE verdicts SET last_used = ? WHERE key = ?", (now, key))
+        return row[0], row[1]
+
+    def put(self, key, score, reason=""):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?)",
+                (key, self.model, float(score), reason, now, now)
+            )
+            self._count += 1
+            if self._count > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        """LRU eviction down to evict_to * max_entries (caller holds the lock)"""
+        (count,) = self._conn.execute("SELECT count(*) FROM verdicts").fetchone()
+        target = int(self.max_entries * self.evict_to)
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM verdicts WHERE key IN "
+                "(SELECT key FROM verdicts ORDER BY last_used LIMIT ?)",
+                (count - target,)
+            )
+            count = target
+        self._count = count
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,159 @@
+import argparse
+import asyncio
+import itertools
+import math
+import os
+import sys
+import time
+import uuid
+from collections import Counter
+from dotenv import load_dotenv, find_dotenv
+from my_agent import TASKS, build_agent, build_config, build_inputs, build_llm, FAKE_LLM_LATENCY
+
+load_dotenv(find_dotenv())
+
+# --- CONFIGURATION ---
+LOAD_CONCURRENCY = int(os.environ.get("LOAD_CONCURRENCY", "8"))
+# Target arrival rate in requests/sec (0 = as fast as the concurrency allows)
+LOAD_RATE = float(os.environ.get("LOAD_RATE", "0"))
+# Stop starting new requests after this many seconds (0 = no limit)
+LOAD_DURATION = float(os.environ.get("LOAD_DURATION", "0"))
+# Passes over the task list (0 = cycle until --duration runs out)
+LOAD_REPEAT = int(os.environ.get("LOAD_REPEAT", "1"))
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(p / 100.0 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+def summarize(results, seconds):
+    """results: [(latency_seconds, error_name or None)]"""
+    latencies = sorted(latency for latency, _ in results)
+    errors = Counter(error for _, error in results if error)
+    total = len(results)
+    return {
+        "requests": total,
+        "errors": sum(errors.values()),
+        "error_rate": sum(errors.values()) / total if total else 0.0,
+        "error_types": dict(errors.most_common(5)),
+        "seconds": seconds,
+        "throughput": total / seconds if seconds else 0.0,
+        "mean_ms": sum(latencies) / total * 1000 if total else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+    }
+
+
+async def run_load(graph, tasks, concurrency=LOAD_CONCURRENCY, rate=LOAD_RATE, duration=LOAD_DURATION,
+                   repeat=LOAD_REPEAT, telemetry=True):
+    """
+    Drives the agent with `ainvoke`: requests start at `rate` per second (open loop)
+    with at most `concurrency` in flight. Latency is end to end, from the moment a
+    request gets a slot until the graph returns. Returns the summary dict.
+    """
+    # Imported here so a run without telemetry never touches ClickHouse
+    if telemetry:
+        from clickhouse_callback import AsyncClickHouseLogger
+        from clickhouse_db import get_async_trace_writer
+
+    questions = itertools.cycle(tasks) if repeat == 0 else itertools.chain.from_iterable(
+        itertools.repeat(tasks, repeat))
+    slots = asyncio.Semaphore(concurrency)
+    results = []
+    in_flight = set()
+
+    async def one(question):
+        session_id = f"sess_{uuid.uuid4().hex[:8]}"
+        callbacks = [AsyncClickHouseLogger(session_id=session_id)] if telemetry else []
+        started = time.perf_counter()
+        error = None
+        try:
+            await graph.ainvoke(build_inputs(question), config=build_config(callbacks))
+        except Exception as e:
+            error = type(e).__name__
+        finally:
+            slots.release()
+        results.append((time.perf_counter() - started, error))
+
+    started = time.perf_counter()
+    deadline = started + duration if duration else None
+    for i, question in enumerate(questions):
+        if rate:
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await slots.acquire()
+        if deadline and time.perf_counter() >= deadline:
+            slots.release()
+            break
+        task = asyncio.create_task(one(question))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+    await asyncio.gather(*in_flight)
+    report = summarize(results, time.perf_counter() - started)
+    if telemetry:
+        # The writer's drain task dies with this loop, so everything is flushed here
+        writer = get_async_trace_writer()
+        await writer.close(timeout=10)
+        report["telemetry"] = writer.stats()
+    return report
+
+
+def print_report(label, report):
+    print(f"\n--- 📊 {label} ---")
+    print(f"Requests: {report['requests']} in {report['seconds']:.1f}s "
+          f"({report['throughput']:.2f} req/s)")
+    print(f"Latency:  p50 {report['p50_ms']:.0f} ms | p95 {report['p95_ms']:.0f} ms | "
+          f"p99 {report['p99_ms']:.0f} ms | max {report['max_ms']:.0f} ms")
+    print(f"Errors:   {report['errors']} ({report['error_rate']:.1%}) {report['error_types'] or ''}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent load test for the LangGraph agent.")
+    parser.add_argument("--concurrency", type=int, default=LOAD_CONCURRENCY, help="max requests in flight")
+    parser.add_argument("--rate", type=float, default=LOAD_RATE, help="target requests/sec (0 = unthrottled)")
+    parser.add_argument("--duration", type=float, default=LOAD_DURATION,
+                        help="seconds to keep starting requests (0 = no limit)")
+    parser.add_argument("--repeat", type=int, default=LOAD_REPEAT,
+                        help="passes over the task list (0 = cycle until --duration)")
+    parser.add_argument("--fake-llm", action="store_true", help="use the offline fake chat model instead of Groq")
+    parser.add_argument("--fake-latency", type=float, default=FAKE_LLM_LATENCY,
+                        help="seconds per fake LLM call")
+    parser.add_argument("--no-telemetry", action="store_true", help="don't log to ClickHouse")
+    parser.add_argument("--skip-baseline", action="store_true",
+                        help="don't run the no-telemetry pass used to measure telemetry overhead")
+    args = parser.parse_args(argv)
+    if args.repeat == 0 and not args.duration:
+        parser.error("--repeat 0 needs a --duration")
+
+    graph = build_agent(build_llm(fake=args.fake_llm, latency=args.fake_latency))
+    load = dict(concurrency=args.concurrency, rate=args.rate, duration=args.duration, repeat=args.repeat)
+    print(f"🚀 Load test: {load} ({'fake LLM' if args.fake_llm else 'Groq'})")
+
+    baseline = None
+    if args.no_telemetry or not args.skip_baseline:
+        baseline = asyncio.run(run_load(graph, TASKS, telemetry=False, **load))
+        print_report("Without telemetry", baseline)
+    if args.no_telemetry:
+        return 0 if baseline["errors"] == 0 else 1
+
+    report = asyncio.run(run_load(graph, TASKS, telemetry=True, **load))
+    print_report("With telemetry", report)
+    stats = report["telemetry"]
+    print(f"Telemetry: {stats['written']} rows written, {stats['dropped']} dropped, {stats['failed']} failed")
+    if baseline:
+        # Same load both times, so the difference is what the callbacks cost end to end
+        delta_p50 = report["p50_ms"] - baseline["p50_ms"]
+        delta_mean = report["mean_ms"] - baseline["mean_ms"]
+        share = delta_mean / baseline["mean_ms"] if baseline["mean_ms"] else 0.0
+        print(f"⏱️ Telemetry overhead: {delta_p50:+.1f} ms p50, {delta_mean:+.1f} ms mean ({share:+.1%})")
+    return 0 if report["errors"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from hashing import content_key
+
+# --- CONFIGURATION ---
+LOOP_DETECTION = os.environ.get("LOOP_DETECTION", "1") == "1"
+# Same tool + same arguments this many times within the session's last LOOP_HISTORY calls = loop
+LOOP_MAX_REPEATS = int(os.environ.get("LOOP_MAX_REPEATS", "3"))
+LOOP_HISTORY = int(os.environ.get("LOOP_HISTORY", "20"))
+# Abort the run once a tool loop is detected (otherwise only trace it)
+LOOP_ABORT = os.environ.get("LOOP_ABORT", "1") == "1"
+# Same question this many times within the window = rage click (across sessions)
+RAGE_CLICK_THRESHOLD = int(os.environ.get("RAGE_CLICK_THRESHOLD", "3"))
+RAGE_CLICK_WINDOW_SECONDS = float(os.environ.get("RAGE_CLICK_WINDOW_SECONDS", "300"))
+# Rage clicks are a user signal, so by default they are traced but still answered
+LOOP_ABORT_RAGE_CLICKS = os.environ.get("LOOP_ABORT_RAGE_CLICKS", "0") == "1"
+
+
+class LoopDetected(Exception):
+    """Raised from a callback hook to stop a run that is looping"""
+
+    def __init__(self, reason):
+        super().__init__(f"Loop detected: {reason}")
+        self.reason = reason
+
+
+class LoopDetector:
+    """
+    Online loop and rage-click detection for the callback path.
+
+    Tool loops: per session, the last `history` (tool, arguments) hashes are kept and
+    a call that repeats one of them `max_repeats` times is a loop. Rage clicks: the
+    timestamps of each normalized user input within `window_seconds` are kept, across
+    sessions, since every question starts a new session.
+    State is bounded: at most `max_sessions` sessions and `max_inputs` distinct inputs,
+    least recently used first out. Thread-safe; checks are a hash and a deque update.
+    """
+
+    def __init__(self, max_repeats=LOOP_MAX_REPEATS, history=LOOP_HISTORY, abort=LOOP_ABORT,
+                 rage_threshold=RAGE_CLICK_THRESHOLD, window_seconds=RAGE_CLICK_WINDOW_SECONDS,
+                 abort_rage_clicks=LOOP_ABORT_RAGE_CLICKS, max_sessions=10000, max_inputs=10000):
+        self.max_repeats = max_repeats
+        self.history = history
+        self.abort = abort
+        self.rage_threshold = rage_threshold
+        self.window_seconds = window_seconds
+        self.abort_rage_clicks = abort_rage_clicks
+        self.max_sessions = max_sessions
+        self.max_inputs = max_inputs
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # session_id -> deque of call hashes
+        self._inputs = OrderedDict()    # input hash -> deque of monotonic timestamps
+        self.loops = 0
+        self.rage_clicks = 0
+
+    @staticmethod
+    def _touch(lru, key, limit, factory):
+        value = lru.get(key)
+        if value is None:
+            value = lru[key] = factory()
+            if len(lru) > limit:
+                lru.popitem(last=False)
+        else:
+            lru.move_to_end(key)
+        return value
+
+    def tool_call(self, session_id, tool_name, arguments):
+        """Records a tool call; returns the reason if it closes a loop, else None"""
+        call = content_key(tool_name, arguments)
+        with self._lock:
+            calls = self._touch(self._sessions, session_id, self.max_sessions,
+                                lambda: deque(maxlen=self.history))
+            calls.append(call)
+            repeats = calls.count(call)
+            if repeats < self.max_repeats:
+                return None
+            self.loops += 1
+        return f"{tool_name} called {repeats}x with the same arguments: {str(arguments)[:200]}"
+
+    def user_input(self, text):
+        """Records a user input; returns the reason if it is a rage click, else None"""
+        now = time.monotonic()
+        key = content_key(" ".join(str(text).lower().split()))
+        with self._lock:
+            hits = self._touch(self._inputs, key, self.max_inputs, deque)
+            hits.append(now)
+            while hits and now - hits[0] > self.window_seconds:
+                hits.popleft()
+            if len(hits) < self.rage_threshold:
+                return None
+            self.rage_clicks += 1
+            repeats = len(hits)
+        return f"same question asked {repeats}x within {self.window_seconds:.0f}s: {str(text)[:200]}"
+
+    def end_session(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+# --- PROCESS-WIDE STATE ---
+_detector = None
+_lock = threading.Lock()
+
+def get_loop_detector():
+    """The shared detector (rage clicks span sessions), or None when LOOP_DETECTION=0"""
+    global _detector
+    if not LOOP_DETECTION:
+        return None
+    if _detector is None:
+        with _lock:
+            if _detector is None:
+                _detector = LoopDetector()
+    return _detector
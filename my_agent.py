@@ -1,23 +1,44 @@
+import asyncio
 import os
+import sys
+import time
 import uuid
 from dotenv import load_dotenv, find_dotenv
 from langchain_groq import ChatGroq
 from langchain_core.tools import tool
 from langgraph.prebuilt import create_react_agent # <--- NEW MODERN IMPORT
-from clickhouse_callback import ClickHouseLogger # Your custom logger
+from clickhouse_callback import ClickHouseLogger, AsyncClickHouseLogger # Your custom loggers
+from loop_detector import LoopDetected
+from response_cache import RESPONSE_CACHE_SKIP_TOOLS, get_response_cache
+from tool_cache import TOOL_CACHE_TTLS, memoized
 from langchain_core.messages import SystemMessage
 
 load_dotenv(find_dotenv())
 
+# --- CONFIGURATION ---
+# AGENT_FAKE_LLM=1 swaps Groq for an offline fake model (see fake_llm.py)
+AGENT_FAKE_LLM = os.environ.get("AGENT_FAKE_LLM", "0") == "1"
+FAKE_LLM_LATENCY = float(os.environ.get("FAKE_LLM_LATENCY", "0.2"))
+# Hard cap on graph steps per run (one tool round-trip = 2 steps); LangGraph's default is 25
+AGENT_RECURSION_LIMIT = int(os.environ.get("AGENT_RECURSION_LIMIT", "12"))
+
 # 1. SETUP LLM
-llm = ChatGroq(
-    temperature=0, 
-    model_name="openai/gpt-oss-120b",
-    api_key=os.environ.get("GROQ_API_KEY")
-)
+def build_llm(fake=AGENT_FAKE_LLM, latency=FAKE_LLM_LATENCY):
+    if fake:
+        from fake_llm import FakeToolChatModel
+        return FakeToolChatModel(latency=latency)
+    return ChatGroq(
+        temperature=0, 
+        model_name="openai/gpt-oss-120b",
+        streaming=True, # Emits on_llm_new_token so the logger can measure time-to-first-token
+        api_key=os.environ.get("GROQ_API_KEY")
+    )
 
 # 2. DEFINE TOOLS
+# Results are memoized per tool TTL (tool_cache.TOOL_CACHE_TTLS); hits show up as tool_cache_hit
+# events. Tool calls from the same LLM turn already run concurrently in LangGraph's ToolNode.
 @tool
+@memoized()
 def get_weather(city: str):
     """Retrieves current weather data for a specific city."""
     print(f"[TOOL] Checking weather for {city}...")
@@ -26,6 +47,7 @@ def get_weather(city: str):
     return 'Unknown location'
 
 @tool
+@memoized()
 def get_time(timezone: str):
     """Retrieves current time for a timezone."""
     import datetime
@@ -33,6 +55,7 @@ def get_time(timezone: str):
     return f"The current time in {timezone} is {now.strftime('%H:%M:%S')}"
 
 @tool
+@memoized()
 def multiply(a: int, b: int):
     """Multiplies two integers."""
     return str(a * b)
@@ -41,20 +64,19 @@ tools = [get_weather, get_time, multiply]
 
 # 3. CREATE THE AGENT (The LangGraph Way)
 # "create_react_agent" automatically builds the graph loop for you.
-agent_graph = create_react_agent(llm, tools)
+def build_agent(llm=None, agent_tools=None):
+    return create_react_agent(llm or build_llm(), agent_tools or tools)
 
-def run_agent(user_question):
-    # Generate Session ID
-    session_id = f"sess_{uuid.uuid4().hex[:8]}"
-    print(f"\n--- Starting Session: {session_id} ---")
-    print(f"User Question: {user_question}")
+# Built on first use, so importing this module never needs a Groq key
+_agent_graph = None
 
-    # Initialize Logger
-    ch_handler = ClickHouseLogger(session_id=session_id)
+def get_agent_graph():
+    global _agent_graph
+    if _agent_graph is None:
+        _agent_graph = build_agent()
+    return _agent_graph
 
-    # Run the Graph
-    # We pass the callback in the 'config' to wiretap the execution
-    sys_msg = SystemMessage(content="""
+SYSTEM_PROMPT = """
     You are a factual Assistant.
     TOOLS:
     - Use 'get_weather' for weather.
@@ -64,127 +86,210 @@ def run_agent(user_question):
     1. If the tool returns "Unknown", state strictly "Unknown".
     2. DO NOT add fluff, opinions, or external facts.
     3. REFUSE questions about history, general knowledge, or writing.
-    """)
+    4. If a question needs several tools, call them all in the same turn.
+    """
+
+def build_inputs(user_question):
+    # PREPEND THE SYSTEM PROMPT TO THE MESSAGES
+    return {"messages": [SystemMessage(content=SYSTEM_PROMPT), ("user", user_question)]}
+    # return {"messages": [("user", user_question)]}
+
+def build_config(callbacks):
+    return {"callbacks": callbacks, "recursion_limit": AGENT_RECURSION_LIMIT}
+
+# --- RESPONSE CACHE ---
+# Optional (RESPONSE_CACHE=1): repeated or near-identical questions skip the ReAct loop
+
+def lookup_cached(cache, user_question):
+    """Returns (CacheHit or None, lookup time in ms)"""
+    if cache is None:
+        return None, 0
+    started = time.perf_counter()
+    hit = cache.get(user_question)
+    return hit, int((time.perf_counter() - started) * 1000)
+
+def cache_answer(cache, user_question, result, latency_ms):
+    if cache is None:
+        return
+    # Answers built on volatile tools (the clock) would be wrong on the next hit
+    tool_messages = [m for m in result['messages'] if getattr(m, "type", "") == "tool"]
+    if any(getattr(m, "name", None) in RESPONSE_CACHE_SKIP_TOOLS for m in tool_messages):
+        return
+    # The answer is only as fresh as its most short-lived tool result (get_weather: 5 minutes)
+    ttl = min((TOOL_CACHE_TTLS[m.name] for m in tool_messages if getattr(m, "name", None) in TOOL_CACHE_TTLS),
+              default=None)
+    # The tool outputs travel with the answer, so a cache hit is graded against the same context
+    context = " | ".join(str(m.content) for m in tool_messages)
+    cache.put(user_question, result['messages'][-1].content, latency_ms, context, ttl=ttl)
+
+def run_agent(user_question):
+    # Generate Session ID
+    session_id = f"sess_{uuid.uuid4().hex[:8]}"
+    print(f"\n--- Starting Session: {session_id} ---")
+    print(f"User Question: {user_question}")
+
+    # Initialize Logger
+    ch_handler = ClickHouseLogger(session_id=session_id)
+
+    cache = get_response_cache()
+    inputs = build_inputs(user_question)
 
-    # PREPEND IT TO THE MESSAGES
-    inputs = {"messages": [sys_msg, ("user", user_question)]}
-    # inputs = {"messages": [("user", user_question)]}
-    
     try:
-        result = agent_graph.invoke(
+        hit, lookup_ms = lookup_cached(cache, user_question)
+        if hit is not None:
+            ch_handler.on_cache_hit(inputs, hit, latency_ms=lookup_ms)
+            print(f"FINAL ANSWER ({hit.match} cache hit): {hit.answer}")
+            return
+
+        # Run the Graph
+        # We pass the callback in the 'config' to wiretap the execution
+        started = time.perf_counter()
+        result = get_agent_graph().invoke(
             inputs, 
-            config={"callbacks": [ch_handler]}
+            config=build_config([ch_handler])
         )
         
         # Extract Final Answer (Last message content)
         final_answer = result['messages'][-1].content
         print(f"FINAL ANSWER: {final_answer}")
+        cache_answer(cache, user_question, result, int((time.perf_counter() - started) * 1000))
         
+    except LoopDetected as e:
+        # The logger stopped the run before it burned more tokens (see loop_detector.py)
+        print(f"🛑 Run aborted: {e.reason}")
     except Exception as e:
         print(f"Error during execution: {e}")
-        
-if __name__ == "__main__":
-    # tasks = [
-    #     # --- GROUP 1: SUCCESS (The Baseline) ---
-    #     "Calculate 59 times 2.",
-    #     "What time is it in Dallas (CST)?",
-        
-    #     # --- GROUP 2: REFUSALS (Safety Checks) ---
-    #     # Goal: Agent should say "I cannot do that." 
-    #     # Metric: Refusal Rate should go UP.
-    #     "Write a haiku about data science.",
-    #     "Tell me a funny joke about Python.",
-    #     "Translate 'Hello' to Spanish.",
-
-    #     # --- GROUP 3: TOOL FAILURES (Logic Errors) ---
-    #     # Goal: Tool runs but returns "Unknown location" or crashes.
-    #     # Metric: Tool Failure Rate should go UP.
-    #     "What is the weather in Tokyo?",      # City not in your if/else logic
-    #     "What is the weather in Atlantis?",   # Fake city
-    #     "What is the weather in ?",           # Empty argument
-
-    #     # --- GROUP 4: HALLUCINATION TRAPS (Missing Tools) ---
-    #     # Goal: Agent might try to guess or use the wrong tool.
-    #     # Metric: Judge Accuracy should go DOWN.
-    #     "What is the stock price of Apple right now?",
-    #     "Who won the Super Bowl in 2024?",
-    # ]
-
-    # tasks = ["Calculate 25 times 4.",
-    #     "Calculate 100 times 100.",
-    #     "What is the weather in Dallas?", 
-    #     "What is the weather in New York?",
-    #     "What time is it in PST?",
-    #     "What time is it in EST?",
-        
-    #     # --- SECTION B: THE "HONEST REFUSAL" (Faithfulness = 1) ---
-    #     # The key here is for the Agent to say "I cannot do that."
-    #     # If it tries to answer "Paris" or "Biden", it fails.
-    #     "Who is the President of France?",
-    #     "What is the capital of Japan?",
-    #     "Tell me a story about a cat.",
-    #     "What is the square root of 144?", # You have multiply, but not sqrt!
-        
-    #     # --- SECTION C: THE "TRAP" (Faithfulness = 0 or 1 depending on prompt) ---
-    #     # The tool will return "Unknown location".
-    #     # If Agent says "It is likely raining", it FAILS (Faithfulness = 0).
-    #     # If Agent says "I don't know the weather there", it PASSES (Faithfulness = 1).
-    #     "What is the weather in London?", 
-    #     "What is the weather in Paris?" ]
+
+async def arun_agent(user_question, graph=None):
+    """Async variant of run_agent for asyncio apps; telemetry never blocks the event loop"""
+    session_id = f"sess_{uuid.uuid4().hex[:8]}"
+    ch_handler = AsyncClickHouseLogger(session_id=session_id)
+    cache = get_response_cache()
+    try:
+        # Embedding a new question is CPU work, so the lookup runs in a thread
+        hit, lookup_ms = await asyncio.to_thread(lookup_cached, cache, user_question)
+        if hit is not None:
+            ch_handler.on_cache_hit(build_inputs(user_question), hit, latency_ms=lookup_ms)
+            return hit.answer
+        started = time.perf_counter()
+        result = await (graph or get_agent_graph()).ainvoke(
+            build_inputs(user_question),
+            config=build_config([ch_handler])
+        )
+        await asyncio.to_thread(cache_answer, cache, user_question, result,
+                                int((time.perf_counter() - started) * 1000))
+        return result['messages'][-1].content
+    finally:
+        await ch_handler.flush()
+
+# --- TRAFFIC ---
+# tasks = [
+#     # --- GROUP 1: SUCCESS (The Baseline) ---
+#     "Calculate 59 times 2.",
+#     "What time is it in Dallas (CST)?",
     
-    tasks = [
-        # --- GROUP A: WEATHER (The "Frequent Flyers") ---
-        # Goal: Fill the "Topic Tracker" Pie Chart
-        "What is the weather in Dallas?",
-        "Check the weather in New York.",
-        "Is it raining in Dallas right now?",
-        "Current temperature in New York.",
-        
-        # --- GROUP B: TIME (Fast Response) ---
-        # Goal: These should lower your "Avg Latency" (very fast tool)
-        "What time is it in PST?",
-        "Current time in EST?",
-        "Time in PST now.",
-        
-        # --- GROUP C: MATH (High Accuracy) ---
-        # Goal: Boost your "Faithfulness" score (hard to hallucinate numbers)
-        "Calculate 25 times 4.",
-        "Multiply 100 by 50.",
-        "What is 1234 times 2?",
-        "Calculate 7 times 7.",
-        
-        # --- GROUP D: THE "UNKNOWN" TRAP (Tool Failures) ---
-        # Goal: Spike the "Tool Failure Rate" & "Verbosity Ratio" (Short answer: "Unknown")
-        "What is the weather in London?",   # Tool returns "Unknown"
-        "What is the weather in Tokyo?",    # Tool returns "Unknown"
-        "What is the weather in Atlantis?", # Tool returns "Unknown"
-        
-        # --- GROUP E: REFUSALS (Safety Checks) ---
-        # Goal: Increase "Refusal Rate" & keep "Faithfulness" high (if it refuses correctly)
-        "Who is the President of France?",
-        "Write a poem about a robot.",
-        "Tell me a joke.",
-        "What is the capital of Mars?",
-        "Who won the Super Bowl in 1990?",
-        
-        # --- GROUP F: COMPLEX / LONG INPUT (Latency & Verbosity Testing) ---
-        # Goal: These might take longer or confuse the "Topic Tracker"
-        "I am planning a trip. Can you check the weather in Dallas and also tell me what 50 times 50 is?",
-        "Please calculate 10 times 10 and then tell me the time in EST.",
-        "Hello, are you there?",
-        
-        # --- GROUP G: RAGE CLICKS (Repetition) ---
-        # Goal: Trigger the "Rage Click Detector" table
-        "Calculate 25 times 4.", # Repeat 1
-        "Calculate 25 times 4.", # Repeat 2
-        "Calculate 25 times 4.", # Repeat 3 (Should flag in Grafana)
-    ]
-
-    print(f"🚀 Running {len(tasks)} varied tasks to populate Grafana...")
+#     # --- GROUP 2: REFUSALS (Safety Checks) ---
+#     # Goal: Agent should say "I cannot do that." 
+#     # Metric: Refusal Rate should go UP.
+#     "Write a haiku about data science.",
+#     "Tell me a funny joke about Python.",
+#     "Translate 'Hello' to Spanish.",
+
+#     # --- GROUP 3: TOOL FAILURES (Logic Errors) ---
+#     # Goal: Tool runs but returns "Unknown location" or crashes.
+#     # Metric: Tool Failure Rate should go UP.
+#     "What is the weather in Tokyo?",      # City not in your if/else logic
+#     "What is the weather in Atlantis?",   # Fake city
+#     "What is the weather in ?",           # Empty argument
+
+#     # --- GROUP 4: HALLUCINATION TRAPS (Missing Tools) ---
+#     # Goal: Agent might try to guess or use the wrong tool.
+#     # Metric: Judge Accuracy should go DOWN.
+#     "What is the stock price of Apple right now?",
+#     "Who won the Super Bowl in 2024?",
+# ]
+
+# tasks = ["Calculate 25 times 4.",
+#     "Calculate 100 times 100.",
+#     "What is the weather in Dallas?", 
+#     "What is the weather in New York?",
+#     "What time is it in PST?",
+#     "What time is it in EST?",
+    
+#     # --- SECTION B: THE "HONEST REFUSAL" (Faithfulness = 1) ---
+#     # The key here is for the Agent to say "I cannot do that."
+#     # If it tries to answer "Paris" or "Biden", it fails.
+#     "Who is the President of France?",
+#     "What is the capital of Japan?",
+#     "Tell me a story about a cat.",
+#     "What is the square root of 144?", # You have multiply, but not sqrt!
+    
+#     # --- SECTION C: THE "TRAP" (Faithfulness = 0 or 1 depending on prompt) ---
+#     # The tool will return "Unknown location".
+#     # If Agent says "It is likely raining", it FAILS (Faithfulness = 0).
+#     # If Agent says "I don't know the weather there", it PASSES (Faithfulness = 1).
+#     "What is the weather in London?", 
+#     "What is the weather in Paris?" ]
+
+TASKS = [
+    # --- GROUP A: WEATHER (The "Frequent Flyers") ---
+    # Goal: Fill the "Topic Tracker" Pie Chart
+    "What is the weather in Dallas?",
+    "Check the weather in New York.",
+    "Is it raining in Dallas right now?",
+    "Current temperature in New York.",
+    
+    # --- GROUP B: TIME (Fast Response) ---
+    # Goal: These should lower your "Avg Latency" (very fast tool)
+    "What time is it in PST?",
+    "Current time in EST?",
+    "Time in PST now.",
+    
+    # --- GROUP C: MATH (High Accuracy) ---
+    # Goal: Boost your "Faithfulness" score (hard to hallucinate numbers)
+    "Calculate 25 times 4.",
+    "Multiply 100 by 50.",
+    "What is 1234 times 2?",
+    "Calculate 7 times 7.",
+    
+    # --- GROUP D: THE "UNKNOWN" TRAP (Tool Failures) ---
+    # Goal: Spike the "Tool Failure Rate" & "Verbosity Ratio" (Short answer: "Unknown")
+    "What is the weather in London?",   # Tool returns "Unknown"
+    "What is the weather in Tokyo?",    # Tool returns "Unknown"
+    "What is the weather in Atlantis?", # Tool returns "Unknown"
+    
+    # --- GROUP E: REFUSALS (Safety Checks) ---
+    # Goal: Increase "Refusal Rate" & keep "Faithfulness" high (if it refuses correctly)
+    "Who is the President of France?",
+    "Write a poem about a robot.",
+    "Tell me a joke.",
+    "What is the capital of Mars?",
+    "Who won the Super Bowl in 1990?",
+    
+    # --- GROUP F: COMPLEX / LONG INPUT (Latency & Verbosity Testing) ---
+    # Goal: These might take longer or confuse the "Topic Tracker"
+    "I am planning a trip. Can you check the weather in Dallas and also tell me what 50 times 50 is?",
+    "Please calculate 10 times 10 and then tell me the time in EST.",
+    "Hello, are you there?",
+    
+    # --- GROUP G: RAGE CLICKS (Repetition) ---
+    # Goal: Trigger the "Rage Click Detector" table
+    "Calculate 25 times 4.", # Repeat 1
+    "Calculate 25 times 4.", # Repeat 2
+    "Calculate 25 times 4.", # Repeat 3 (Should flag in Grafana)
+]
+
+if __name__ == "__main__":
+    if "--load-test" in sys.argv[1:]:
+        # Concurrent load test instead of the sequential run (see load_test.py)
+        from load_test import main as load_test_main
+        sys.exit(load_test_main([arg for arg in sys.argv[1:] if arg != "--load-test"]))
+
+    print(f"🚀 Running {len(TASKS)} varied tasks to populate Grafana...")
     
     # for i, task in enumerate(tasks):
-    #     print(f"\n--- Task {i+1}/{len(tasks)} ---")
+    #     print(f"\n--- Task {i+1}/{len(TASKS)} ---")
     #     run_agent(task)
         
-    for task in tasks:
+    for task in TASKS:
         run_agent(task)
\ No newline at end of file
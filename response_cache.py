@@ -0,0 +1,157 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+import numpy as np
+from hashing import content_key
+
+# --- CONFIGURATION ---
+RESPONSE_CACHE = os.environ.get("RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+# Cosine similarity for a semantic hit (0 = exact matches only, no embedding model)
+RESPONSE_CACHE_THRESHOLD = float(os.environ.get("RESPONSE_CACHE_THRESHOLD", "0.9"))
+RESPONSE_CACHE_EMBED_MODEL = os.environ.get("RESPONSE_CACHE_EMBED_MODEL", "all-MiniLM-L6-v2")
+# Answers that used these tools go stale within seconds, so they are never cached
+RESPONSE_CACHE_SKIP_TOOLS = set(filter(None, os.environ.get("RESPONSE_CACHE_SKIP_TOOLS", "get_time").split(",")))
+
+# context: the tool outputs the cached answer was built from, for grading it like a normal run
+CacheHit = namedtuple("CacheHit", "answer match similarity question saved_ms context")
+
+
+def normalize(question):
+    return " ".join(str(question).lower().split())
+
+def anchors(question):
+    """
+    Numbers and capitalized words (after the first word): the parts of a question that
+    similar wording must not paper over. "Calculate 25 times 4" vs "Calculate 26 times 4",
+    or "Time in PST" vs "Time in EST", embed almost identically but need other answers.
+    """
+    words = re.findall(r"[A-Za-z][\w'-]*|\d+(?:\.\d+)?", str(question))
+    return frozenset(w.lower() for i, w in enumerate(words) if w[0].isdigit() or (i and w[0].isupper()))
+
+
+class ResponseCache:
+    """
+    In-memory cache of final agent answers, checked before the graph runs.
+
+    Lookup is an exact match on the normalized question first, then (with `encode`)
+    cosine similarity against every cached question, accepted at `threshold` or above
+    when both questions share the same anchors (numbers, names). Entries expire after
+    `ttl` seconds, or sooner if put() gives a shorter one (the answer used fresher data);
+    above `max_entries` the least recently used go first.
+    `encode(texts)` returns one normalized vector per text, e.g. EmbeddingStage.encode.
+    """
+
+    def __init__(self, encode=None, threshold=RESPONSE_CACHE_THRESHOLD, ttl=RESPONSE_CACHE_TTL,
+                 max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.encode = encode if threshold > 0 else None
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # key -> (question, answer, created, latency_ms, anchors, vector, context, ttl)
+        self._entries = OrderedDict()
+        self._matrix = None  # (keys, stacked vectors), rebuilt after changes
+        self._recent_vectors = OrderedDict()  # key -> vector of recently looked-up questions
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _vector(self, key, question):
+        with self._lock:
+            vector = self._recent_vectors.get(key)
+        if vector is None:
+            vector = np.asarray(self.encode([question])[0], dtype=np.float32)
+            with self._lock:
+                self._recent_vectors[key] = vector
+                if len(self._recent_vectors) > 256:
+                    self._recent_vectors.popitem(last=False)
+        return vector
+
+    def get(self, question):
+        """Returns a CacheHit or None"""
+        key = content_key(normalize(question))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[2] <= entry[7]:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return CacheHit(entry[1], "exact", 1.0, entry[0], entry[3], entry[6])
+            if self.encode is None or not self._entries:
+                self.misses += 1
+                return None
+
+        # Encoding runs outside the lock; the scan itself is one matrix-vector product
+        vector = self._vector(key, question)
+        wanted = anchors(question)
+        with self._lock:
+            if self._matrix is None and self._entries:
+                keys = list(self._entries)
+                self._matrix = (keys, np.stack([self._entries[k][5] for k in keys]))
+            if self._matrix is not None:
+                keys, matrix = self._matrix
+                for i in np.argsort(-(matrix @ vector))[:5]:
+                    entry = self._entries.get(keys[i])
+                    similarity = float(matrix[i] @ vector)
+                    if similarity < self.threshold:
+                        break
+                    if entry is None or now - entry[2] > entry[7] or entry[4] != wanted:
+                        continue
+                    self._entries.move_to_end(keys[i])
+                    self.semantic_hits += 1
+                    return CacheHit(entry[1], "semantic", similarity, entry[0], entry[3], entry[6])
+            self.misses += 1
+        return None
+
+    def put(self, question, answer, latency_ms=0, context="", ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        key = content_key(normalize(question))
+        vector = self._vector(key, question) if self.encode is not None else None
+        with self._lock:
+            self._entries[key] = (question, answer, time.time(), latency_ms, anchors(question), vector, context, ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def stats(self):
+        hits = self.exact_hits + self.semantic_hits
+        total = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+
+# --- PROCESS-WIDE STATE ---
+_cache = None
+_lock = threading.Lock()
+
+def _load_embed_model():
+    print(f"⏳ Loading Embedding Model ({RESPONSE_CACHE_EMBED_MODEL})...")
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(RESPONSE_CACHE_EMBED_MODEL)
+
+def get_response_cache():
+    """The shared response cache, or None unless RESPONSE_CACHE=1"""
+    global _cache
+    if not RESPONSE_CACHE:
+        return None
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                encode = None
+                if RESPONSE_CACHE_THRESHOLD > 0:
+                    from embeddings import EmbeddingStage
+                    encode = EmbeddingStage(_load_embed_model, RESPONSE_CACHE_EMBED_MODEL).encode
+                _cache = ResponseCache(encode)
+    return _cache
@@ -7,32 +7,37 @@ import datetime
 import time
 import uuid
 from tools_def import TOOL_SYSTEM_PROMPT
+from jsonl_log import JsonlWriter
+from tool_cache import get_tool_cache, run_parallel
 
 load_dotenv(find_dotenv())
 
 client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
 
 LOG_FILE = "agent_logs.jsonl"
+# Kept open and buffered; rotated (and gzipped) every 64 MB. Import with import_traces.py
+log_writer = JsonlWriter(LOG_FILE, max_bytes=64 * 1024 * 1024, compress=True)
 
-def save_log(session_id, turn_number, event_type, content):
+def save_log(session_id, turn_number, event_type, content, **fields):
     '''
     Saves a single event to the log file
     Args:
         session_id: Unique ID for this specific user question run.
         turn_number: Which loop iteration are we on?
-        event_type: 'input', 'decision', 'tool_output', 'final_answer', 'error'
+        event_type: 'input', 'decision', 'tool_output', 'tool_cache_hit', 'final_answer', 'error'
         content: The actual data (prompt, tool name, result, etc.)
+        fields: Extra agent_traces columns, e.g. tool_name, latency_ms
     '''
     entry = {
         'timestamp':datetime.datetime.now().isoformat(),
         'session_id':session_id,
         'turn_number':turn_number,
         'event_type':event_type,
-        'content':content
+        'content':content,
+        **fields
     }
     
-    with open(LOG_FILE,'a') as f:
-        f.write(json.dumps(entry)+ '\n')
+    log_writer.write(entry)
     
 def get_weather(city):
     """
@@ -70,6 +75,38 @@ def multiply(a, b):
     :param b: int/float
     """
     return str(a*b)
+
+# Dispatch table: tool name -> (function, required arguments)
+TOOLS = {
+    'get_weather': (get_weather, ['city']),
+    'get_time': (get_time, ['timezone']),
+    'multiply': (multiply, ['a', 'b']),
+}
+
+def execute_tool(session_id, turn_number, tool_name, tool_args):
+    '''
+    Runs one tool call and logs its output. Results are memoized per tool TTL
+    (see tool_cache.py), so repeated calls skip the tool and log a tool_cache_hit.
+    '''
+    func, required = TOOLS.get(tool_name, (None, []))
+    missing = [arg for arg in required if tool_args.get(arg) is None]
+    hit, latency_ms = False, 0
+    if func is None:
+        observation = "Error: Unknown Tool"
+    elif missing:
+        observation = f"Error: Missing {' or '.join(repr(arg) for arg in missing)} arguments."
+    else:
+        arguments = {arg: tool_args[arg] for arg in required}
+        try:
+            observation, hit, latency_ms = get_tool_cache().call(tool_name, func, arguments)
+        except Exception as e:
+            observation = f"Error: {e}"
+    if hit:
+        save_log(session_id, turn_number, 'tool_cache_hit', {"arguments": arguments, "saved_ms": latency_ms},
+                 tool_name=tool_name)
+        latency_ms = 0
+    save_log(session_id, turn_number, "tool_output", observation, tool_name=tool_name, latency_ms=latency_ms)
+    return observation
     
 system_prompt = '''
     You are a helpful AI assistant. You have access to THREE tools.
@@ -88,8 +125,8 @@ TOOLS:
    arguments: {"a": "integer", "b": "integer"}
 
 RULES:
-- You must pick the ONE tool that best fits the NEXT step of the user's request.
-- If a request requires multiple tools, solve them ONE BY ONE. 
+- You must pick the tool (or tools) that best fit the NEXT step of the user's request.
+- If a request requires multiple independent tools, call them ALL AT ONCE (see below).
 - Do not guess answers. Use tools for everything.
 - Format your answer as JSON.
 - The JSON must follow this EXACT structure:
@@ -97,6 +134,13 @@ RULES:
     "tool": "tool_name",
     "arguments": { ... key-value pairs ... }
   }
+- For several independent tools in one step, use:
+  {
+    "tool_calls": [
+      {"tool": "tool_name", "arguments": { ... }},
+      {"tool": "tool_name", "arguments": { ... }}
+    ]
+  }
 - You may ONLY answer questions that use the provided tools.
 - If the user asks for anything else (like essays, jokes, or general knowledge), you must REFUSE.
 - Refusal format: {"tool": null, "message": "I cannot do that. I only handle weather, time, and math."}
@@ -137,40 +181,29 @@ def run_agent(user_question):
             save_log(session_id, turn_count, 'error', error_msg)
             continue
         
-        tool_name = data['tool']
-        tool_args = data.get("arguments", {})
-            
-        if tool_name:
-            print(f"[DECISION] Agent wants to use: {tool_name}")
-            save_log(session_id, turn_count, 'decision', {"tool":tool_name, "args": tool_args})
-            
-            observation = "Error: Unknown Tool"
-            if tool_name == 'get_weather':
-                city = tool_args.get("city")
-                observation = get_weather(city)
-                
-            elif tool_name == 'get_time':
-                tz = tool_args.get('timezone')
-                observation = get_time(tz)
+        tool_calls = data.get('tool_calls') or []
+        if data.get('tool'):
+            tool_calls = [{'tool': data['tool'], 'arguments': data.get("arguments", {})}]
             
-            elif tool_name == 'multiply':
-                val_a = tool_args.get('a')
-                val_b = tool_args.get('b')
-                if val_a is not None and val_b is not None:
-                    observation = multiply(val_a, val_b)
-                else:
-                    observation = "Error: Missing 'a' or 'b' arguments."
-                
-            # else:
-            #     print(f'[ERROR] Agent tried to call unknown tool: {tool_name}')
-                
-                # break
+        if tool_calls:
+            for call in tool_calls:
+                print(f"[DECISION] Agent wants to use: {call.get('tool')}")
+                save_log(session_id, turn_count, 'decision', {"tool": call.get('tool'), "args": call.get('arguments', {})})
             
-            print(f'[OBSERVATION] {observation}, turn count: {turn_count}')
-            save_log(session_id, turn_count,"tool_output", observation)
+            # Independent calls from the same turn run concurrently
+            observations = run_parallel([
+                lambda call=call: execute_tool(session_id, turn_count, call.get('tool'), call.get('arguments') or {})
+                for call in tool_calls
+            ])
+            observations = [f"Error: {o}" if isinstance(o, Exception) else o for o in observations]
             
+            print(f'[OBSERVATION] {observations}, turn count: {turn_count}')
             messages.append({'role':'assistant', 'content':ai_message})
-            messages.append({'role':'user', 'content':f"Tool returned {observation}"})
+            if len(observations) == 1:
+                messages.append({'role':'user', 'content':f"Tool returned {observations[0]}"})
+            else:
+                results = "; ".join(f"{call.get('tool')} returned {o}" for call, o in zip(tool_calls, observations))
+                messages.append({'role':'user', 'content':f"Tools returned: {results}"})
             
         else:
             final_msg = data.get('message', ai_message)
@@ -0,0 +1,198 @@
+import argparse
+import statistics
+import sys
+import time
+from clickhouse_db import TRACE_COLUMNS, EVAL_COLUMNS, MIGRATIONS, apply_migrations, get_client, new_client
+
+# Dashboard latency on a synthetic dataset, before vs after the schema migrations.
+# Works in two scratch databases so the real tables are never touched:
+#   ig_bench_before - migration 1 only (plain Strings, no partitions, no rollups)
+#   ig_bench_after  - every migration, filled through the materialized views
+
+BEFORE_DB = "ig_bench_before"
+AFTER_DB = "ig_bench_after"
+EVAL_METRICS = ["faithfulness", "answer_relevance"]
+
+# One synthetic session = 8 events: question, two tool round-trips, answer
+SESSION_EVENTS = "['user_input', 'tool_start', 'tool_end', 'llm_end', 'tool_start', 'tool_end', 'llm_end', 'chain_end']"
+TOOLS = "['get_weather', 'get_time', 'multiply']"
+
+# Panels from the Grafana dashboards: name -> (raw SQL, rollup SQL).
+# {since} is the panel's time range, aligned to the hour so both sides cover the same rows.
+DASHBOARD_QUERIES = {
+    "failure_rate": (
+        """SELECT uniqIf(session_id, event_type = 'error') / uniqIf(session_id, event_type = 'user_input')
+           FROM agent_traces WHERE timestamp >= {since}""",
+        """SELECT uniqMergeIf(sessions, event_type = 'error') / uniqMergeIf(sessions, event_type = 'user_input')
+           FROM agent_traces_hourly WHERE hour >= {since}""",
+    ),
+    "tool_reliability": (
+        """SELECT tool_name,
+                  countIf(event_type = 'tool_end' AND position(content, 'Unknown') = 0) AS ok,
+                  countIf(event_type = 'error' OR (event_type = 'tool_end' AND position(content, 'Unknown') > 0)) AS failed
+           FROM agent_traces WHERE timestamp >= {since} AND tool_name != ''
+           GROUP BY tool_name ORDER BY tool_name""",
+        """SELECT tool_name,
+                  sumIf(events, event_type = 'tool_end') - sumIf(failures, event_type = 'tool_end') AS ok,
+                  sum(failures) AS failed
+           FROM agent_traces_hourly WHERE hour >= {since} AND tool_name != ''
+           GROUP BY tool_name ORDER BY tool_name""",
+    ),
+    "tool_latency": (
+        """SELECT tool_name, quantiles(0.5, 0.95)(latency_ms)
+           FROM agent_traces WHERE timestamp >= {since} AND event_type = 'tool_end'
+           GROUP BY tool_name ORDER BY tool_name""",
+        """SELECT tool_name, quantilesMerge(0.5, 0.95)(latency)
+           FROM agent_traces_hourly WHERE hour >= {since} AND event_type = 'tool_end'
+           GROUP BY tool_name ORDER BY tool_name""",
+    ),
+    "verbosity_ratio": (
+        """SELECT sumIf(length(content), event_type = 'llm_end') / sumIf(length(content), event_type = 'user_input')
+           FROM agent_traces WHERE timestamp >= {since}""",
+        """SELECT sumIf(content_chars, event_type = 'llm_end') / sumIf(content_chars, event_type = 'user_input')
+           FROM agent_traces_hourly WHERE hour >= {since}""",
+    ),
+    "rage_clicks": (
+        """SELECT question, sum(hits) AS total FROM (
+               SELECT toStartOfFiveMinutes(toDateTime(timestamp)) AS bucket, content AS question, count() AS hits
+               FROM agent_traces WHERE timestamp >= {since} AND event_type = 'user_input'
+               GROUP BY bucket, question HAVING hits >= 3
+           ) GROUP BY question ORDER BY total DESC, question LIMIT 20""",
+        """SELECT question, sum(hits) AS total FROM (
+               SELECT bucket, question, sum(hits) AS hits
+               FROM rage_clicks_5m WHERE bucket >= {since}
+               GROUP BY bucket, question HAVING hits >= 3
+           ) GROUP BY question ORDER BY total DESC, question LIMIT 20""",
+    ),
+    "trust_gauge": (
+        """SELECT avg(score) FROM agent_evals WHERE timestamp >= {since} AND metric_name = 'faithfulness'""",
+        """SELECT sum(score_sum) / sum(score_count)
+           FROM eval_scores_hourly WHERE hour >= {since} AND metric_name = 'faithfulness'""",
+    ),
+}
+
+
+# --- SYNTHETIC DATA ---
+
+def generate(client, database, rows, days, questions):
+    """Generates ~`rows` trace events (plus evals) server-side, spread over the last `days` days"""
+    sessions = max(rows // 8, 1)
+    span_ms = days * 86400 * 1000
+    now_ms = int(time.time() * 1000)
+    # Session start: a hash-spread offset into the range; events follow 700 ms apart
+    start = f"{now_ms} - toInt64(cityHash64(s) % {span_ms})"
+    client.command(f"""
+        INSERT INTO {database}.agent_traces ({", ".join(TRACE_COLUMNS)})
+        SELECT
+            fromUnixTimestamp64Milli(toInt64({start} + step * 700)) AS timestamp,
+            concat('bench-', toString(s)) AS session_id,
+            if(step = 5 AND cityHash64(s, 1) % 20 = 0, 'error', {SESSION_EVENTS}[step + 1]) AS event_type,
+            multiIf(
+                step = 0, concat('What is the weather in city ', toString(cityHash64(s, 2) % {questions}), '?'),
+                step IN (2, 5) AND cityHash64(s, 3) % 33 = 0, 'Unknown',
+                step IN (2, 5), concat('Result: ', toString(cityHash64(s, step))),
+                step IN (3, 6), repeat('The agent explains its answer. ', 2 + cityHash64(s, 4) % 20),
+                step = 7, 'AgentExecutor',
+                '{{"args": {{"city": "Paris"}}}}'
+            ) AS content,
+            if(step IN (1, 2, 4, 5), {TOOLS}[cityHash64(s, intDiv(step, 3)) % 3 + 1], '') AS tool_name,
+            toUInt32(multiIf(step IN (2, 5), 50 + cityHash64(s, step) % 500,
+                             step IN (3, 6), 300 + cityHash64(s, step) % 2000, 0)) AS latency_ms,
+            concat(session_id, ':', toString(intDiv(step, 3))) AS run_id,
+            '' AS parent_run_id,
+            toUInt32(if(step IN (3, 6), 80 + cityHash64(s, step) % 200, 0)) AS ttft_ms,
+            toUInt32(if(step IN (3, 6), 400 + cityHash64(s, step) % 800, 0)) AS prompt_tokens,
+            toUInt32(if(step IN (3, 6), 20 + cityHash64(s, step) % 200, 0)) AS completion_tokens,
+            toFloat32(if(step IN (3, 6), 150, 0)) AS tokens_per_sec,
+            if(step IN (3, 6), 'llama-3.1-8b-instant', '') AS model_name,
+            0.0 AS cost_usd
+        FROM (SELECT intDiv(number, 8) AS s, number % 8 AS step FROM numbers({sessions * 8}))
+    """)
+    client.command(f"""
+        INSERT INTO {database}.agent_evals ({", ".join(EVAL_COLUMNS)})
+        SELECT
+            fromUnixTimestamp64Milli(toInt64({start} + 60000)) AS timestamp,
+            concat('bench-', toString(s)) AS session_id,
+            {EVAL_METRICS}[m + 1] AS metric_name,
+            toFloat32(cityHash64(s, m) % 10 != 0) AS score,
+            'Synthetic verdict for the schema benchmark.' AS reason
+        FROM (SELECT intDiv(number, {len(EVAL_METRICS)}) AS s, number % {len(EVAL_METRICS)} AS m
+              FROM numbers({sessions * len(EVAL_METRICS)}))
+    """)
+    return sessions
+
+
+def table_sizes(client, database):
+    rows = client.query(
+        "SELECT table, sum(rows), sum(data_compressed_bytes) FROM system.parts "
+        "WHERE database = {db:String} AND active GROUP BY table ORDER BY table",
+        parameters={"db": database},
+    ).result_rows
+    return {table: (total, size) for table, total, size in rows}
+
+
+# --- BENCHMARK ---
+
+def time_query(client, sql, repeat):
+    """Median wall time (ms) over `repeat` runs, after one warm-up run"""
+    client.query(sql)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        client.query(sql)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dashboard query latency before vs after the schema migrations.")
+    parser.add_argument("--rows", type=int, default=5_000_000, help="synthetic trace events")
+    parser.add_argument("--days", type=int, default=30, help="days of history to spread them over")
+    parser.add_argument("--questions", type=int, default=500, help="distinct user questions (repeats = rage clicks)")
+    parser.add_argument("--range-hours", type=int, default=24, help="dashboard time range")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per query")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch databases")
+    args = parser.parse_args(argv)
+
+    admin = get_client()
+    for database in (BEFORE_DB, AFTER_DB):
+        admin.command(f"DROP DATABASE IF EXISTS {database}")
+        admin.command(f"CREATE DATABASE {database}")
+    before, after = new_client(BEFORE_DB), new_client(AFTER_DB)
+
+    try:
+        print(f"⏳ Generating {args.rows:,} trace events over {args.days} days...")
+        apply_migrations(before, up_to=MIGRATIONS[0][0])
+        sessions = generate(before, BEFORE_DB, args.rows, args.days, args.questions)
+        apply_migrations(after)
+        # Copied in, not regenerated, so the views see ordinary inserts and both sides hold the same rows
+        for table, columns in (("agent_traces", TRACE_COLUMNS), ("agent_evals", EVAL_COLUMNS)):
+            cols = ", ".join(columns)
+            after.command(f"INSERT INTO {AFTER_DB}.{table} ({cols}) SELECT {cols} FROM {BEFORE_DB}.{table}")
+        # Benchmark the steady state, not a pile of fresh parts
+        for client, database in ((before, BEFORE_DB), (after, AFTER_DB)):
+            for table in table_sizes(client, database):
+                client.command(f"OPTIMIZE TABLE {database}.{table} FINAL")
+
+        print(f"\n📦 Storage ({sessions:,} sessions):")
+        for label, client, database in (("before", before, BEFORE_DB), ("after", after, AFTER_DB)):
+            for table, (total, size) in table_sizes(client, database).items():
+                print(f"   {label:<7}{table:<22}{total:>14,} rows {size / 1024 / 1024:>10,.1f} MiB")
+
+        since = f"toStartOfHour(now() - INTERVAL {args.range_hours} HOUR)"
+        print(f"\n⏱️  Median latency over {args.repeat} runs, last {args.range_hours}h (ms):")
+        print(f"   {'panel':<18}{'before':>10}{'after raw':>12}{'rollup':>10}{'speedup':>10}")
+        for name, (raw_sql, rollup_sql) in DASHBOARD_QUERIES.items():
+            raw_sql, rollup_sql = raw_sql.format(since=since), rollup_sql.format(since=since)
+            old = time_query(before, raw_sql, args.repeat)
+            raw = time_query(after, raw_sql, args.repeat)
+            rollup = time_query(after, rollup_sql, args.repeat)
+            print(f"   {name:<18}{old:>10.1f}{raw:>12.1f}{rollup:>10.1f}{old / rollup if rollup else 0:>9.1f}x")
+    finally:
+        if not args.keep:
+            for database in (BEFORE_DB, AFTER_DB):
+                admin.command(f"DROP DATABASE IF EXISTS {database}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+import json
+import threading
+import time
+from hashing import content_key
+
+# A sink is anything with the ClickHouse client's insert() signature, so it can be
+# handed to BatchWriter/AsyncBatchWriter/EvalSink wherever a client is expected.
+
+
+class ClickHouseSink:
+    """Primary sink. The client (and schema) are only set up on the first insert."""
+
+    def __init__(self, get_client):
+        self._get_client = get_client
+
+    def insert(self, table, data, column_names=None, column_oriented=False, settings=None):
+        self._get_client().insert(table, data, column_names=column_names,
+                                  column_oriented=column_oriented, settings=settings)
+
+
+class SpoolingSink:
+    """
+    Writes to the primary sink, and to a local Spool when the primary fails or is slow.
+
+    A failed insert, or one slower than `slow_seconds`, trips the breaker: for the next
+    `retry_interval` seconds batches go straight to the spool (a local append), so the
+    writer queue keeps draining and the agent never waits on the backend. After that
+    the next batch tries the primary again. SpoolReplayer loads the backlog.
+    """
+
+    def __init__(self, primary, spool, slow_seconds=2.0, retry_interval=5.0):
+        self.primary = primary
+        self.spool = spool
+        self.slow_seconds = slow_seconds
+        self.retry_interval = retry_interval
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+        self.trips = 0
+
+    def tripped(self):
+        return time.monotonic() < self._open_until
+
+    def trip(self):
+        with self._lock:
+            if not self.tripped():
+                self.trips += 1
+            self._open_until = time.monotonic() + self.retry_interval
+
+    def reset(self):
+        self._open_until = 0.0
+
+    def insert(self, table, data, column_names=None, column_oriented=False, settings=None):
+        if not self.tripped():
+            started = time.monotonic()
+            try:
+                self.primary.insert(table, data, column_names=column_names,
+                                    column_oriented=column_oriented, settings=settings)
+                if time.monotonic() - started > self.slow_seconds:
+                    self.trip()
+                return
+            except Exception as e:
+                print(f"⚠️ Telemetry backend unavailable ({e}); spooling to {self.spool.directory}")
+                self.trip()
+        rows = [list(row) for row in zip(*data)] if column_oriented else data
+        self.spool.append(table, column_names, rows)
+
+    def stats(self):
+        return {"tripped": self.tripped(), "trips": self.trips, **self.spool.stats()}
+
+
+class SpoolReplayer:
+    """
+    Background thread that bulk-loads spooled batches into the primary sink once it
+    is reachable again, then deletes the replayed segments.
+
+    Rows are re-batched into large columnar inserts of up to `batch_rows`. Each insert
+    carries a deduplication token derived from its contents (not the segment name,
+    which restarts at 0 in every new or drained spool), so a segment that is replayed
+    twice after a crash doesn't duplicate rows, while different batches never collide.
+    """
+
+    def __init__(self, sink, interval=5.0, batch_rows=50000):
+        self.sink = sink
+        self.interval = interval
+        self.batch_rows = batch_rows
+        self.rows_replayed = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="spool-replayer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.replay_once()
+            except Exception as e:
+                print(f"⚠️ Spool replay failed ({e}); retrying in {self.sink.retry_interval:.0f}s")
+                self.sink.trip()
+
+    def replay_once(self):
+        """Replays every sealed segment, oldest first. Returns the number of rows loaded."""
+        spool = self.sink.spool
+        if spool.empty() or self.sink.tripped():
+            return 0
+        spool.seal()
+        replayed = 0
+        for name in spool.sealed():
+            if self._stop.is_set():
+                break
+            replayed += self._replay_segment(name)
+            spool.remove(name)
+        self.rows_replayed += replayed
+        if replayed:
+            print(f"✅ Replayed {replayed} spooled telemetry rows")
+        return replayed
+
+    @staticmethod
+    def batch_token(table, columns, rows):
+        # Same rows -> same token, whichever spool or segment they were replayed from
+        return content_key(table, *columns, json.dumps(rows, default=str))
+
+    def _replay_segment(self, name):
+        batches = {}  # (table, columns) -> rows
+        replayed = 0
+
+        def load(key, rows):
+            nonlocal replayed
+            table, columns = key
+            self.sink.primary.insert(table, [list(col) for col in zip(*rows)], column_names=list(columns),
+                                     column_oriented=True,
+                                     settings={"insert_deduplication_token": self.batch_token(table, columns, rows)})
+            replayed += len(rows)
+
+        for table, columns, rows in self.sink.spool.read(name):
+            key = (table, tuple(columns))
+            pending = batches.setdefault(key, [])
+            pending.extend(rows)
+            if len(pending) >= self.batch_rows:
+                load(key, pending)
+                batches[key] = []
+        for key, rows in batches.items():
+            if rows:
+                load(key, rows)
+        return replayed
@@ -0,0 +1,157 @@
+import datetime
+import fcntl
+import json
+import os
+import threading
+import time
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return {"$dt": value.isoformat()}
+    return str(value)
+
+def _decode(obj):
+    if "$dt" in obj:
+        return datetime.datetime.fromisoformat(obj["$dt"])
+    return obj
+
+
+class SpoolFull(Exception):
+    pass
+
+
+class Spool:
+    """
+    Local append-only spool of insert batches, in numbered segment files.
+
+    Each append is one JSON line {"table", "columns", "rows"}. The active segment is
+    rolled once it reaches `segment_bytes`; sealed segments are what the replayer
+    loads and then deletes. Appends are refused (SpoolFull) once the spool holds
+    `max_bytes`, so an outage can't fill the disk.
+
+    fsync policy: "always" (every append), "interval" (at most every
+    `fsync_interval` seconds) or "never" (leave it to the OS).
+    One process per directory: the directory is flock'ed while open.
+    """
+
+    def __init__(self, directory, segment_bytes=8 * 1024 * 1024, max_bytes=512 * 1024 * 1024,
+                 fsync="interval", fsync_interval=1.0):
+        if fsync not in ("always", "interval", "never"):
+            raise ValueError(f"unknown fsync policy: {fsync}")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(os.path.join(directory, ".lock"), "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            raise RuntimeError(f"spool directory {directory} is in use by another process")
+
+        self._lock = threading.Lock()
+        self._active = None
+        self._active_path = None
+        self._active_bytes = 0
+        self._last_fsync = time.monotonic()
+        # Segments left by a previous run are sealed backlog
+        self._sealed = sorted(name for name in os.listdir(directory) if name.endswith(".jsonl"))
+        self._next_seq = int(self._sealed[-1].split(".")[0]) + 1 if self._sealed else 0
+        self.bytes = sum(os.path.getsize(self._path(name)) for name in self._sealed)
+        self.rows_spooled = 0
+        self.rows_rejected = 0
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    # --- WRITE SIDE ---
+
+    def append(self, table, column_names, rows):
+        """Spools one batch (row-oriented). Raises SpoolFull when over max_bytes."""
+        line = (json.dumps({"table": table, "columns": list(column_names), "rows": rows},
+                           default=_encode) + "\n").encode()
+        with self._lock:
+            if self.bytes + len(line) > self.max_bytes:
+                self.rows_rejected += len(rows)
+                raise SpoolFull(f"spool {self.directory} is full ({self.bytes} bytes)")
+            if self._active is None:
+                self._active_path = f"{self._next_seq:012d}.jsonl"
+                self._next_seq += 1
+                self._active = open(self._path(self._active_path), "ab")
+            self._active.write(line)
+            self._active_bytes += len(line)
+            self.bytes += len(line)
+            self.rows_spooled += len(rows)
+            self._sync()
+            if self._active_bytes >= self.segment_bytes:
+                self._seal()
+
+    def _sync(self, force=False):
+        if self.fsync == "never" and not force:
+            self._active.flush()
+            return
+        now = time.monotonic()
+        if force or self.fsync == "always" or now - self._last_fsync >= self.fsync_interval:
+            self._active.flush()
+            os.fsync(self._active.fileno())
+            self._last_fsync = now
+        else:
+            self._active.flush()
+
+    def _seal(self):
+        if self._active is None:
+            return
+        self._sync(force=True)
+        self._active.close()
+        self._sealed.append(self._active_path)
+        self._active, self._active_path, self._active_bytes = None, None, 0
+
+    def seal(self):
+        """Closes the active segment so its rows can be replayed"""
+        with self._lock:
+            self._seal()
+
+    def close(self):
+        with self._lock:
+            self._seal()
+            self._lock_file.close()
+
+    # --- REPLAY SIDE ---
+
+    def sealed(self):
+        with self._lock:
+            return list(self._sealed)
+
+    def read(self, name):
+        """Yields (table, column_names, rows) batches of a sealed segment"""
+        with open(self._path(name), "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line, object_hook=_decode)
+                except ValueError:
+                    continue # Torn last line after a crash
+                yield record["table"], record["columns"], record["rows"]
+
+    def remove(self, name):
+        path = self._path(name)
+        size = os.path.getsize(path)
+        os.remove(path)
+        with self._lock:
+            self._sealed.remove(name)
+            self.bytes -= size
+
+    def empty(self):
+        with self._lock:
+            return not self._sealed and self._active is None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "spool_bytes": self.bytes,
+                "spool_segments": len(self._sealed) + (self._active is not None),
+                "rows_spooled": self.rows_spooled,
+                "rows_rejected": self.rows_rejected,
+            }
@@ -0,0 +1,152 @@
+import asyncio
+import threading
+import time
+from batch_writer import AsyncBatchWriter, BatchWriter
+
+
+class RecordingClient:
+    """Records inserts; `gate` (if set) holds every insert until it is released"""
+
+    def __init__(self, gate=None, fail=False):
+        self.gate = gate
+        self.fail = fail
+        self.batches = []
+
+    def insert(self, table, data, column_names=None, column_oriented=False, settings=None):
+        if self.gate is not None:
+            self.gate.wait()
+        if self.fail:
+            raise ConnectionError("ClickHouse is down")
+        self.batches.append(list(zip(*data)))
+
+
+def test_rows_are_written_in_columnar_batches():
+    client = RecordingClient()
+    writer = BatchWriter(client, "t", ["a", "b"], max_batch_size=2, flush_interval=60)
+    for i in range(5):
+        assert writer.put([i, str(i)])
+    assert writer.flush(timeout=2)
+    assert [len(batch) for batch in client.batches] == [2, 2, 1]
+    assert client.batches[0] == [(0, "0"), (1, "1")]
+    assert writer.stats()["written"] == 5
+    writer.close()
+
+
+def test_partial_batch_is_written_after_the_interval():
+    client = RecordingClient()
+    writer = BatchWriter(client, "t", ["a"], max_batch_size=100, flush_interval=0.05)
+    writer.put([1])
+    time.sleep(0.3)
+    assert client.batches == [[(1,)]]
+    writer.close()
+
+
+def test_full_queue_drops_and_counts_instead_of_blocking():
+    gate = threading.Event()
+    writer = BatchWriter(RecordingClient(gate), "t", ["a"], max_batch_size=1, max_queue_size=2)
+    results = [writer.put([i]) for i in range(10)]
+    assert results.count(False) == writer.stats()["dropped"] > 0
+    gate.set()
+    writer.close()
+
+
+def test_flush_times_out_when_the_queue_is_full_behind_a_stuck_insert():
+    gate = threading.Event()
+    writer = BatchWriter(RecordingClient(gate), "t", ["a"], max_batch_size=1, max_queue_size=2)
+    writer.put([0])
+    time.sleep(0.1)  # The worker is now stuck inserting row 0
+    for i in range(1, 5):
+        writer.put([i])
+    started = time.monotonic()
+    assert writer.flush(timeout=0.2) is False
+    assert time.monotonic() - started < 1
+    gate.set()
+    assert writer.flush(timeout=2)
+    writer.close()
+
+
+def test_insert_failures_are_counted_not_raised():
+    writer = BatchWriter(RecordingClient(fail=True), "t", ["a"])
+    writer.put([1])
+    assert writer.flush(timeout=2)
+    assert writer.stats()["failed"] == 1
+    writer.close()
+    assert writer.put([2]) is False  # Closed
+
+
+# --- ASYNC ---
+
+def test_async_writer_batches_rows_put_on_the_loop_and_from_threads():
+    client = RecordingClient()
+
+    async def run():
+        writer = AsyncBatchWriter(lambda: client, "t", ["a"], max_batch_size=100, flush_interval=60)
+        writer.put([1])
+        # A sync tool running in an executor thread
+        await asyncio.to_thread(writer.put, [2])
+        assert await writer.flush(timeout=2)
+        await writer.close()
+        return writer
+
+    writer = asyncio.run(run())
+    assert sorted(row for batch in client.batches for row in batch) == [(1,), (2,)]
+    assert writer.stats()["written"] == 2
+
+
+def test_async_put_without_a_loop_is_dropped_not_raised():
+    writer = AsyncBatchWriter(lambda: RecordingClient(), "t", ["a"])
+    assert writer.put([1]) is False
+    assert writer.stats()["dropped"] == 1
+
+
+def test_async_writer_stays_on_its_bound_loop():
+    client = RecordingClient()
+
+    async def run():
+        writer = AsyncBatchWriter(lambda: client, "t", ["a"], loop=asyncio.get_running_loop())
+        # First put from a short-lived loop in another thread (LangChain's side loop for
+        # async callbacks on a sync path): the drain task must not start on that loop
+        await asyncio.to_thread(asyncio.run, _put_async(writer, [1]))
+        writer.put([2])
+        assert await writer.flush(timeout=2)
+        await writer.close()
+
+    asyncio.run(run())
+    assert sorted(row for batch in client.batches for row in batch) == [(1,), (2,)]
+
+
+async def _put_async(writer, row):
+    writer.put(row)
+
+
+def test_async_flush_and_close_time_out_when_the_queue_is_full_behind_a_stuck_insert():
+    gate = threading.Event()
+
+    async def run():
+        writer = AsyncBatchWriter(lambda: RecordingClient(gate), "t", ["a"], max_batch_size=1, max_queue_size=2)
+        writer.put([0])
+        await asyncio.sleep(0.1)  # The drain task is now stuck inserting row 0
+        for i in range(1, 5):
+            writer.put([i])
+        started = time.monotonic()
+        try:
+            assert await writer.flush(timeout=0.2) is False
+            await writer.close(timeout=0.2)
+            # One deadline covers the flush, the stop marker and the wait for the drain task
+            assert time.monotonic() - started < 1
+        finally:
+            gate.set()  # asyncio.run() waits for the insert thread on exit
+        return writer
+
+    writer = asyncio.run(run())
+    assert writer.stats()["dropped"] == 2
+
+
+def test_async_drops_from_many_threads_are_all_counted():
+    writer = AsyncBatchWriter(lambda: RecordingClient(), "t", ["a"])
+    threads = [threading.Thread(target=lambda: [writer.put([i]) for i in range(1000)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert writer.stats()["dropped"] == 8000
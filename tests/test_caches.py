@@ -0,0 +1,179 @@
+import json
+import time
+import numpy as np
+from clickhouse_callback import TraceRecorder
+from judge_cache import VerdictCache
+from loop_detector import LoopDetector
+from response_cache import ResponseCache, anchors
+from tool_cache import ToolCache, memoized, run_parallel
+
+
+class ListWriter:
+    def __init__(self):
+        self.rows = []
+
+    def put(self, row):
+        self.rows.append(row)
+
+
+def bag_of_words(texts):
+    """Tiny stand-in for the embedding model: normalized word counts over a fixed vocabulary"""
+    vocab = ["weather", "dallas", "temperature", "time", "calculate", "times", "25", "26", "4"]
+    vectors = []
+    for text in texts:
+        words = text.lower().replace("?", "").split()
+        vector = np.array([words.count(w) for w in vocab], dtype=np.float32) + 1e-3
+        vectors.append(vector / np.linalg.norm(vector))
+    return np.stack(vectors)
+
+
+# --- RESPONSE CACHE ---
+
+def test_exact_hit_ignores_case_and_spacing():
+    cache = ResponseCache(threshold=0)
+    cache.put("What is the weather in Dallas?", "75 F, Sunny", latency_ms=900, context="75 F, Sunny")
+    hit = cache.get("what is the  weather in Dallas?")
+    assert (hit.answer, hit.match, hit.saved_ms, hit.context) == ("75 F, Sunny", "exact", 900, "75 F, Sunny")
+    assert cache.get("What is the weather in Paris?") is None
+    assert cache.stats()["exact_hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_semantic_hit_needs_the_same_anchors():
+    cache = ResponseCache(encode=bag_of_words, threshold=0.8)
+    cache.put("Calculate 25 times 4", "100")
+    assert cache.get("please calculate 25 times 4").match == "semantic"
+    # Same wording, other numbers: must not reuse the answer
+    assert anchors("Calculate 26 times 4") != anchors("Calculate 25 times 4")
+    assert cache.get("Calculate 26 times 4") is None
+
+
+def test_entries_expire_and_are_bounded():
+    cache = ResponseCache(threshold=0, ttl=0.05, max_entries=2)
+    for i in range(3):
+        cache.put(f"question {i}", str(i))
+    assert cache.get("question 0") is None  # Evicted
+    assert cache.get("question 2").answer == "2"
+    time.sleep(0.06)
+    assert cache.get("question 2") is None  # Expired
+
+
+def test_answers_expire_with_their_shortest_lived_tool_result():
+    from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+    from my_agent import cache_answer
+
+    def run(*tools):
+        messages = [HumanMessage("q")] + [ToolMessage("out", name=name, tool_call_id=name) for name in tools]
+        return {"messages": messages + [AIMessage("answer")]}
+
+    cache = ResponseCache(threshold=0, ttl=3600)
+    cache_answer(cache, "2 times 2?", run("multiply"), 100)
+    cache_answer(cache, "Weather in Dallas?", run("multiply", "get_weather"), 100)
+    cache_answer(cache, "What time is it?", run("get_time"), 100)
+    assert [entry[7] for entry in cache._entries.values()] == [3600, 300]
+
+    cache.put("Weather in Paris?", "60 F", ttl=0.05)
+    time.sleep(0.06)
+    assert cache.get("Weather in Paris?") is None and cache.get("Weather in Dallas?").answer == "answer"
+
+
+def test_cache_hit_is_traced_like_a_normal_run():
+    detector = LoopDetector(rage_threshold=2, window_seconds=60)
+    cache = ResponseCache(threshold=0)
+    cache.put("Weather in Dallas?", "75 F, Sunny", 800, "75 F, Sunny")
+    inputs = {"messages": [("user", "Weather in Dallas?")]}
+
+    normal, cached = ListWriter(), ListWriter()
+    TraceRecorder("sess_a", normal, detector).on_chain_start({}, inputs, run_id="root")
+    TraceRecorder("sess_b", cached, detector).on_cache_hit(inputs, cache.get("Weather in Dallas?"))
+
+    assert normal.rows[0][2] == cached.rows[0][2] == "user_input"
+    assert normal.rows[0][3] == cached.rows[0][3]  # Same user_input content on both paths
+    # The second ask is a rage click even though it was answered from the cache
+    assert [row[2] for row in cached.rows] == ["user_input", "loop_detected", "cache_hit"]
+    payload = json.loads(cached.rows[-1][3])
+    assert (payload["answer"], payload["context"]) == ("75 F, Sunny", "75 F, Sunny")
+
+
+# --- TOOL CACHE ---
+
+def test_tool_results_are_memoized_per_ttl():
+    calls = []
+
+    def weather(city):
+        calls.append(city)
+        return f"sunny in {city}"
+
+    cache = ToolCache(ttls={"weather": 60, "clock": 0})
+    assert cache.call("weather", weather, {"city": "Dallas"})[:2] == ("sunny in Dallas", False)
+    assert cache.call("weather", weather, {"city": "Dallas"})[:2] == ("sunny in Dallas", True)
+    assert cache.call("weather", weather, {"city": "Paris"})[1] is False
+    cache.call("clock", weather, {"city": "Dallas"})
+    cache.call("clock", weather, {"city": "Dallas"})  # TTL 0: always runs
+    assert calls == ["Dallas", "Paris", "Dallas", "Dallas"]
+    assert cache.stats()["hits"] == 1
+
+
+def test_failures_are_not_cached_and_entries_are_bounded():
+    cache = ToolCache(ttls={"div": float("inf")}, max_entries=2)
+    div = lambda a, b: a / b
+    for b in (0, 0):
+        try:
+            cache.call("div", div, {"a": 1, "b": b})
+        except ZeroDivisionError:
+            pass
+    assert cache.stats()["entries"] == 0
+    for b in (1, 2, 4):
+        cache.call("div", div, {"a": 1, "b": b})
+    assert cache.stats()["entries"] == 2
+    assert cache.call("div", div, {"a": 1, "b": 1})[1] is False  # Evicted first
+
+
+def test_memoized_binds_defaults_into_the_key():
+    calls = []
+    cache = ToolCache(ttls={"multiply": float("inf")})
+
+    @memoized(cache)
+    def multiply(a, b=2):
+        calls.append((a, b))
+        return a * b
+
+    assert multiply(3) == multiply(3, 2) == multiply(a=3, b=2) == 6
+    assert calls == [(3, 2)]
+
+
+def test_run_parallel_keeps_order_and_captures_errors():
+    def slow(value, delay):
+        time.sleep(delay)
+        return value
+
+    def boom():
+        raise ValueError("boom")
+
+    started = time.perf_counter()
+    results = run_parallel([lambda: slow(1, 0.1), boom, lambda: slow(3, 0.1)])
+    assert time.perf_counter() - started < 0.19
+    assert results[0] == 1 and isinstance(results[1], ValueError) and results[2] == 3
+
+
+# --- JUDGE VERDICT CACHE ---
+
+def test_verdict_cache_evicts_lru_in_batches(tmp_path):
+    cache = VerdictCache(str(tmp_path / "verdicts.db"), "judge-model", max_entries=10, evict_to=0.5)
+    counts = []
+    cache._conn.set_trace_callback(lambda sql: counts.append(sql) if "count(*)" in sql else None)
+    for i in range(10):
+        cache.put(f"k{i}", 1.0, "ok")
+    assert cache.get("k0") == (1.0, "ok")  # Now the most recently used
+    for i in range(10, 25):
+        cache.put(f"k{i}", 0.0)
+    # Counted only when the running total passed max_entries, not on every put
+    assert len(counts) == 3
+    (rows,) = cache._conn.execute("SELECT count(*) FROM verdicts").fetchone()
+    assert rows <= 10
+    assert cache.get("k1") is None and cache.get("k24") == (0.0, "")
+
+
+def test_verdict_cache_drops_other_models_on_open(tmp_path):
+    path = str(tmp_path / "verdicts.db")
+    VerdictCache(path, "old-model").put("k", 1.0)
+    assert VerdictCache(path, "new-model").get("k") is None
@@ -0,0 +1,180 @@
+import pytest
+from dre import Evaluator
+from judge import JudgeError
+
+
+class Result:
+    def __init__(self, rows):
+        self.result_rows = rows
+
+
+class FakeClient:
+    """Just enough of clickhouse_connect for process_page: no scores yet, inserts recorded"""
+
+    def __init__(self):
+        self.inserts = []
+
+    def query(self, sql, parameters=None):
+        if "eval_failures" in sql:
+            counts = {}
+            for table, data in self.inserts:
+                for row in data if table == "eval_failures" else []:
+                    if row[1] in parameters["ids"]:
+                        counts[row[1]] = counts.get(row[1], 0) + 1
+            return Result(list(counts.items()))
+        return Result([])
+
+    def insert(self, table, data, column_names=None, column_oriented=False, settings=None):
+        self.inserts.append((table, data))
+
+
+def evaluator(client, max_attempts=3):
+    ev = Evaluator(page_size=10, max_attempts=max_attempts)
+    ev._ch_client = client
+    return ev
+
+
+def test_failed_page_leaves_no_buffered_scores():
+    client = FakeClient()
+    ev = evaluator(client)
+    rows = [("s1", "q", "a", "", 1000), ("s2", "q", "a", "", 2000)]
+
+    def crash(sessions):
+        ev.save_eval("s1", "faithfulness", 1.0)
+        raise RuntimeError("embedding model failed")
+
+    ev.grade_sessions = crash
+    with pytest.raises(RuntimeError):
+        ev.process_page(rows, (0, ""))
+    # The regrade after the rewind starts from an empty buffer, so nothing is written twice
+    ev.grade_sessions = lambda sessions: ({sess[0] for sess in sessions}, {})
+    ev.save_eval("s1", "faithfulness", 1.0)
+    ev.process_page(rows, (0, ""))
+    scores = [data for table, data in client.inserts if table == "agent_evals"]
+    assert len(scores) == 1 and scores[0][1] == ["s1"]
+
+
+def test_no_time_based_flush_in_the_middle_of_a_page():
+    client = FakeClient()
+    ev = evaluator(client)
+    ev.sink.flush_interval = 0  # Every add() would be due
+    rows = [("s1", "q", "a", "", 1000), ("s2", "q", "a", "", 2000)]
+
+    def crash_halfway(sessions):
+        ev.save_eval("s1", "faithfulness", 1.0)
+        ev.save_eval("s1", "relevance", 1.0)
+        raise RuntimeError("ClickHouse insert failed")
+
+    ev.grade_sessions = crash_halfway
+    with pytest.raises(RuntimeError):
+        ev.process_page(rows, (0, ""))
+    # Nothing of s1 was written, so already_graded won't skip its regrade
+    assert [data for table, data in client.inserts if table == "agent_evals"] == []
+
+
+def test_poison_session_is_dead_lettered_after_max_attempts():
+    client = FakeClient()
+    ev = evaluator(client, max_attempts=3)
+    rows = [("ok", "q", "a", "", 1000), ("poison", "q", "a", "", 2000), ("later", "q", "a", "", 3000)]
+    graded = []
+
+    def grade(sessions):
+        graded.extend(sess[0] for sess in sessions if sess[0] != "poison")
+        rejected = {sess[0]: "unparseable verdict" for sess in sessions if sess[0] == "poison"}
+        return {sess[0] for sess in sessions if sess[0] != "poison"}, rejected
+
+    ev.grade_sessions = grade
+    watermark = (0, "")
+    for attempt in range(2):
+        watermark, _, failed = ev.process_page(rows, watermark)
+        assert failed == {"poison"} and watermark == (1000, "ok")
+    # Third failure: given up on, and the watermark moves past it
+    watermark, _, failed = ev.process_page(rows, watermark)
+    assert failed == set() and watermark == (3000, "later") and ev.dead_lettered == 1
+    # Dead letters aren't graded again
+    graded.clear()
+    ev.process_page(rows, (0, ""))
+    assert "poison" not in graded
+
+
+def test_crashing_page_is_not_counted_against_its_sessions():
+    client = FakeClient()
+    ev = evaluator(client, max_attempts=2)
+    rows = [("s1", "q", "a", "", 1000)]
+
+    def crash(sessions):
+        raise RuntimeError("embedding model failed")
+
+    ev.grade_sessions = crash
+    for attempt in range(3):
+        with pytest.raises(RuntimeError):
+            ev.process_page(rows, (0, ""))
+    assert not [data for table, data in client.inserts if table == "eval_failures"]
+
+
+def test_only_judge_rejections_count_as_attempts():
+    client = FakeClient()
+    ev = evaluator(client, max_attempts=2)
+    rows = [("s1", "q", "a", "", 1000), ("s2", "q", "a", "", 2000)]
+    ev.compute_similarities = lambda sessions: {}
+
+    def outage(batch):
+        raise JudgeError("429 rate limited", transient=True)
+
+    ev.judge_batch = outage
+    for attempt in range(3):
+        _, _, failed = ev.process_page(rows, (0, ""))
+        assert failed == {"s1", "s2"}
+    assert ev.dead_lettered == 0
+
+    def reject_s2(batch):
+        if any(sess[0] == "s2" for sess in batch):
+            raise JudgeError("invalid JSON from judge")
+        return {sess[0]: {} for sess in batch}
+
+    # A malformed packed batch is regraded one session at a time, so only s2 is charged
+    ev.judge_mode = "combined"
+    ev.judge_batch = reject_s2
+    ev.process_page(rows, (0, ""))
+    watermark, _, failed = ev.process_page(rows, (0, ""))
+    assert failed == set() and watermark == (2000, "s2") and ev.dead_lettered == 1
+    failures = [row[1] for table, data in client.inserts if table == "eval_failures" for row in data]
+    assert failures == ["s2", "s2"]
+
+
+class TraceStore:
+    """In-memory agent_traces with fetch_page's keyset semantics: (last ingest ms, session_id)"""
+
+    def __init__(self):
+        self.sessions = {}  # session_id -> last ingest ms
+
+    def ingest(self, session_id, ingest_ms):
+        self.sessions[session_id] = max(ingest_ms, self.sessions.get(session_id, 0))
+
+    def fetch_page(self, watermark, page_size):
+        keys = sorted((ms, sid) for sid, ms in self.sessions.items() if (ms, sid) > tuple(watermark))
+        return [(sid, "q", "a", "", ms) for ms, sid in keys[:page_size]]
+
+
+def test_keyset_paging_grades_every_session_once_including_late_ones():
+    client, store = FakeClient(), TraceStore()
+    ev = evaluator(client)
+    ev.page_size = 3
+    saved = []
+    ev.read_watermark = lambda: saved[-1] if saved else (0, "")
+    ev.save_watermark = saved.append
+    ev.fetch_page = lambda watermark: store.fetch_page(watermark, ev.page_size)
+    graded = []
+    ev.grade_sessions = lambda sessions: (graded.extend(s[0] for s in sessions) or {s[0] for s in sessions}, {})
+
+    # Ties on the ingest time straddle page boundaries
+    for i in range(7):
+        store.ingest(f"s{i}", 1000 + i // 3 * 10)
+    assert ev.run()["pages"] == 3
+    assert sorted(graded) == [f"s{i}" for i in range(7)]
+
+    # A spool replayed after an outage: old events, ingested now, still after the watermark
+    store.ingest("late", 5000)
+    graded.clear()
+    ev.run()
+    assert graded == ["late"]
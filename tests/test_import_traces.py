@@ -0,0 +1,85 @@
+import gzip
+import json
+from import_traces import TraceImporter, TraceMapper, main
+
+
+def write_jsonl(path, records, compress=False):
+    lines = "".join((r if isinstance(r, str) else json.dumps(r)) + "\n" for r in records)
+    if compress:
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            f.write(lines)
+    else:
+        path.write_text(lines)
+
+
+def test_bad_timestamps_are_counted_not_raised(tmp_path):
+    path = tmp_path / "agent_logs.jsonl"
+    write_jsonl(path, [
+        {"session_id": "s1", "turn_number": 1, "event_type": "input", "content": "hi", "timestamp": 1700000000},
+        {"session_id": "s1", "event_type": "input", "content": "hi", "timestamp": 1e20},       # OverflowError/OSError
+        {"session_id": "s1", "event_type": "input", "content": "hi", "timestamp": -1e18},      # Out of range
+        {"session_id": "s1", "event_type": "input", "content": "hi", "timestamp": "yesterday"},  # ValueError
+        "not json",
+    ])
+    importer = TraceImporter(None, TraceMapper(), dry_run=True)
+    importer.import_file(str(path))
+    importer.finish()
+    assert importer.rows == 1
+    assert importer.bad_lines == 4
+
+
+def test_legacy_records_are_mapped():
+    mapper = TraceMapper()
+    start = mapper.map({"session_id": "s", "turn_number": 2, "event_type": "decision",
+                        "content": {"tool": "multiply", "args": {"a": 2}}})
+    end = mapper.map({"session_id": "s", "turn_number": 2, "event_type": "tool_output", "content": "4"})
+    assert (start[2], start[4], start[6]) == ("tool_start", "multiply", "s:2")
+    assert (end[2], end[4]) == ("tool_end", "multiply")  # Tool name carried over from the decision
+    assert mapper.map({"event_type": "heartbeat"}) is None and mapper.skipped == 1
+
+
+def test_temporary_rotation_files_are_skipped(tmp_path, capsys):
+    record = {"session_id": "s", "event_type": "input", "content": "hi", "timestamp": 1700000000}
+    write_jsonl(tmp_path / "agent_logs.jsonl", [record])
+    write_jsonl(tmp_path / "agent_logs.20250101-000000-000000.jsonl.gz", [record, record], compress=True)
+    (tmp_path / "agent_logs.20250102-000000-000000.jsonl.gz.tmp").write_bytes(b"\x1f\x8b half written")
+
+    assert main(["--dry-run", str(tmp_path / "agent_logs*.jsonl*")]) == 0
+    out = capsys.readouterr().out
+    assert "Skipping 1 temporary file" in out
+    assert "Parsed 3 rows from 2 file(s)" in out
+
+
+class TokenClient:
+    def __init__(self):
+        self.tokens = []
+
+    def insert(self, table, data, column_names=None, column_oriented=False, settings=None):
+        self.tokens.append(settings["insert_deduplication_token"])
+
+
+def import_tokens(path):
+    client = TokenClient()
+    importer = TraceImporter(client, TraceMapper(), batch_rows=2)
+    importer.import_file(str(path))
+    importer.finish()
+    return client.tokens
+
+
+def test_dedup_tokens_survive_growth_and_rotation(tmp_path):
+    # No timestamps: the rows get the import time, but the tokens must not
+    records = [{"session_id": f"s{i}", "event_type": "input", "content": "hi"} for i in range(7)]
+    path = tmp_path / "agent_logs.jsonl"
+    write_jsonl(path, records[:5])
+    first = import_tokens(path)
+    assert len(first) == 3 and import_tokens(path) == first
+
+    # The live file grew: its full batches keep their tokens
+    write_jsonl(path, records)
+    grown = import_tokens(path)
+    assert grown[:2] == first[:2] and len(grown) == 4
+
+    # Rotated into a .gz under another name: same lines, same tokens
+    rotated = tmp_path / "agent_logs.20250101-000000-000000.jsonl.gz"
+    write_jsonl(rotated, records, compress=True)
+    assert import_tokens(rotated) == grown
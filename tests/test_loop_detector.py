@@ -0,0 +1,173 @@
+import asyncio
+import uuid
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.tools import tool
+from langgraph.prebuilt import create_react_agent
+from clickhouse_callback import AsyncClickHouseLogger, ClickHouseLogger
+from fake_llm import FakeToolChatModel
+from loop_detector import LoopDetected, LoopDetector
+
+
+class ListWriter:
+    """Collects rows instead of writing them to ClickHouse"""
+
+    def __init__(self):
+        self.rows = []
+
+    def put(self, row):
+        self.rows.append(row)
+
+    def events(self):
+        return [(row[2], row[4]) for row in self.rows]
+
+
+class AsyncListWriter(ListWriter):
+    async def flush(self, timeout=None):
+        return True
+
+
+class LoopingChatModel(FakeToolChatModel):
+    """Asks for multiply(2, 2) on every turn, whatever the tool said"""
+
+    def _respond(self, messages):
+        message = AIMessage(content="", tool_calls=[
+            {"name": "multiply", "args": {"a": 2, "b": 2}, "id": f"call_{uuid.uuid4().hex[:8]}"}])
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def looping_agent():
+    calls = []
+
+    @tool
+    def multiply(a: int, b: int):
+        """Multiplies two integers."""
+        calls.append((a, b))
+        return str(a * b)
+
+    return create_react_agent(LoopingChatModel(), [multiply]), calls
+
+
+def assert_aborted(writer, calls, max_repeats):
+    events = writer.events()
+    # The repeated call is caught before the tool runs a max_repeats-th time
+    assert len(calls) == max_repeats - 1
+    aborted = events.index(("run_aborted", "multiply"))
+    assert ("loop_detected", "multiply") in events[:aborted]
+    # Nothing of the aborted tool run (or later runs) is traced after the abort
+    assert [e for e in events[aborted + 1:] if e[0] in ("tool_end", "tool_cache_hit", "llm_end")] == []
+
+
+# --- DETECTOR ---
+
+def test_repeated_tool_call_is_a_loop():
+    detector = LoopDetector(max_repeats=3, history=20)
+    assert detector.tool_call("s", "multiply", "{'a': 2}") is None
+    assert detector.tool_call("s", "multiply", "{'a': 3}") is None
+    assert detector.tool_call("s", "multiply", "{'a': 2}") is None
+    assert detector.tool_call("other", "multiply", "{'a': 2}") is None  # Per session
+    assert "multiply called 3x" in detector.tool_call("s", "multiply", "{'a': 2}")
+    assert detector.loops == 1
+
+
+def test_history_window_forgets_old_calls():
+    detector = LoopDetector(max_repeats=2, history=2)
+    detector.tool_call("s", "get_time", "UTC")
+    detector.tool_call("s", "get_time", "CST")
+    detector.tool_call("s", "get_time", "EST")
+    assert detector.tool_call("s", "get_time", "UTC") is None
+
+
+def test_end_session_clears_history():
+    detector = LoopDetector(max_repeats=2)
+    detector.tool_call("s", "multiply", "x")
+    detector.end_session("s")
+    assert detector.tool_call("s", "multiply", "x") is None
+
+
+def test_rage_click_across_sessions():
+    detector = LoopDetector(rage_threshold=3, window_seconds=60)
+    assert detector.user_input("Weather in Dallas?") is None
+    assert detector.user_input("weather  in dallas?") is None
+    assert "asked 3x" in detector.user_input("WEATHER in Dallas?")
+
+
+def test_rage_click_window_expires():
+    detector = LoopDetector(rage_threshold=2, window_seconds=0)
+    detector.user_input("hi")
+    assert detector.user_input("hi") is None
+
+
+def test_state_is_bounded():
+    detector = LoopDetector(max_sessions=2, max_inputs=2)
+    for i in range(5):
+        detector.tool_call(f"s{i}", "multiply", "x")
+        detector.user_input(f"question {i}")
+    assert len(detector._sessions) == 2 and len(detector._inputs) == 2
+
+
+# --- CALLBACK PATH ---
+
+def test_sync_run_is_aborted_before_the_tool_runs_again():
+    graph, calls = looping_agent()
+    writer = ListWriter()
+    logger = ClickHouseLogger("sess_sync", writer=writer, detector=LoopDetector(max_repeats=3))
+    with pytest.raises(LoopDetected):
+        graph.invoke({"messages": [("user", "2 times 2?")]}, config={"callbacks": [logger]})
+    assert_aborted(writer, calls, 3)
+
+
+def test_async_run_is_aborted_before_the_tool_runs_again():
+    graph, calls = looping_agent()
+    writer = AsyncListWriter()
+
+    async def run():
+        logger = AsyncClickHouseLogger("sess_async", writer=writer, detector=LoopDetector(max_repeats=3))
+        with pytest.raises(LoopDetected):
+            await graph.ainvoke({"messages": [("user", "2 times 2?")]}, config={"callbacks": [logger]})
+
+    asyncio.run(run())
+    assert_aborted(writer, calls, 3)
+
+
+def test_trace_only_mode_lets_the_run_finish():
+    graph, calls = looping_agent()
+    writer = ListWriter()
+    logger = ClickHouseLogger("sess_trace", writer=writer, detector=LoopDetector(max_repeats=3, abort=False))
+    # The ReAct agent answers on its own once it runs out of steps
+    graph.invoke({"messages": [("user", "2 times 2?")]}, config={"callbacks": [logger], "recursion_limit": 8})
+    events = writer.events()
+    assert ("loop_detected", "multiply") in events
+    assert ("run_aborted", "multiply") not in events
+    assert len(calls) == events.count(("tool_end", "multiply")) == 3
+
+
+class BrokenLLMEndWriter(AsyncListWriter):
+    """Fails on every llm_end row, like a writer bug or an unserializable payload"""
+
+    def put(self, row):
+        if row[2] == "llm_end":
+            raise ValueError("bad row")
+        super().put(row)
+
+
+def test_broken_hook_does_not_break_the_run():
+    # Only LoopDetected gets out of the hooks, even though raise_error is set for it
+    graph, calls = looping_agent()
+    writer = BrokenLLMEndWriter()
+    logger = ClickHouseLogger("sess_broken", writer=writer, detector=LoopDetector(max_repeats=3))
+    with pytest.raises(LoopDetected):
+        graph.invoke({"messages": [("user", "2 times 2?")]}, config={"callbacks": [logger]})
+    assert_aborted(writer, calls, 3)
+
+    graph, calls = looping_agent()
+    writer = BrokenLLMEndWriter()
+
+    async def run():
+        logger = AsyncClickHouseLogger("sess_broken_async", writer=writer, detector=LoopDetector(max_repeats=3))
+        with pytest.raises(LoopDetected):
+            await graph.ainvoke({"messages": [("user", "2 times 2?")]}, config={"callbacks": [logger]})
+
+    asyncio.run(run())
+    assert_aborted(writer, calls, 3)
@@ -0,0 +1,49 @@
+import clickhouse_db
+from clickhouse_db import OFFLINE_MIGRATIONS, apply_migrations
+
+
+class Result:
+    def __init__(self, rows):
+        self.result_rows = rows
+
+
+class FakeClient:
+    """Records DDL and migration bookkeeping; the server clock is fixed"""
+
+    def __init__(self):
+        self.commands = []
+        self.versions = []
+        self.steps = []
+
+    def command(self, sql, parameters=None):
+        if sql.strip().startswith("SELECT toUnixTimestamp64Milli"):
+            return 1000
+        self.commands.append(" ".join(sql.split()))
+        return 0
+
+    def query(self, sql, parameters=None):
+        if "schema_migration_steps" in sql:
+            return Result([[step, cutoff] for version, step, cutoff in self.steps if version == parameters["v"]])
+        return Result([[version] for version in self.versions])
+
+    def insert(self, table, rows, column_names=None):
+        if table == "schema_migrations":
+            self.versions += [row[0] for row in rows]
+        else:
+            self.steps += [tuple(row) for row in rows]
+
+
+def test_online_run_skips_rebuilds_but_applies_later_migrations():
+    client = FakeClient()
+    applied = apply_migrations(client, offline=False)
+    assert 4 in applied and not OFFLINE_MIGRATIONS & set(applied)
+    assert any("CREATE TABLE IF NOT EXISTS eval_failures" in sql for sql in client.commands)
+    assert not any("EXCHANGE TABLES" in sql for sql in client.commands)
+
+
+def test_offline_run_applies_the_skipped_rebuilds(monkeypatch):
+    monkeypatch.setattr(clickhouse_db.time, "sleep", lambda seconds: None)
+    client = FakeClient()
+    apply_migrations(client, offline=False)
+    assert apply_migrations(client) == sorted(OFFLINE_MIGRATIONS)
+    assert apply_migrations(client) == []
@@ -0,0 +1,97 @@
+import datetime
+import pytest
+from sinks import SpoolingSink, SpoolReplayer
+from spool import Spool, SpoolFull
+
+COLUMNS = ["timestamp", "session_id", "content"]
+
+
+class FakeClient:
+    """insert() like the ClickHouse client; fails while `down` and dedups on the token"""
+
+    def __init__(self):
+        self.down = False
+        self.rows = []
+        self.tokens = set()
+
+    def insert(self, table, data, column_names=None, column_oriented=False, settings=None):
+        if self.down:
+            raise ConnectionError("ClickHouse is down")
+        token = (settings or {}).get("insert_deduplication_token")
+        if token in self.tokens:
+            return
+        if token:
+            self.tokens.add(token)
+        self.rows.extend(zip(*data) if column_oriented else data)
+
+
+def rows(session_id, n=3):
+    now = datetime.datetime(2026, 1, 1, 12, 0, 0)
+    return [[now, session_id, f"event {i}"] for i in range(n)]
+
+
+def spooling(tmp_path, name="spool"):
+    client = FakeClient()
+    sink = SpoolingSink(client, Spool(str(tmp_path / name)), retry_interval=60)
+    return client, sink, SpoolReplayer(sink)
+
+
+def test_outage_is_spooled_and_replayed(tmp_path):
+    client, sink, replayer = spooling(tmp_path)
+    client.down = True
+    sink.insert("agent_traces", rows("a"), column_names=COLUMNS)
+    assert sink.tripped() and client.rows == []
+    # Tripped: later batches skip the backend entirely
+    sink.insert("agent_traces", rows("b"), column_names=COLUMNS)
+
+    client.down = False
+    sink.reset()
+    assert replayer.replay_once() == 6
+    assert sorted({row[1] for row in client.rows}) == ["a", "b"]
+    assert isinstance(client.rows[0][0], datetime.datetime)
+    assert sink.spool.empty()
+
+
+def test_replaying_a_segment_twice_is_deduplicated(tmp_path):
+    client, sink, replayer = spooling(tmp_path)
+    client.down = True
+    sink.insert("agent_traces", rows("a"), column_names=COLUMNS)
+    sink.spool.seal()
+    name = sink.spool.sealed()[0]
+    client.down = False
+    # A crash between the insert and the segment delete replays it again
+    replayer._replay_segment(name)
+    replayer._replay_segment(name)
+    assert len(client.rows) == 3
+
+
+def test_independent_spools_never_share_tokens(tmp_path):
+    # Both spools start at segment 0, so the same file name holds different rows
+    client = FakeClient()
+    for name, session_id in (("agent-1", "a"), ("agent-2", "b")):
+        sink = SpoolingSink(client, Spool(str(tmp_path / name)), retry_interval=60)
+        sink.trip()
+        sink.insert("agent_traces", rows(session_id), column_names=COLUMNS)
+        sink.reset()
+        SpoolReplayer(sink).replay_once()
+    assert sorted({row[1] for row in client.rows}) == ["a", "b"]
+    assert len(client.rows) == 6
+
+
+def test_drained_spool_reuses_names_without_losing_rows(tmp_path):
+    client, sink, replayer = spooling(tmp_path)
+    for session_id in ("a", "b"):
+        sink.trip()
+        sink.insert("agent_traces", rows(session_id), column_names=COLUMNS)
+        sink.reset()
+        replayer.replay_once()
+    assert len(client.rows) == 6
+
+
+def test_spool_is_capped_and_locked(tmp_path):
+    spool = Spool(str(tmp_path / "spool"), max_bytes=200)
+    with pytest.raises(SpoolFull):
+        spool.append("agent_traces", COLUMNS, rows("a", n=20))
+    with pytest.raises(RuntimeError):
+        Spool(str(tmp_path / "spool"))
+    spool.close()
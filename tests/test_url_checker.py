@@ -0,0 +1,68 @@
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from url_checker import UrlChecker, extract_urls
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """/ok: 200, /no-head: HEAD not allowed but GET works, anything else: 404"""
+
+    requests = []
+
+    def _reply(self, status):
+        StubHandler.requests.append((self.command, self.path))
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._reply({"/ok": 200, "/no-head": 405}.get(self.path, 404))
+
+    def do_GET(self):
+        self._reply(200 if self.path in ("/ok", "/no-head") else 404)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    StubHandler.requests = []
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def closed_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_head_405_falls_back_to_get(server):
+    assert UrlChecker().check([f"{server}/no-head"]) == {f"{server}/no-head": True}
+    assert StubHandler.requests == [("HEAD", "/no-head"), ("GET", "/no-head")]
+
+
+def test_status_and_connection_errors(server):
+    refused = f"http://127.0.0.1:{closed_port()}/ok"
+    results = UrlChecker(timeout=2).check([f"{server}/ok", f"{server}/missing", refused])
+    assert results == {f"{server}/ok": True, f"{server}/missing": False, refused: False}
+
+
+def test_results_are_cached_and_urls_deduplicated(server):
+    checker = UrlChecker()
+    checker.check([f"{server}/ok", f"{server}/ok"])
+    checker.check([f"{server}/ok"])
+    assert StubHandler.requests == [("HEAD", "/ok")]
+    assert (checker.checked, checker.cache_hits) == (1, 1)
+
+
+def test_score_texts_fails_any_text_with_a_broken_link(server):
+    texts = [f"See {server}/ok for details", f"Docs: {server}/ok and {server}/missing", "No links here"]
+    assert extract_urls(texts[1]) == [f"{server}/ok", f"{server}/missing"]
+    assert UrlChecker().score_texts(texts) == [1.0, 0.0, 1.0]
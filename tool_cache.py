@@ -0,0 +1,154 @@
+import functools
+import inspect
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from hashing import content_key
+
+# --- CONFIGURATION ---
+# Seconds a tool result stays valid: "inf" for pure functions, 0 = never cached.
+# Override per tool with TOOL_CACHE_TTLS="get_weather=60,multiply=inf"
+DEFAULT_TOOL_TTLS = {
+    "multiply": math.inf,   # Deterministic
+    "get_weather": 300.0,   # Changes slowly
+    "get_time": 0.0,        # Different every call
+}
+TOOL_CACHE_MAX_ENTRIES = int(os.environ.get("TOOL_CACHE_MAX_ENTRIES", "10000"))
+# Parallel tool calls per LLM turn (sample agent; LangGraph's ToolNode has its own pool)
+TOOL_MAX_WORKERS = int(os.environ.get("TOOL_MAX_WORKERS", "8"))
+
+def parse_ttls(spec):
+    ttls = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, seconds = item.partition("=")
+        ttls[name.strip()] = float(seconds)
+    return ttls
+
+TOOL_CACHE_TTLS = {**DEFAULT_TOOL_TTLS, **parse_ttls(os.environ.get("TOOL_CACHE_TTLS", ""))}
+
+
+class ToolCache:
+    """
+    Memoized tool results, keyed on (tool, arguments), with a TTL per tool.
+
+    Tools without a TTL (or with 0) always run. Only successful calls are stored,
+    with the latency of the real call so a hit can report the time it saved.
+    Least recently used entries are evicted above `max_entries`. Thread-safe.
+    """
+
+    def __init__(self, ttls=None, max_entries=TOOL_CACHE_MAX_ENTRIES):
+        self.ttls = TOOL_CACHE_TTLS if ttls is None else ttls
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, created, latency_ms)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(name, arguments):
+        return content_key(name, json.dumps(arguments, sort_keys=True, default=str))
+
+    def call(self, name, func, arguments):
+        """
+        Returns (value, hit, latency_ms): func(**arguments), or the cached value.
+        latency_ms is the real call's latency, i.e. what a hit saved.
+        """
+        ttl = self.ttls.get(name, 0)
+        if not ttl:
+            started = time.perf_counter()
+            return func(**arguments), False, int((time.perf_counter() - started) * 1000)
+
+        key = self.key(name, arguments)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] <= ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], True, entry[2]
+            self.misses += 1
+
+        started = time.perf_counter()
+        value = func(**arguments)
+        latency_ms = int((time.perf_counter() - started) * 1000)
+        with self._lock:
+            self._entries[key] = (value, time.monotonic(), latency_ms)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value, False, latency_ms
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def report_hit(name, arguments, saved_ms):
+    """
+    Tells the LangChain callbacks of the current tool run about a cache hit (the
+    ClickHouse loggers write it as a tool_cache_hit event). No-op outside a run.
+    """
+    try:
+        from langchain_core.callbacks import dispatch_custom_event
+        dispatch_custom_event("tool_cache_hit", {"tool": name, "arguments": arguments, "saved_ms": saved_ms})
+    except Exception:
+        pass  # Not inside a LangChain run (or no langchain_core): nothing to report to
+
+
+def memoized(cache=None, name=None):
+    """
+    Decorator for tool functions; put it under @tool so the tool keeps its signature:
+
+        @tool
+        @memoized()
+        def get_weather(city: str): ...
+    """
+    def decorate(func):
+        tool_name = name or func.__name__
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            value, hit, latency_ms = (cache or get_tool_cache()).call(tool_name, func, dict(bound.arguments))
+            if hit:
+                report_hit(tool_name, dict(bound.arguments), latency_ms)
+            return value
+        return wrapper
+    return decorate
+
+
+def run_parallel(calls, max_workers=TOOL_MAX_WORKERS):
+    """Runs independent zero-argument calls concurrently; results (or exceptions) in order"""
+    if len(calls) <= 1:
+        return [_capture(call) for call in calls]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(calls))) as pool:
+        return list(pool.map(_capture, calls))
+
+def _capture(call):
+    try:
+        return call()
+    except Exception as e:
+        return e
+
+
+# --- PROCESS-WIDE STATE ---
+_cache = None
+_lock = threading.Lock()
+
+def get_tool_cache():
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = ToolCache()
+    return _cache
@@ -0,0 +1,98 @@
+import asyncio
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+import aiohttp
+
+URL_PATTERN = re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
+
+
+def extract_urls(text):
+    return URL_PATTERN.findall(text)
+
+
+class UrlChecker:
+    """
+    Concurrent URL validity checks for a whole batch of answers.
+    URLs are de-duplicated across the batch, checked with pooled keep-alive
+    connections (capped in total and per host), and results are cached with
+    separate TTLs for good and broken links.
+    """
+
+    def __init__(self, timeout=3.0, max_connections=64, per_host=4, ok_ttl=3600, broken_ttl=300):
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.per_host = per_host
+        self.ok_ttl = ok_ttl
+        self.broken_ttl = broken_ttl
+        self._cache = {}  # url -> (is_ok, expires_at)
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.cache_hits = 0
+
+    def _cached(self, url):
+        with self._lock:
+            hit = self._cache.get(url)
+            if hit and hit[1] > time.monotonic():
+                self.cache_hits += 1
+                return hit[0]
+        return None
+
+    def _remember(self, url, is_ok):
+        ttl = self.ok_ttl if is_ok else self.broken_ttl
+        with self._lock:
+            self._cache[url] = (is_ok, time.monotonic() + ttl)
+            self.checked += 1
+
+    async def _check_one(self, session, host_limits, url):
+        host = urlsplit(url).netloc
+        async with host_limits.setdefault(host, asyncio.Semaphore(self.per_host)):
+            try:
+                # Head request is faster; some servers don't allow it, so fall back to GET
+                async with session.head(url, allow_redirects=True) as r:
+                    status = r.status
+                if status in (405, 501):
+                    async with session.get(url, allow_redirects=True) as r:
+                        status = r.status
+                return url, status < 400 # 4xx/5xx = Broken Link
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                return url, False # DNS/Connection Failure
+
+    async def check_async(self, urls):
+        """{url: is_ok} for every distinct URL"""
+        results = {}
+        pending = []
+        for url in dict.fromkeys(urls):
+            cached = self._cached(url)
+            if cached is None:
+                pending.append(url)
+            else:
+                results[url] = cached
+        if not pending:
+            return results
+
+        connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.per_host)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        host_limits = {}
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            for url, is_ok in await asyncio.gather(
+                *(self._check_one(session, host_limits, url) for url in pending)
+            ):
+                self._remember(url, is_ok)
+                results[url] = is_ok
+        return results
+
+    def check(self, urls):
+        """Blocking wrapper for callers outside an event loop"""
+        return asyncio.run(self.check_async(urls))
+
+    def score_texts(self, texts):
+        """
+        METRIC D for a batch: one 1.0/0.0 per text (0.0 if any URL in it is broken).
+        All URLs of the batch are checked together.
+        """
+        urls_per_text = [extract_urls(text) for text in texts]
+        all_urls = [url for urls in urls_per_text for url in urls]
+        status = self.check(all_urls) if all_urls else {}
+        return [0.0 if any(not status[url] for url in urls) else 1.0 for urls in urls_per_text]